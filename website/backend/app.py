@@ -1,16 +1,25 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, request, jsonify, session, Response, stream_with_context
 from flask_cors import CORS
+from sqlalchemy import text
 import uuid
+import json
 import sys
 import os
+import time
 from models import db, User, ChatSession, Message, Review
+from jobs import JobQueue, JobCancelled, QueueFull
+from limiter import LLMOverloaded
+from warmup import NotReady
+import metrics
+from settings.config import DATABASE_URI, JOB_WORKERS, JOB_MAX_PENDING, JOB_TTL, JOB_ABANDON_AFTER, JOB_HEARTBEAT, ADMIN_TOKEN
 
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 
 try:
-    from rag import ask, generate_hypotheses
+    from rag import ask, generate_hypotheses, ask_stream, generate_hypotheses_stream, cache_stats, llm_stats, facets, search, parse_filters, rag_warmup
+    from rag import reload_index, index_status, start_index_watcher
     RAG_AVAILABLE = True
-    print("RAG система загружена")
+    print("RAG модуль импортирован, модель и индекс загружаются в фоне")
 except ImportError as e:
     print(f"Warning: RAG module not available: {e}")
     print("Using dummy responses instead.")
@@ -19,22 +28,38 @@ except Exception as e:
     print(f"Warning: Error importing RAG module: {e}")
     RAG_AVAILABLE = False
 
+STARTED_AT = time.time()
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chatbot.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SESSION_TYPE'] = 'filesystem'
 
 db.init_app(app)
-CORS(app, origins=["http://localhost:5500", "http://127.0.0.1:5500", "http://localhost:3000", "http://127.0.0.1:3000"], supports_credentials=True)
+CORS_ORIGINS = ["http://localhost:5500", "http://127.0.0.1:5500", "http://localhost:3000", "http://127.0.0.1:3000"]
+CORS(app, origins=CORS_ORIGINS, supports_credentials=True)
+metrics.init_app(app)
 
 with app.app_context():
     db.create_all()
 
+job_queue = JobQueue(workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, ttl=JOB_TTL, abandon_after=JOB_ABANDON_AFTER)
+
+# Модель и индекс грузятся в фоне, сервер принимает запросы сразу; если они уже загружены
+# (например, в master-процессе до fork), повторной загрузки не будет.
+# Наблюдатель за faiss_index/CURRENT подхватывает новые версии индекса без перезапуска
+if RAG_AVAILABLE:
+    rag_warmup.start()
+    start_index_watcher()
+
 def get_or_create_user():
     user_id = request.headers.get('X-User-ID')
     print(f"Получен X-User-ID из заголовков: {user_id}")
-    
+    return ensure_user(user_id)
+
+def ensure_user(user_id):
+    """Возвращает id пользователя, создавая его в БД при первом обращении"""
     if not user_id:
         user_id = str(uuid.uuid4())
         print(f"Создан новый user_id: {user_id}")
@@ -175,196 +200,486 @@ def new_chat():
         print(f"Ошибка создания чата: {e}")
         return jsonify({'error': str(e)}), 500
 
+MODE_QUESTION_GREETING = "Отлично! Вы выбрали режим **вопросов**. Теперь я буду отвечать на ваши вопросы на основе доступных знаний.\n\nЧто вы хотите узнать?"
+MODE_HYPOTHESIS_GREETING = "Отлично! Вы выбрали режим **генерации гипотез**. Я буду анализировать проблему и предлагать научно обоснованные гипотезы.\n\nОпишите проблему или тему, по которой вы хотите сгенерировать гипотезы:"
+MODE_CHOICE_PROMPT = "Вы хотите задать **вопрос** или сгенерировать **гипотезу**?\n\nПожалуйста, ответьте:\n- 'вопрос' - для получения ответов на вопросы\n- 'гипотеза' - для генерации научных гипотез"
+RAG_ERROR_RESPONSE = "Извините, произошла ошибка при обработке запроса. Пожалуйста, попробуйте ещё раз."
+HYPOTHESIS_ERROR_RESPONSE = "Извините, произошла ошибка при генерации гипотез. Попробуйте ещё раз."
+
+def update_chat_title(chat, text, reason):
+    if chat.title != "Новый чат":
+        return
+    title_text = text[:100]
+    if len(text) > 100:
+        title_text += "..."
+    chat.title = title_text.capitalize()
+    db.session.add(chat)
+    print(f"Обновлен заголовок чата {reason}: {chat.title}")
+
+def detect_mode(chat, chat_id, message):
+    """Определяет режим чата. Для сообщения с выбором режима сразу возвращает готовый ответ."""
+    if len(chat.messages) == 1:  # Это первое сообщение пользователя
+        message_lower = message.lower().strip()
+        if 'вопрос' in message_lower:
+            return 'question', MODE_QUESTION_GREETING
+        elif 'гипотез' in message_lower or 'генер' in message_lower:
+            return 'hypothesis', MODE_HYPOTHESIS_GREETING
+        return 'choice', MODE_CHOICE_PROMPT
+    
+    # Определяем режим на основе истории чата
+    # Ищем первое сообщение пользователя, чтобы определить режим
+    first_user_msg = Message.query.filter_by(
+        chat_id=chat_id, 
+        is_user=True
+    ).order_by(Message.created_at.asc()).first()
+    
+    if first_user_msg:
+        first_msg_lower = first_user_msg.content.lower().strip()
+        if 'вопрос' in first_msg_lower:
+            return 'question', None
+        elif 'гипотез' in first_msg_lower or 'генер' in first_msg_lower:
+            return 'hypothesis', None
+        # Если первое сообщение не выбор режима, то это второе сообщение (вопрос/проблема)
+        # ОБНОВЛЯЕМ ЗАГОЛОВОК ЧАТА НА ОСНОВЕ ЭТОГО СООБЩЕНИЯ
+        update_chat_title(chat, first_msg_lower, "на основе вопроса")
+    return None, None
+
+def format_hypotheses(message, final_hypotheses, docs):
+    bot_response = f"## Сгенерированные гипотезы\n\n"
+    bot_response += f"**Проблема:** {message}\n\n"
+    bot_response += f"**На основе источников:**\n"
+    for i, doc in enumerate(docs[:3], 1):
+        bot_response += f"{i}. {doc.metadata.get('title', 'Без названия')}\n"
+    bot_response += f"\n**Гипотезы:**\n\n{final_hypotheses}"
+    return bot_response
+
+def with_attachments(bot_response, attachments, separator="\n\n "):
+    if not attachments:
+        return bot_response
+    file_names = ', '.join([att.get('name', '') for att in attachments])
+    return f"{bot_response}{separator}Прикреплённые файлы: {file_names}"
+
+def begin_message(data, user_id):
+    """Общая часть send_message и send_message_stream: проверка, сохранение сообщения пользователя"""
+    chat_id = data.get('chat_id')
+    message = data.get('message')
+    attachments = data.get('attachments', [])
+    filters = data.get('filters')
+    
+    print(f"Получено сообщение: chat_id={chat_id}, user_id={user_id}, message={(message or '')[:50]}...")
+    
+    if not chat_id or not message:
+        return None, ({'error': 'Missing chat_id or message'}, 400)
+    
+    if RAG_AVAILABLE:
+        try:
+            filters = parse_filters(filters)
+        except ValueError as e:
+            return None, ({'error': str(e)}, 400)
+    
+    chat = ChatSession.query.filter_by(id=chat_id, user_id=user_id).first()
+    if not chat:
+        print(f"Чат не найден: chat_id={chat_id}, user_id={user_id}")
+        return None, ({'error': 'Chat not found or access denied'}, 404)
+    
+    print(f"Чат найден: {chat.title}")
+    
+    user_message = Message(
+        chat_id=chat_id, 
+        content=message, 
+        is_user=True,
+        attachments=str(attachments) if attachments else None
+    )
+    db.session.add(user_message)
+    
+    # ОБНОВЛЯЕМ ЗАГОЛОВОК ЧАТА ТОЛЬКО КОГДА ЭТО ПЕРВОЕ СООБЩЕНИЕ С ВЫБОРОМ РЕЖИМА
+    if len(chat.messages) == 0:
+        # Для первого сообщения оставляем заголовок "Новый чат"
+        chat.title = "Новый чат"
+        db.session.add(chat)
+        print(f"Установлен заголовок чата: {chat.title}")
+    
+    db.session.flush()
+    
+    return {
+        'chat': chat,
+        'chat_id': chat_id,
+        'message': message,
+        'attachments': attachments,
+        'filters': filters,
+        'user_message': user_message,
+    }, None
+
+def finish_message(ctx, bot_response, mode):
+    """Сохраняет ответ бота и формирует тело ответа API"""
+    chat, user_message = ctx['chat'], ctx['user_message']
+    bot_message = Message(
+        chat_id=ctx['chat_id'], 
+        content=bot_response, 
+        is_user=False
+    )
+    db.session.add(bot_message)
+    
+    with metrics.stage("db_commit", mode=mode):
+        db.session.commit()
+    
+    print(f"Сообщение сохранено в БД: user_msg_id={user_message.id}, bot_msg_id={bot_message.id}, mode={mode}, chat_title={chat.title}")
+    
+    return {
+        'user_message': {
+            'id': user_message.id,
+            'content': ctx['message'],
+            'is_user': True,
+            'created_at': user_message.created_at.isoformat(),
+            'attachments': ctx['attachments']
+        },
+        'bot_response': {
+            'id': bot_message.id,
+            'content': bot_response,
+            'is_user': False,
+            'created_at': bot_message.created_at.isoformat()
+        },
+        'chat_id': ctx['chat_id'],
+        'mode': mode,
+        'chat_title': chat.title  # Добавляем обновленный заголовок в ответ
+    }
+
 @app.route('/api/send_message', methods=['POST'])
 def send_message():
     try:
         user_id = get_or_create_user()
-        data = request.json
-        
-        chat_id = data.get('chat_id')
-        message = data.get('message')
-        attachments = data.get('attachments', [])
-        
-        print(f"Получено сообщение: chat_id={chat_id}, user_id={user_id}, message={message[:50]}...")
-        
-        if not chat_id or not message:
-            return jsonify({'error': 'Missing chat_id or message'}), 400
-        
-        chat = ChatSession.query.filter_by(id=chat_id, user_id=user_id).first()
-        if not chat:
-            print(f"Чат не найден: chat_id={chat_id}, user_id={user_id}")
-            return jsonify({'error': 'Chat not found or access denied'}), 404
-        
-        print(f"Чат найден: {chat.title}")
-        
-        user_message = Message(
-            chat_id=chat_id, 
-            content=message, 
-            is_user=True,
-            attachments=str(attachments) if attachments else None
-        )
-        db.session.add(user_message)
-        
-        # ОБНОВЛЯЕМ ЗАГОЛОВОК ЧАТА ТОЛЬКО КОГДА ЭТО ПЕРВОЕ СООБЩЕНИЕ С ВЫБОРОМ РЕЖИМА
-        if len(chat.messages) == 0:
-            # Для первого сообщения оставляем заголовок "Новый чат"
-            chat.title = "Новый чат"
-            db.session.add(chat)
-            print(f"Установлен заголовок чата: {chat.title}")
-        
-        db.session.flush()
+        ctx, error = begin_message(request.json, user_id)
+        if error:
+            return error
         
+        chat, message, attachments, filters = ctx['chat'], ctx['message'], ctx['attachments'], ctx['filters']
         bot_response = ""
         mode = None
         
         try:
-            # Проверяем, нужно ли определять режим работы
-            if len(chat.messages) == 1:  # Это первое сообщение пользователя
-                message_lower = message.lower().strip()
-                
-                if 'вопрос' in message_lower:
-                    mode = 'question'
-                    bot_response = "Отлично! Вы выбрали режим **вопросов**. Теперь я буду отвечать на ваши вопросы на основе доступных знаний.\n\nЧто вы хотите узнать?"
-                
-                elif 'гипотез' in message_lower or 'генер' in message_lower:
-                    mode = 'hypothesis'
-                    bot_response = "Отлично! Вы выбрали режим **генерации гипотез**. Я буду анализировать проблему и предлагать научно обоснованные гипотезы.\n\nОпишите проблему или тему, по которой вы хотите сгенерировать гипотезы:"
-                
-                else:
-                    mode = 'choice'
-                    bot_response = "Вы хотите задать **вопрос** или сгенерировать **гипотезу**?\n\nПожалуйста, ответьте:\n- 'вопрос' - для получения ответов на вопросы\n- 'гипотеза' - для генерации научных гипотез"
-            
-            else:
-                # Определяем режим на основе истории чата
-                # Ищем первое сообщение пользователя, чтобы определить режим
-                first_user_msg = Message.query.filter_by(
-                    chat_id=chat_id, 
-                    is_user=True
-                ).order_by(Message.created_at.asc()).first()
-                
-                if first_user_msg:
-                    first_msg_lower = first_user_msg.content.lower().strip()
-                    if 'вопрос' in first_msg_lower:
-                        mode = 'question'
-                    elif 'гипотез' in first_msg_lower or 'генер' in first_msg_lower:
-                        mode = 'hypothesis'
-                    else:
-                        # Если первое сообщение не выбор режима, то это второе сообщение (вопрос/проблема)
-                        # ОБНОВЛЯЕМ ЗАГОЛОВОК ЧАТА НА ОСНОВЕ ЭТОГО СООБЩЕНИЯ
-                        if chat.title == "Новый чат":
-                            # Обрезаем слишком длинные сообщения для заголовка
-                            title_text = first_msg_lower[:100]
-                            if len(first_msg_lower) > 100:
-                                title_text += "..."
-                            chat.title = title_text.capitalize()
-                            db.session.add(chat)
-                            print(f"Обновлен заголовок чата на основе вопроса: {chat.title}")
-                
+            mode, bot_response = detect_mode(chat, ctx['chat_id'], message)
+
+            if bot_response is None and mode in ('question', 'hypothesis') and RAG_AVAILABLE:
+                not_ready = warmup_response()
+                if not_ready:
+                    db.session.rollback()
+                    return not_ready
+
+            if bot_response is None:
                 # Если режим определен, обрабатываем запрос
                 if mode == 'question' and RAG_AVAILABLE:
                     print(f"Обработка вопроса: {message[:100]}...")
-                    bot_response = ask(message)
+                    bot_response = ask(message, filters=filters)
                     print(f"Получен ответ от RAG ({len(bot_response)} символов)")
                     
                     # ОБНОВЛЯЕМ ЗАГОЛОВОК ДЛЯ РЕЖИМА ВОПРОСОВ
-                    if chat.title == "Новый чат":
-                        title_text = message[:100]
-                        if len(message) > 100:
-                            title_text += "..."
-                        chat.title = title_text.capitalize()
-                        db.session.add(chat)
-                        print(f"Обновлен заголовок чата для вопроса: {chat.title}")
+                    update_chat_title(chat, message, "для вопроса")
                 
                 elif mode == 'hypothesis' and RAG_AVAILABLE:
                     print(f"Генерация гипотез для: {message[:100]}...")
                     try:
-                        final_hypotheses, raw_hypotheses, docs = generate_hypotheses(message)
+                        final_hypotheses, raw_hypotheses, docs = generate_hypotheses(message, filters=filters)
                         
                         # Форматируем ответ
-                        bot_response = f"## Сгенерированные гипотезы\n\n"
-                        bot_response += f"**Проблема:** {message}\n\n"
-                        bot_response += f"**На основе источников:**\n"
-                        for i, doc in enumerate(docs[:3], 1):
-                            bot_response += f"{i}. {doc.metadata.get('title', 'Без названия')}\n"
-                        bot_response += f"\n**Гипотезы:**\n\n{final_hypotheses}"
+                        bot_response = format_hypotheses(message, final_hypotheses, docs)
                         
                         print(f"Сгенерировано гипотез: {len(final_hypotheses)} символов")
                         
                         # ОБНОВЛЯЕМ ЗАГОЛОВОК ДЛЯ РЕЖИМА ГИПОТЕЗ
-                        if chat.title == "Новый чат":
-                            title_text = message[:100]
-                            if len(message) > 100:
-                                title_text += "..."
-                            chat.title = title_text.capitalize()
-                            db.session.add(chat)
-                            print(f"Обновлен заголовок чата для гипотезы: {chat.title}")
+                        update_chat_title(chat, message, "для гипотезы")
                         
+                    except LLMOverloaded:
+                        raise
                     except Exception as hyp_error:
                         print(f"Ошибка генерации гипотез: {hyp_error}")
-                        bot_response = f"Извините, произошла ошибка при генерации гипотез. Попробуйте ещё раз."
+                        bot_response = HYPOTHESIS_ERROR_RESPONSE
                 
                 elif not RAG_AVAILABLE:
                     bot_response = f"Это ответ AI на сообщение: '{message}'"
                     print("RAG недоступен, использую фиктивный ответ")
                     
                     # ОБНОВЛЯЕМ ЗАГОЛОВОК ДЛЯ ФИКТИВНЫХ ОТВЕТОВ
-                    if chat.title == "Новый чат":
-                        title_text = message[:100]
-                        if len(message) > 100:
-                            title_text += "..."
-                        chat.title = title_text.capitalize()
-                        db.session.add(chat)
-                        print(f"Обновлен заголовок чата для фиктивного ответа: {chat.title}")
+                    update_chat_title(chat, message, "для фиктивного ответа")
                 
                 else:
                     bot_response = "Пожалуйста, сначала выберите режим работы. Напишите 'вопрос' или 'гипотеза'."
             
-            if attachments:
-                file_names = ', '.join([att.get('name', '') for att in attachments])
-                bot_response = f"{bot_response}\n\n Прикреплённые файлы: {file_names}"
+            bot_response = with_attachments(bot_response, attachments)
                 
+        except LLMOverloaded as e:
+            db.session.rollback()
+            print(f"LLM перегружена: {e}")
+            return overloaded_response(e, e.retry_after)
         except Exception as rag_error:
             print(f"Ошибка RAG: {rag_error}")
-            bot_response = f"Извините, произошла ошибка при обработке запроса. Пожалуйста, попробуйте ещё раз."
-            if attachments:
-                file_names = ', '.join([att.get('name', '') for att in attachments])
-                bot_response += f"\nПрикреплённые файлы: {file_names}"
-        
-        bot_message = Message(
-            chat_id=chat_id, 
-            content=bot_response, 
-            is_user=False
-        )
-        db.session.add(bot_message)
+            bot_response = with_attachments(RAG_ERROR_RESPONSE, attachments, separator="\n")
+        
+        return jsonify(finish_message(ctx, bot_response, mode)), 200
         
+    except Exception as e:
+        db.session.rollback()
+        print(f"Общая ошибка в send_message: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def hypothesis_job(job, chat_id, user_message_id, message, attachments, filters):
+    """Генерация гипотез в воркере очереди; ответ бота сохраняется в БД по завершении"""
+    events = generate_hypotheses_stream(message, filters=filters)
+    try:
+        response_text = None
+        for event in events:
+            # Отмена срабатывает между токенами: закрытие генератора обрывает стрим GigaChat
+            job.checkpoint(JOB_ABANDON_AFTER)
+            if event['event'] == 'done':
+                response_text = format_hypotheses(message, event['final'], event['docs'])
+            else:
+                job.publish(event)
+    except (JobCancelled, LLMOverloaded):
+        raise
+    except Exception as hyp_error:
+        print(f"Ошибка генерации гипотез: {hyp_error}")
+        response_text = HYPOTHESIS_ERROR_RESPONSE
+    finally:
+        events.close()
+    job.checkpoint(JOB_ABANDON_AFTER)
+    
+    return complete_message(chat_id, user_message_id, message, attachments,
+                            with_attachments(response_text, attachments), 'hypothesis', "для гипотезы")
+
+def complete_message(chat_id, user_message_id, message, attachments, bot_response, mode, title_reason=None):
+    """Сохраняет ответ бота на уже записанное сообщение пользователя вне исходного запроса"""
+    with app.app_context():
+        chat = ChatSession.query.get(chat_id)
+        if title_reason:
+            update_chat_title(chat, message, title_reason)
+        ctx = {
+            'chat': chat,
+            'chat_id': chat_id,
+            'message': message,
+            'attachments': attachments,
+            'user_message': Message.query.get(user_message_id),
+        }
+        return finish_message(ctx, bot_response, mode)
+
+def discard_user_message(user_message_id):
+    """Удаляет сообщение пользователя, на которое не будет ответа бота"""
+    with app.app_context():
+        message = Message.query.get(user_message_id)
+        if message:
+            db.session.delete(message)
+            db.session.commit()
+            print(f"Удалено сообщение без ответа: user_msg_id={user_message_id}")
+
+def submit_hypothesis_job(ctx, user_id):
+    """Сохраняет сообщение пользователя и ставит генерацию гипотез в очередь.
+    Если задачу отменят или она упадёт, сообщение удаляется, как и в asgi.py."""
+    db.session.commit()
+    user_message_id = ctx['user_message'].id
+    try:
+        job = job_queue.submit(
+            'hypothesis', hypothesis_job,
+            ctx['chat_id'], user_message_id, ctx['message'], ctx['attachments'], ctx['filters'],
+            owner=user_id, on_abort=lambda: discard_user_message(user_message_id)
+        )
+    except QueueFull:
+        db.session.delete(ctx['user_message'])
         db.session.commit()
+        raise
+    print(f"Генерация гипотез поставлена в очередь: job_id={job.id}, chat_id={ctx['chat_id']}")
+    return job
+
+def job_event_stream(job, cancel_on_disconnect=True):
+    """SSE-события задачи до её завершения; при обрыве соединения задача отменяется"""
+    job.subscribers += 1
+    cursor = 0
+    try:
+        while True:
+            events, cursor = job.events_since(cursor, timeout=JOB_HEARTBEAT)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                name = event['event']
+                if name == 'done':
+                    yield sse('done', event['result'])
+                    return
+                if name == 'failed':
+                    yield sse('error', {'error': event['error'], 'job_id': job.id})
+                    return
+                if name == 'cancelled':
+                    yield sse('cancelled', {'job_id': job.id})
+                    return
+                yield sse(name, {k: v for k, v in event.items() if k != 'event'})
+    finally:
+        job.subscribers -= 1
+        job.touch()
+        if cancel_on_disconnect and not job.finished and not job.subscribers:
+            print(f"Клиент отключился, отменяю задачу {job.id}")
+            job.cancel()
+
+def overloaded_response(e, retry_after=JOB_HEARTBEAT):
+    response = jsonify({'error': str(e), 'retry_after': retry_after})
+    response.headers['Retry-After'] = str(int(retry_after))
+    return response, 503
+
+def warmup_response():
+    """503 с Retry-After, пока модель и индекс загружаются; None, если RAG готов"""
+    try:
+        rag_warmup.require()
+    except NotReady as e:
+        return overloaded_response(e, e.retry_after)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+    return None
+
+@app.route('/api/send_message_stream', methods=['POST'])
+def send_message_stream():
+    """То же, что send_message, но ответ приходит потоком токенов (Server-Sent Events)"""
+    try:
+        user_id = get_or_create_user()
+        ctx, error = begin_message(request.json, user_id)
+        if error:
+            return error
+        
+        chat, message, attachments, filters = ctx['chat'], ctx['message'], ctx['attachments'], ctx['filters']
+        mode, bot_response = detect_mode(chat, ctx['chat_id'], message)
+        
+        if bot_response is None and mode in ('question', 'hypothesis') and RAG_AVAILABLE:
+            not_ready = warmup_response()
+            if not_ready:
+                db.session.rollback()
+                return not_ready
+        
+        # Гипотезы генерируются в фоновой очереди, поток лишь транслирует события задачи
+        job = None
+        if bot_response is None and mode == 'hypothesis' and RAG_AVAILABLE:
+            job = submit_hypothesis_job(ctx, user_id)
+    except QueueFull as e:
+        return overloaded_response(e)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Общая ошибка в send_message_stream: {e}")
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        response_text = bot_response
+        start = {'chat_id': ctx['chat_id'], 'mode': mode, 'user_message_id': ctx['user_message'].id}
+        if job is not None:
+            yield sse('start', {**start, 'job_id': job.id})
+            yield from job_event_stream(job)
+            return
+        
+        yield sse('start', start)
+        try:
+            if response_text is None and mode == 'question' and RAG_AVAILABLE:
+                print(f"Потоковая обработка вопроса: {message[:100]}...")
+                for event in ask_stream(message, filters=filters):
+                    if event['event'] == 'token':
+                        yield sse('token', {'text': event['text']})
+                    elif event['event'] == 'done':
+                        response_text = event['answer']
+                update_chat_title(chat, message, "для вопроса")
+            
+            elif response_text is None and not RAG_AVAILABLE:
+                response_text = f"Это ответ AI на сообщение: '{message}'"
+                update_chat_title(chat, message, "для фиктивного ответа")
+            
+            elif response_text is None:
+                response_text = "Пожалуйста, сначала выберите режим работы. Напишите 'вопрос' или 'гипотеза'."
+            
+            response_text = with_attachments(response_text, attachments)
+        except LLMOverloaded as e:
+            db.session.rollback()
+            print(f"LLM перегружена: {e}")
+            yield sse('error', {'error': str(e), 'retry_after': e.retry_after})
+            return
+        except Exception as rag_error:
+            print(f"Ошибка RAG: {rag_error}")
+            response_text = with_attachments(RAG_ERROR_RESPONSE, attachments, separator="\n")
         
-        print(f"Сообщение сохранено в БД: user_msg_id={user_message.id}, bot_msg_id={bot_message.id}, mode={mode}, chat_title={chat.title}")
+        try:
+            yield sse('done', finish_message(ctx, response_text, mode))
+        except Exception as e:
+            db.session.rollback()
+            print(f"Ошибка сохранения потокового ответа: {e}")
+            yield sse('error', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Ставит генерацию гипотез в очередь и сразу возвращает job_id"""
+    if not RAG_AVAILABLE:
+        return jsonify({'error': 'RAG not available'}), 503
+    not_ready = warmup_response()
+    if not_ready:
+        return not_ready
+    try:
+        user_id = get_or_create_user()
+        ctx, error = begin_message(request.json, user_id)
+        if error:
+            return error
         
-        return jsonify({
-            'user_message': {
-                'id': user_message.id,
-                'content': message,
-                'is_user': True,
-                'created_at': user_message.created_at.isoformat(),
-                'attachments': attachments
-            },
-            'bot_response': {
-                'id': bot_message.id,
-                'content': bot_response,
-                'is_user': False,
-                'created_at': bot_message.created_at.isoformat()
-            },
-            'chat_id': chat_id,
-            'mode': mode,
-            'chat_title': chat.title  # Добавляем обновленный заголовок в ответ
-        }), 200
+        mode, bot_response = detect_mode(ctx['chat'], ctx['chat_id'], ctx['message'])
+        if mode != 'hypothesis' or bot_response is not None:
+            db.session.rollback()
+            return jsonify({'error': 'Фоновые задачи доступны только для генерации гипотез, используйте /api/send_message'}), 400
         
+        job = submit_hypothesis_job(ctx, user_id)
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'chat_id': ctx['chat_id'],
+            'user_message_id': ctx['user_message'].id
+        }), 202
+    except QueueFull as e:
+        return overloaded_response(e)
     except Exception as e:
         db.session.rollback()
-        print(f"Общая ошибка в send_message: {e}")
+        print(f"Ошибка постановки задачи: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/stats', methods=['GET'])
+def get_job_stats():
+    """Число задач по статусам"""
+    return jsonify(job_queue.stats()), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Статус и текущая стадия задачи (опрос продлевает жизнь задачи)"""
+    job = job_queue.get(job_id, owner=get_or_create_user())
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.touch()
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """Подписка на стадии и токены задачи (Server-Sent Events)"""
+    job = job_queue.get(job_id, owner=get_or_create_user())
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    cancel_on_disconnect = request.args.get('cancel_on_disconnect', '1') != '0'
+    return Response(
+        job_event_stream(job, cancel_on_disconnect=cancel_on_disconnect),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Отмена задачи в очереди или в работе"""
+    job = job_queue.cancel(job_id, owner=get_or_create_user())
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
 @app.route('/api/chat_history', methods=['GET'])
 def get_chat_history():
     try:
@@ -445,15 +760,79 @@ def get_rag_status():
     """Проверка статуса RAG-системы"""
     return jsonify({
         'rag_available': RAG_AVAILABLE,
-        'status': 'ready' if RAG_AVAILABLE else 'not_available'
+        'status': rag_warmup.status if RAG_AVAILABLE else 'not_available',
+        'warmup': rag_warmup.stats() if RAG_AVAILABLE else None
     }), 200
 
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """Счётчики попаданий/промахов кэша ответов RAG"""
+    if not RAG_AVAILABLE:
+        return jsonify({'error': 'RAG not available'}), 503
+    return jsonify(cache_stats()), 200
+
+@app.route('/api/llm_stats', methods=['GET'])
+def get_llm_stats():
+    """Переиспользование соединений и попадания в кэш токена GigaChat"""
+    if not RAG_AVAILABLE:
+        return jsonify({'error': 'RAG not available'}), 503
+    return jsonify(llm_stats()), 200
+
+def filters_from_args():
+    """Фильтры из query-параметров: year_from, year_to и повторяющиеся country/source/type"""
+    raw_filters = {}
+    for key in ('year_from', 'year_to'):
+        if request.args.get(key):
+            raw_filters[key] = request.args.get(key)
+    for key in ('country', 'source', 'type'):
+        values = request.args.getlist(key)
+        if values:
+            raw_filters[key] = values
+    return raw_filters
+
+@app.route('/api/facets', methods=['GET'])
+def get_facets():
+    """Количество чанков по годам, странам, источникам и типам (с учётом фильтров)"""
+    if not RAG_AVAILABLE:
+        return jsonify({'error': 'RAG not available'}), 503
+    not_ready = warmup_response()
+    if not_ready:
+        return not_ready
+    
+    try:
+        limit = int(request.args.get('limit', 50))
+        return jsonify(facets(filters_from_args(), limit=limit)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/search', methods=['GET'])
+def search_sources():
+    """Поиск источников без LLM: ранжированные фрагменты с оценками и подсветкой"""
+    if not RAG_AVAILABLE:
+        return jsonify({'error': 'RAG not available'}), 503
+    not_ready = warmup_response()
+    if not_ready:
+        return not_ready
+    
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'Missing q'}), 400
+    
+    try:
+        k = int(request.args.get('k', 10))
+        return jsonify(search(query, k=k, filters=filters_from_args())), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/api/test_rag', methods=['POST'])
 def test_rag():
     """Тестовый endpoint для проверки RAG"""
     try:
         if not RAG_AVAILABLE:
             return jsonify({'error': 'RAG not available'}), 503
+        not_ready = warmup_response()
+        if not_ready:
+            return not_ready
         
         data = request.json
         test_message = data.get('message', 'Привет')
@@ -474,6 +853,36 @@ def test_rag():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def admin_allowed():
+    """Админ-маршруты: с ADMIN_TOKEN — по заголовку X-Admin-Token, без него — только с localhost"""
+    if ADMIN_TOKEN:
+        return request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/api/admin/index', methods=['GET'])
+def get_index_status():
+    """Загруженная и опубликованная версии индекса, список версий, состояние перезагрузки"""
+    if not admin_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    if not RAG_AVAILABLE:
+        return jsonify({'error': 'RAG not available'}), 503
+    return jsonify(index_status()), 200
+
+@app.route('/api/admin/reload_index', methods=['POST'])
+def post_reload_index():
+    """Загрузить версию индекса в фоне и переключиться на неё; без version — версию из CURRENT"""
+    if not admin_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    if not RAG_AVAILABLE:
+        return jsonify({'error': 'RAG not available'}), 503
+    not_ready = warmup_response()
+    if not_ready:
+        return not_ready
+    
+    data = request.get_json(silent=True) or {}
+    job = reload_index(data.get('version'))
+    return jsonify(job.stats()), 202
+
 @app.route('/api/debug/user', methods=['GET'])
 def debug_user():
     """Отладочный endpoint для проверки пользователя"""
@@ -495,15 +904,49 @@ def debug_chats():
         'chats': [{'id': c.id, 'user_id': c.user_id, 'title': c.title} for c in all_chats]
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Метрики в формате Prometheus: стадии RAG, вызовы GigaChat, время ответа маршрутов"""
+    if not metrics.PROMETHEUS_AVAILABLE:
+        return jsonify({'error': 'prometheus_client not installed or METRICS_ENABLED is False'}), 503
+    body, content_type = metrics.export()
+    return Response(body, content_type=content_type)
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Проверка работоспособности сервера"""
+    """Liveness: процесс жив и отвечает. Готовность к запросам — /ready"""
     return jsonify({
         'status': 'ok',
+        'uptime_seconds': round(time.time() - STARTED_AT, 1),
         'rag_available': RAG_AVAILABLE,
-        'database': 'connected'
+        'rag_status': rag_warmup.status if RAG_AVAILABLE else 'not_available'
     }), 200
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: БД отвечает и модель с индексом загружены (или RAG отключён). Иначе 503 с Retry-After"""
+    checks = {}
+    ready = True
+    try:
+        db.session.execute(text('SELECT 1'))
+        checks['database'] = 'ok'
+    except Exception as e:
+        checks['database'] = f"error: {e}"
+        ready = False
+    
+    if RAG_AVAILABLE:
+        checks['rag'] = rag_warmup.stats()
+        ready = ready and rag_warmup.ready
+    else:
+        checks['rag'] = {'status': 'not_available'}
+    
+    response = jsonify({'status': 'ready' if ready else 'not_ready', 'checks': checks})
+    if ready:
+        return response, 200
+    if RAG_AVAILABLE and rag_warmup.status == 'warming':
+        response.headers['Retry-After'] = str(int(rag_warmup.retry_after))
+    return response, 503
+
 if __name__ == '__main__':
     print("=" * 50)
     print("Запуск Flask приложения с RAG-ботом")
@@ -511,7 +954,7 @@ if __name__ == '__main__':
     print("=" * 50)
     
     if RAG_AVAILABLE:
-        print("RAG система готова к работе")
+        print("RAG система прогревается в фоне, готовность — GET /ready")
     else:
         print("RAG система не доступна, будут использоваться фиктивные ответы")
     
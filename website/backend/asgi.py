@@ -0,0 +1,212 @@
+"""ASGI-версия бэкенда.
+
+Маршруты с вызовами LLM обслуживаются асинхронно (aask / agenerate_hypotheses), поэтому
+ожидание GigaChat не держит поток. Остальные /api/* маршруты и модели SQLAlchemy — из
+Flask-приложения app.py, смонтированного через WSGIMiddleware.
+
+    uvicorn asgi:app --port 5000
+"""
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    app as flask_app, db, RAG_AVAILABLE, CORS_ORIGINS,
+    ensure_user, begin_message, detect_mode, finish_message, complete_message, discard_user_message,
+    update_chat_title, format_hypotheses, with_attachments, sse,
+    RAG_ERROR_RESPONSE, HYPOTHESIS_ERROR_RESPONSE,
+)
+from limiter import LLMOverloaded
+
+if RAG_AVAILABLE:
+    from rag import aask, agenerate_hypotheses, aask_stream, agenerate_hypotheses_stream, rag_warmup
+
+
+def _overloaded(e):
+    return JSONResponse(
+        {'error': str(e), 'retry_after': e.retry_after},
+        status_code=503,
+        headers={'Retry-After': str(int(e.retry_after))}
+    )
+
+
+def _prepare(data, user_header):
+    """Сохраняет сообщение пользователя. Если ответ не требует LLM, сразу сохраняет и его."""
+    with flask_app.app_context():
+        try:
+            user_id = ensure_user(user_header)
+            ctx, error = begin_message(data, user_id)
+            if error:
+                return None, error
+
+            mode, bot_response = detect_mode(ctx['chat'], ctx['chat_id'], ctx['message'])
+            if bot_response is None and not RAG_AVAILABLE:
+                bot_response = f"Это ответ AI на сообщение: '{ctx['message']}'"
+                update_chat_title(ctx['chat'], ctx['message'], "для фиктивного ответа")
+            elif bot_response is None and mode not in ('question', 'hypothesis'):
+                bot_response = "Пожалуйста, сначала выберите режим работы. Напишите 'вопрос' или 'гипотеза'."
+
+            if bot_response is not None:
+                result = finish_message(ctx, with_attachments(bot_response, ctx['attachments']), mode)
+                return {'mode': mode, 'result': result}, None
+
+            # Ответ LLM ждём вне контекста приложения: сообщение пользователя фиксируем сразу
+            db.session.commit()
+            return {
+                'mode': mode,
+                'result': None,
+                'chat_id': ctx['chat_id'],
+                'user_message_id': ctx['user_message'].id,
+                'message': ctx['message'],
+                'attachments': ctx['attachments'],
+                'filters': ctx['filters'],
+            }, None
+        except Exception as e:
+            db.session.rollback()
+            print(f"Общая ошибка в send_message: {e}")
+            return None, ({'error': str(e)}, 500)
+
+
+async def _not_ready(pending):
+    """Пока модель и индекс загружаются — 503 с Retry-After без обращения к RAG"""
+    if rag_warmup.ready:
+        return None
+    await run_in_threadpool(discard_user_message, pending['user_message_id'])
+    try:
+        rag_warmup.require()
+    except LLMOverloaded as e:
+        return _overloaded(e)
+    except RuntimeError as e:
+        return JSONResponse({'error': str(e)}, status_code=503)
+
+
+def _complete(pending, bot_response):
+    title_reason = "для вопроса" if pending['mode'] == 'question' else "для гипотезы"
+    return complete_message(
+        pending['chat_id'], pending['user_message_id'], pending['message'], pending['attachments'],
+        with_attachments(bot_response, pending['attachments']), pending['mode'], title_reason
+    )
+
+
+async def send_message(request):
+    data = await request.json()
+    pending, error = await run_in_threadpool(_prepare, data, request.headers.get('X-User-ID'))
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+    if pending['result'] is not None:
+        return JSONResponse(pending['result'])
+    not_ready = await _not_ready(pending)
+    if not_ready:
+        return not_ready
+
+    message, filters = pending['message'], pending['filters']
+    try:
+        if pending['mode'] == 'question':
+            print(f"Обработка вопроса: {message[:100]}...")
+            bot_response = await aask(message, filters=filters)
+        else:
+            print(f"Генерация гипотез для: {message[:100]}...")
+            try:
+                final_hypotheses, raw_hypotheses, docs = await agenerate_hypotheses(message, filters=filters)
+                bot_response = format_hypotheses(message, final_hypotheses, docs)
+            except LLMOverloaded:
+                raise
+            except Exception as hyp_error:
+                print(f"Ошибка генерации гипотез: {hyp_error}")
+                bot_response = HYPOTHESIS_ERROR_RESPONSE
+    except LLMOverloaded as e:
+        print(f"LLM перегружена: {e}")
+        await run_in_threadpool(discard_user_message, pending['user_message_id'])
+        return _overloaded(e)
+    except Exception as rag_error:
+        print(f"Ошибка RAG: {rag_error}")
+        bot_response = RAG_ERROR_RESPONSE
+
+    result = await run_in_threadpool(_complete, pending, bot_response)
+    return JSONResponse(result)
+
+
+async def send_message_stream(request):
+    """Асинхронный аналог /api/send_message_stream; при обрыве соединения стрим GigaChat отменяется"""
+    data = await request.json()
+    pending, error = await run_in_threadpool(_prepare, data, request.headers.get('X-User-ID'))
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+    if pending['result'] is None:
+        not_ready = await _not_ready(pending)
+        if not_ready:
+            return not_ready
+
+    async def generate():
+        if pending['result'] is not None:
+            result = pending['result']
+            yield sse('start', {'chat_id': result['chat_id'], 'mode': pending['mode'],
+                                'user_message_id': result['user_message']['id']})
+            yield sse('done', result)
+            return
+
+        message, filters = pending['message'], pending['filters']
+        yield sse('start', {'chat_id': pending['chat_id'], 'mode': pending['mode'],
+                            'user_message_id': pending['user_message_id']})
+        bot_response = None
+        try:
+            if pending['mode'] == 'question':
+                async for event in aask_stream(message, filters=filters):
+                    if event['event'] == 'token':
+                        yield sse('token', {'text': event['text']})
+                    elif event['event'] == 'done':
+                        bot_response = event['answer']
+            else:
+                async for event in agenerate_hypotheses_stream(message, filters=filters):
+                    if event['event'] == 'done':
+                        bot_response = format_hypotheses(message, event['final'], event['docs'])
+                    else:
+                        yield sse(event['event'], {k: v for k, v in event.items() if k != 'event'})
+        except LLMOverloaded as e:
+            print(f"LLM перегружена: {e}")
+            await run_in_threadpool(discard_user_message, pending['user_message_id'])
+            yield sse('error', {'error': str(e), 'retry_after': e.retry_after})
+            return
+        except Exception as rag_error:
+            print(f"Ошибка RAG: {rag_error}")
+            bot_response = RAG_ERROR_RESPONSE if pending['mode'] == 'question' else HYPOTHESIS_ERROR_RESPONSE
+
+        try:
+            yield sse('done', await run_in_threadpool(_complete, pending, bot_response))
+        except Exception as e:
+            print(f"Ошибка сохранения потокового ответа: {e}")
+            yield sse('error', {'error': str(e)})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+app = Starlette(
+    routes=[
+        Route('/api/send_message', send_message, methods=['POST']),
+        Route('/api/send_message_stream', send_message_stream, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=CORS_ORIGINS,
+            allow_credentials=True,
+            allow_methods=['*'],
+            allow_headers=['*'],
+        ),
+    ],
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, port=5000)
@@ -0,0 +1,8 @@
+"""Бенчмарк качества и скорости поиска по реальному корпусу.
+
+queries.jsonl — размеченные запросы: {"id", "query", "relevant": {заголовок статьи: оценка 1..2}}.
+
+    python -m benchmark.run --output runs/base.json
+    python -m benchmark.run --rebuild --index-type hnsw --output runs/hnsw.json
+    python -m benchmark.compare runs/base.json runs/hnsw.json
+"""
@@ -0,0 +1,115 @@
+"""Сравнение двух отчётов benchmark.run: метрики качества, задержки, размер и время сборки индекса.
+
+    python -m benchmark.compare runs/base.json runs/hnsw.json --max-drop 0.02
+
+С --max-drop код возврата 1, если какая-либо метрика качества упала больше порога (для CI).
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Optional
+
+LATENCY_STATS = ("p50", "p95", "p99")
+
+
+def _delta(base: Optional[float], new: Optional[float]) -> Dict:
+    row = {"base": base, "new": new}
+    if base is not None and new is not None:
+        row["delta"] = round(new - base, 4)
+        row["ratio"] = round(new / base, 3) if base else None
+    return row
+
+
+def compare(base: Dict, new: Dict, changed_threshold: float = 0.1) -> Dict:
+    quality = {
+        name: _delta(base["quality"].get(name), new["quality"].get(name))
+        for name in base["quality"] if name in new["quality"]
+    }
+    latency = {
+        stage: {stat: _delta(base["latency_ms"][stage].get(stat), new["latency_ms"][stage].get(stat))
+                for stat in LATENCY_STATS}
+        for stage in base["latency_ms"] if stage in new["latency_ms"]
+    }
+    index = {
+        key: _delta(base["index"].get(key), new["index"].get(key))
+        for key in ("size_bytes", "build_seconds", "num_vectors")
+    }
+
+    # Запросы, по которым nDCG на максимальном k заметно изменился
+    metric = f"ndcg@{max(base['config']['k'])}"
+    new_rows = {row["id"]: row for row in new["per_query"]}
+    queries = []
+    for row in base["per_query"]:
+        other = new_rows.get(row["id"])
+        if other is None or metric not in row or metric not in other:
+            continue
+        delta = other[metric] - row[metric]
+        if abs(delta) >= changed_threshold:
+            queries.append({"id": row["id"], "query": row["query"], metric: _delta(row[metric], other[metric])})
+    queries.sort(key=lambda q: q[metric]["delta"])
+
+    return {
+        "base": {"label": base.get("label"), "index": base["index"].get("index_spec"), "model": base["index"].get("model_name")},
+        "new": {"label": new.get("label"), "index": new["index"].get("index_spec"), "model": new["index"].get("model_name")},
+        "same_queries": base["config"].get("queries_file") == new["config"].get("queries_file")
+                        and base["config"].get("num_queries") == new["config"].get("num_queries"),
+        "quality": quality,
+        "latency_ms": latency,
+        "index": index,
+        "changed_queries": queries,
+    }
+
+
+def print_diff(diff: Dict):
+    print(f"База:  {diff['base']['label']} ({diff['base']['model']}, {diff['base']['index']})")
+    print(f"Новый: {diff['new']['label']} ({diff['new']['model']}, {diff['new']['index']})")
+    if not diff["same_queries"]:
+        print("ВНИМАНИЕ: прогоны сделаны на разных наборах запросов")
+    print("\nКачество:")
+    for name, row in diff["quality"].items():
+        print(f"  {name:<12} {row['base']:<8} → {row['new']:<8} ({row.get('delta', 0):+.4f})")
+    print("\nЗадержки, мс:")
+    for stage, stats in diff["latency_ms"].items():
+        cells = "  ".join(f"{stat} {row['base']} → {row['new']}" for stat, row in stats.items())
+        print(f"  {stage:<8} {cells}")
+    print("\nИндекс:")
+    for key, row in diff["index"].items():
+        print(f"  {key:<14} {row['base']} → {row['new']}")
+    if diff["changed_queries"]:
+        print("\nЗапросы с заметным изменением:")
+        for q in diff["changed_queries"]:
+            metric = next(key for key in q if key.startswith("ndcg@"))
+            print(f"  {q['id']} {q[metric]['delta']:+.3f}  {q['query'][:80]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение двух прогонов benchmark.run")
+    parser.add_argument("base", type=Path)
+    parser.add_argument("new", type=Path)
+    parser.add_argument("--output", type=Path, help="куда сохранить сравнение (JSON)")
+    parser.add_argument("--max-drop", type=float, help="допустимое падение любой метрики качества")
+    parser.add_argument("--changed-threshold", type=float, default=0.1,
+                        help="минимальное изменение nDCG запроса, чтобы показать его в списке")
+    args = parser.parse_args()
+
+    with open(args.base, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    diff = compare(base, new, args.changed_threshold)
+    print_diff(diff)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(diff, f, indent=2, ensure_ascii=False)
+
+    if args.max_drop is not None:
+        regressions = [name for name, row in diff["quality"].items() if row.get("delta", 0) < -args.max_drop]
+        if regressions:
+            print(f"\nРегрессия качества больше {args.max_drop}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import math
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+
+def article_key(title: str) -> str:
+    # build_faiss.py обрезает заголовок до 200 символов; регистр и пробелы в разметке не важны
+    return " ".join((title or "")[:200].split()).casefold()
+
+
+def article_ranking(row_ids: Iterable[int], row_keys: List[str]) -> List[str]:
+    """Ранжированные чанки → ранжированные статьи (первое вхождение каждой)."""
+    seen = []
+    for row_id in row_ids:
+        if row_id < 0:
+            continue
+        key = row_keys[row_id]
+        if key not in seen:
+            seen.append(key)
+    return seen
+
+
+def recall_at_k(ranked: List[str], relevant: Dict[str, int], k: int) -> float:
+    if not relevant:
+        return 0.0
+    return len(set(ranked[:k]) & set(relevant)) / len(relevant)
+
+
+def reciprocal_rank(ranked: List[str], relevant: Dict[str, int]) -> float:
+    for rank, key in enumerate(ranked, 1):
+        if key in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: List[str], relevant: Dict[str, int], k: int) -> float:
+    """nDCG с градуированной релевантностью: выигрыш 2^grade - 1."""
+    dcg = sum((2 ** relevant.get(key, 0) - 1) / math.log2(rank + 1) for rank, key in enumerate(ranked[:k], 1))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 1) for rank, grade in enumerate(ideal, 1))
+    return dcg / idcg if idcg else 0.0
+
+
+def latency_summary(values_ms: List[float]) -> Dict:
+    values = np.asarray(values_ms, dtype=np.float64)
+    if not len(values):
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3),
+    }
@@ -0,0 +1,265 @@
+"""Прогон размеченных запросов по индексу: recall@k, MRR, nDCG, задержки кодирования и поиска.
+
+По умолчанию загружает готовый индекс (faiss_index/). С --rebuild индекс собирается заново
+в памяти из clean.jsonl с указанной моделью и типом индекса — так сравниваются изменения
+нарезки, модели эмбеддингов и ANN-индекса до того, как их выкатывать.
+
+Релевантность размечена на уровне статей: чанки выдачи сворачиваются в статьи по заголовку.
+
+    python -m benchmark.run --output runs/base.json
+    python -m benchmark.run --rebuild --model intfloat/multilingual-e5-base --index-type hnsw --output runs/e5-base.json
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCHMARK_DIR.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+from settings.config import CHUNKS_FILE, EMBEDDING_BACKEND, HYBRID_RRF_K  # noqa: E402
+from index_factory import DEFAULT_SPECS, make_spec, build_index, apply_search_params, read_index_mmap, search_parameters  # noqa: E402
+from index_manifest import INDEX_FILE, load_manifest, load_embeddings, prefixes_for  # noqa: E402
+from index_versions import resolve_index_dir  # noqa: E402
+from docstore import SQLiteDocstore  # noqa: E402
+from metadata_filter import COLUMNS_FILE, MetadataColumns, make_selector  # noqa: E402
+from bm25 import VOCAB_FILE, BM25Index, reciprocal_rank_fusion  # noqa: E402
+from benchmark.metrics import (  # noqa: E402
+    article_key, article_ranking, recall_at_k, reciprocal_rank, ndcg_at_k, latency_summary,
+)
+
+DEFAULT_QUERIES = BENCHMARK_DIR / "queries.jsonl"
+DEFAULT_MODEL = "intfloat/multilingual-e5-large-instruct"
+
+
+def load_queries(path: Path) -> List[Dict]:
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                raw = json.loads(line)
+                raw["relevant"] = {article_key(title): int(grade) for title, grade in raw["relevant"].items()}
+                queries.append(raw)
+    return queries
+
+
+def _row_keys(docstore: SQLiteDocstore, ntotal: int, batch: int = 900) -> List[str]:
+    keys = []
+    for start in range(0, ntotal, batch):
+        docs = docstore.mget(list(range(start, min(start + batch, ntotal))))
+        # Строк-надгробий (чанки, удалённые инкрементальным обновлением) в docstore нет
+        keys.extend(article_key(docs[i].metadata.get("title", "")) if i in docs else None
+                    for i in range(start, min(start + batch, ntotal)))
+    return keys
+
+
+def load_index(index_dir: Path, backend: str, hybrid: bool) -> Dict:
+    index_dir = resolve_index_dir(index_dir)
+    manifest = load_manifest(index_dir)
+    if not manifest.get("docstore"):
+        raise SystemExit(f"Индекс {index_dir} в старом формате, сначала: python -m scripts.convert_index")
+    embeddings = load_embeddings(manifest, backend=backend)
+    index_path = index_dir / manifest.get("index_file", INDEX_FILE)
+    index = read_index_mmap(index_path)
+    apply_search_params(index, manifest.get("index_spec"))
+    row_keys = _row_keys(SQLiteDocstore(index_dir / manifest["docstore"]), index.ntotal)
+    bm25 = BM25Index.load(index_dir) if hybrid and (index_dir / VOCAB_FILE).exists() else None
+    if hybrid and bm25 is None:
+        logger.warning(f"В {index_dir} нет {VOCAB_FILE}, гибридный поиск недоступен — только dense")
+    live = MetadataColumns.load(index_dir).mask(None) if (index_dir / COLUMNS_FILE).exists() else None
+    return {
+        "index": index,
+        "embeddings": embeddings,
+        "row_keys": row_keys,
+        "bm25": bm25,
+        "live": live,
+        "info": {
+            "source": "loaded",
+            "index_dir": str(index_dir),
+            "model_name": manifest["model_name"],
+            "index_spec": manifest.get("index_spec", {"type": "flat"}),
+            "num_vectors": index.ntotal,
+            "dimension": index.d,
+            "size_bytes": index_path.stat().st_size,
+            "build_seconds": manifest.get("build_seconds"),  # нет у индексов, собранных до появления поля
+            "created_at": manifest.get("created_at"),
+        },
+    }
+
+
+def rebuild_index(chunks_file: Path, model_name: str, spec: Dict, backend: str, hybrid: bool) -> Dict:
+    import faiss
+    from scripts.build_faiss import load_chunks
+
+    documents = load_chunks(chunks_file)
+    query_prefix, passage_prefix = prefixes_for(model_name)
+    manifest = {
+        "model_name": model_name,
+        "normalize_embeddings": True,
+        "query_prefix": query_prefix,
+        "passage_prefix": passage_prefix,
+    }
+    embeddings = load_embeddings(manifest, backend=backend)
+
+    logger.info(f"Кодирование {len(documents)} чанков моделью {model_name}...")
+    t0 = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents([d.page_content for d in documents]), dtype=np.float32)
+    embed_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    index = build_index(spec, vectors)
+    index_seconds = time.perf_counter() - t0
+    return {
+        "index": index,
+        "embeddings": embeddings,
+        "row_keys": [article_key(d.metadata.get("title", "")) for d in documents],
+        "bm25": BM25Index.build(d.page_content for d in documents) if hybrid else None,
+        "info": {
+            "source": "rebuilt",
+            "chunks_file": str(chunks_file),
+            "model_name": model_name,
+            "index_spec": spec,
+            "num_vectors": index.ntotal,
+            "dimension": index.d,
+            "size_bytes": int(faiss.serialize_index(index).nbytes),
+            "build_seconds": round(embed_seconds + index_seconds, 2),
+            "embed_seconds": round(embed_seconds, 2),
+            "index_seconds": round(index_seconds, 2),
+        },
+    }
+
+
+def _search(setup: Dict, text: str, vector: np.ndarray, depth: int) -> List[int]:
+    live = setup.get("live")
+    params = search_parameters(setup["index"], make_selector(live)) if live is not None else None
+    _, ids = setup["index"].search(vector[None, :], depth, params=params)
+    dense = [int(i) for i in ids[0] if i != -1]
+    if setup["bm25"] is None:
+        return dense
+    lexical = [i for i, _ in setup["bm25"].search(text, depth, live)]
+    return [i for i, _ in reciprocal_rank_fusion([dense, lexical], k=HYBRID_RRF_K)[:depth]]
+
+
+def evaluate(setup: Dict, queries: List[Dict], ks: List[int], depth: int, warmup: int) -> Dict:
+    embeddings = setup["embeddings"]
+    known = set(setup["row_keys"])
+    unmatched = sorted({key for q in queries for key in q["relevant"] if key not in known})
+    if unmatched:
+        logger.warning(f"{len(unmatched)} размеченных статей нет в корпусе — для них recall будет 0")
+
+    for _ in range(warmup):
+        vector = np.asarray(embeddings.embed_queries([queries[0]["query"]])[0], dtype=np.float32)
+        _search(setup, queries[0]["query"], vector, depth)
+
+    encode_ms, search_ms, per_query = [], [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        vector = np.asarray(embeddings.embed_queries([q["query"]])[0], dtype=np.float32)
+        t1 = time.perf_counter()
+        ranked = article_ranking(_search(setup, q["query"], vector, depth), setup["row_keys"])
+        t2 = time.perf_counter()
+        encode_ms.append((t1 - t0) * 1000)
+        search_ms.append((t2 - t1) * 1000)
+
+        row = {"id": q["id"], "query": q["query"], "mrr": round(reciprocal_rank(ranked, q["relevant"]), 4)}
+        for k in ks:
+            row[f"recall@{k}"] = round(recall_at_k(ranked, q["relevant"], k), 4)
+            row[f"ndcg@{k}"] = round(ndcg_at_k(ranked, q["relevant"], k), 4)
+        row["relevant_ranks"] = {key: ranked.index(key) + 1 if key in ranked else None for key in q["relevant"]}
+        per_query.append(row)
+
+    metric_names = ["mrr"] + [f"{name}@{k}" for name in ("recall", "ndcg") for k in ks]
+    quality = {name: round(float(np.mean([row[name] for row in per_query])), 4) for name in metric_names}
+    return {
+        "quality": quality,
+        "latency_ms": {
+            "encode": latency_summary(encode_ms),
+            "search": latency_summary(search_ms),
+            "total": latency_summary([e + s for e, s in zip(encode_ms, search_ms)]),
+        },
+        "unmatched_labels": unmatched,
+        "per_query": per_query,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Качество и задержки поиска на размеченных запросах")
+    parser.add_argument("--queries", type=Path, default=DEFAULT_QUERIES)
+    parser.add_argument("--index-dir", type=Path, default=BACKEND_DIR / "faiss_index")
+    parser.add_argument("--rebuild", action="store_true", help="собрать индекс заново в памяти вместо загрузки")
+    parser.add_argument("--chunks", type=Path, default=CHUNKS_FILE, help="--rebuild: файл чанков")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="--rebuild: модель эмбеддингов")
+    parser.add_argument("--index-type", choices=list(DEFAULT_SPECS), default="flat", help="--rebuild: тип индекса")
+    parser.add_argument("--hnsw-m", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--ef-search", type=int)
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=EMBEDDING_BACKEND)
+    parser.add_argument("--hybrid", action="store_true", help="dense + BM25 с RRF, как rag.retrieve")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--depth-factor", type=int, default=5,
+                        help="чанков на одну статью выдачи: поиск идёт на глубину max(k) * factor")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=1, help="потоки FAISS и torch (1 — как на один запрос)")
+    parser.add_argument("--label", help="имя прогона в отчёте")
+    parser.add_argument("--output", type=Path, help="куда сохранить отчёт (JSON)")
+    args = parser.parse_args()
+
+    import faiss
+    faiss.omp_set_num_threads(args.threads)
+    if args.backend == "torch":
+        import torch
+        torch.set_num_threads(args.threads)
+
+    queries = load_queries(args.queries)
+    ks = sorted(set(args.k))
+    if args.rebuild:
+        spec = make_spec(args.index_type, M=args.hnsw_m, efConstruction=args.ef_construction,
+                         efSearch=args.ef_search, nlist=args.nlist, nprobe=args.nprobe)
+        setup = rebuild_index(args.chunks, args.model, spec, args.backend, args.hybrid)
+    else:
+        setup = load_index(args.index_dir, args.backend, args.hybrid)
+        apply_search_params(setup["index"], setup["info"]["index_spec"], ef_search=args.ef_search, nprobe=args.nprobe)
+
+    logger.info(f"Прогон {len(queries)} запросов, индекс {setup['info']['index_spec']}, {setup['info']['num_vectors']} векторов")
+    result = evaluate(setup, queries, ks, depth=max(ks) * args.depth_factor, warmup=args.warmup)
+    report = {
+        "label": args.label or (args.output.stem if args.output else None),
+        "created_at": datetime.now().isoformat(),
+        "config": {
+            "queries_file": str(args.queries),
+            "num_queries": len(queries),
+            "k": ks,
+            "depth": max(ks) * args.depth_factor,
+            "hybrid": setup["bm25"] is not None,
+            "backend": args.backend,
+            "threads": args.threads,
+        },
+        "index": setup["info"],
+        **result,
+    }
+
+    print(json.dumps({key: report[key] for key in ("index", "quality", "latency_ms")}, indent=2, ensure_ascii=False))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"Отчёт сохранён: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import html
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+VOCAB_FILE = "bm25_vocab.json"
+# Версия токенизатора в bm25_vocab.json: индекс, собранный другой версией, пересобирается
+TOKENIZER_VERSION = 2
+
+# Токены вида TiN, Al2O3, CaO-SiO2, 08Х18Н10Т, 3.5 сохраняются целиком
+TOKEN_RE = re.compile(r"[A-Za-zА-Яа-яёЁ0-9]+(?:[-./][A-Za-zА-Яа-яёЁ0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    # Все токены, включая формулы и марки стали, приводятся к одному регистру:
+    # пользователи пишут al2o3 и aisi 304l так же часто, как Al2O3 и AISI 304L
+    tokens = []
+    for match in TOKEN_RE.finditer(text or ""):
+        token = match.group().casefold()
+        tokens.append(token)
+        if "-" in token or "/" in token:
+            tokens.extend(part for part in re.split(r"[-/]", token) if len(part) > 1)
+    return tokens
+
+
+class BM25Index:
+    """Компактный инвертированный индекс BM25 (CSR: offsets / doc ids / tf), строки = id векторов FAISS.
+
+    Строки-надгробия (чанки, удалённые инкрементальным обновлением) в индекс не входят: у них нет
+    постингов, а n_docs и avgdl считаются только по живым строкам — как при полной пересборке.
+    """
+
+    def __init__(self, vocab: Dict[str, int], offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_len: np.ndarray, k1: float = 1.2, b: float = 0.75,
+                 n_docs: Optional[int] = None, avgdl: Optional[float] = None):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(doc_len) if n_docs is None else n_docs
+        if avgdl is None:
+            avgdl = float(np.mean(doc_len)) if len(doc_len) else 0.0
+        self.avgdl = avgdl
+        self._norm = (k1 * (1 - b + b * doc_len / max(self.avgdl, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], row_ids: Optional[Iterable[int]] = None, n_rows: Optional[int] = None,
+              **kwargs) -> "BM25Index":
+        """Индекс по текстам; с row_ids — только по этим строкам из n_rows (остальные — надгробия)."""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = {}
+        for doc_id, text in zip(row_ids, texts) if row_ids is not None else enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+        doc_len = np.zeros(n_rows if n_rows is not None else len(lengths), dtype=np.int32)
+        doc_len[list(lengths)] = list(lengths.values())
+        if row_ids is not None:
+            kwargs.setdefault("n_docs", len(lengths))
+            kwargs.setdefault("avgdl", float(np.mean(list(lengths.values()))) if lengths else 0.0)
+
+        vocab, offsets, doc_ids, tfs = {}, [0], [], []
+        for term_id, term in enumerate(sorted(postings)):
+            vocab[term] = term_id
+            for doc_id, tf in postings[term]:
+                doc_ids.append(doc_id)
+                tfs.append(min(tf, 65535))
+            offsets.append(len(doc_ids))
+        return cls(
+            vocab,
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(doc_ids, dtype=np.int32),
+            np.asarray(tfs, dtype=np.uint16),
+            doc_len,
+            **kwargs
+        )
+
+    def save(self, index_dir: Path):
+        index_dir = Path(index_dir)
+        np.save(index_dir / "bm25_offsets.npy", self.offsets)
+        np.save(index_dir / "bm25_doc_ids.npy", self.doc_ids)
+        np.save(index_dir / "bm25_tfs.npy", self.tfs)
+        np.save(index_dir / "bm25_doc_len.npy", self.doc_len)
+        with open(index_dir / VOCAB_FILE, "w", encoding="utf-8") as f:
+            json.dump({"tokenizer": TOKENIZER_VERSION, "k1": self.k1, "b": self.b, "n_docs": self.n_docs,
+                       "avgdl": self.avgdl, "vocab": self.vocab}, f, ensure_ascii=False)
+
+    @staticmethod
+    def is_current(index_dir: Path) -> bool:
+        """Собран ли сохранённый индекс текущей версией токенизатора."""
+        with open(Path(index_dir) / VOCAB_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get("tokenizer") == TOKENIZER_VERSION
+
+    @classmethod
+    def load(cls, index_dir: Path) -> "BM25Index":
+        index_dir = Path(index_dir)
+        with open(index_dir / VOCAB_FILE, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        return cls(
+            info["vocab"],
+            np.load(index_dir / "bm25_offsets.npy", mmap_mode="r"),
+            np.load(index_dir / "bm25_doc_ids.npy", mmap_mode="r"),
+            np.load(index_dir / "bm25_tfs.npy", mmap_mode="r"),
+            np.load(index_dir / "bm25_doc_len.npy"),
+            k1=info["k1"],
+            b=info["b"],
+            n_docs=info.get("n_docs"),
+            avgdl=info.get("avgdl"),
+        )
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.doc_len), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = np.asarray(self.doc_ids[start:end])
+            tf = np.asarray(self.tfs[start:end], dtype=np.float32)
+            df = len(docs)
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self._norm[docs])
+        if mask is not None:
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(i), float(scores[i])) for i in candidates]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+def _stem(term: str) -> str:
+    # Грубое отсечение окончаний для подсветки словоформ; формулы с цифрами и короткие слова — как есть
+    if len(term) < 6 or not term.isalpha():
+        return term
+    return term[:max(5, len(term) - 2)]
+
+
+def highlight(text: str, query: str, width: int = 300, tag: str = "mark") -> str:
+    """Фрагмент текста длиной около width с наибольшим числом слов запроса, слова обёрнуты в <tag>.
+
+    Текст экранируется как HTML, поэтому результат можно вставлять в разметку как есть.
+    """
+    stems = {_stem(t) for t in tokenize(query)}
+    matches = []
+    for match in TOKEN_RE.finditer(text or ""):
+        token = match.group().casefold()
+        if any(token == stem or (stem != token and token.startswith(stem) and len(stem) >= 5) for stem in stems):
+            matches.append(match.span())
+
+    start = 0
+    if matches:
+        best, left = 0, 0
+        for right in range(len(matches)):
+            while matches[right][1] - matches[left][0] > width:
+                left += 1
+            if right - left + 1 > best:
+                best, start = right - left + 1, matches[left][0]
+        start = max(0, start - width // 5)
+        space = text.rfind(" ", 0, start + 1)
+        start = space + 1 if space > 0 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        end = space if space > start else end
+
+    parts, position = [], start
+    for span_start, span_end in matches:
+        if span_start < start or span_end > end:
+            continue
+        parts.append(html.escape(text[position:span_start]))
+        parts.append(f"<{tag}>{html.escape(text[span_start:span_end])}</{tag}>")
+        position = span_end
+    parts.append(html.escape(text[position:end]))
+    prefix = "… " if start > 0 else ""
+    suffix = " …" if end < len(text) else ""
+    return prefix + "".join(parts).strip() + suffix
@@ -0,0 +1,156 @@
+import json
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!.… ")
+
+
+class AnswerCache:
+    """Персистентный кэш ответов RAG: точное совпадение текста + семантическое по эмбеддингу.
+
+    Хранится в SQLite (WAL), поэтому один файл разделяют все воркеры Flask.
+    """
+
+    COUNTERS = ("exact_hits", "semantic_hits", "misses", "stores", "evictions")
+
+    def __init__(self, path: Path, scope: str, ttl: int, max_entries: int, similarity: float):
+        self.path = Path(path)
+        self.scope = scope
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    mode TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    embedding BLOB,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_lru ON answers (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (mode, scope)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.executemany("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", [(c,) for c in self.COUNTERS])
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _key(self, mode: str, text: str) -> str:
+        raw = f"{mode}\x00{self.scope}\x00{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _bump(self, conn: sqlite3.Connection, counter: str, n: int = 1):
+        conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (n, counter))
+
+    def _touch(self, conn: sqlite3.Connection, key: str):
+        conn.execute("UPDATE answers SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+
+    def get(self, mode: str, text: str) -> Optional[Dict]:
+        key = self._key(mode, text)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload FROM answers WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self._touch(conn, key)
+            self._bump(conn, "exact_hits")
+        return json.loads(row[0])
+
+    def get_similar(self, mode: str, embedding: List[float]) -> Optional[Dict]:
+        query = _unit(embedding)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, embedding FROM answers WHERE mode = ? AND scope = ? AND created_at >= ? AND embedding IS NOT NULL",
+                (mode, self.scope, time.time() - self.ttl)
+            ).fetchall()
+            best_key, best_score = None, -1.0
+            if rows:
+                matrix = np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+                if matrix.shape[1] == query.shape[0]:
+                    scores = matrix @ query
+                    i = int(np.argmax(scores))
+                    best_key, best_score = rows[i][0], float(scores[i])
+            if best_key is None or best_score < self.similarity:
+                self._bump(conn, "misses")
+                return None
+            row = conn.execute("SELECT payload FROM answers WHERE key = ?", (best_key,)).fetchone()
+            if row is None:
+                self._bump(conn, "misses")
+                return None
+            self._touch(conn, best_key)
+            self._bump(conn, "semantic_hits")
+        return json.loads(row[0])
+
+    def put(self, mode: str, text: str, embedding: Optional[List[float]], payload: Dict):
+        now = time.time()
+        blob = _unit(embedding).tobytes() if embedding is not None else None
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, mode, scope, query, embedding, payload, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._key(mode, text), mode, self.scope, text, blob, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            self._bump(conn, "stores")
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        expired = conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,)).rowcount
+        total = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        overflow = total - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+        evicted = expired + max(overflow, 0)
+        if evicted:
+            self._bump(conn, "evictions", evicted)
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            counters["entries"] = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = counters["exact_hits"] + counters["semantic_hits"] + counters["misses"]
+        counters["hit_rate"] = round((counters["exact_hits"] + counters["semantic_hits"]) / lookups, 4) if lookups else 0.0
+        counters["scope"] = self.scope
+        return counters
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM answers")
+
+
+def _unit(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -0,0 +1,198 @@
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.documents import Document
+
+OVERLAP_PROBE_CHARS = 80
+CHARS_PER_TOKEN = 4.0  # оценка, если у чанка нет chunk_tokens
+MIN_TAIL_TOKENS = 80  # меньший остаток бюджета не заполняем обрезками
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _join_texts(left: str, right: str) -> str:
+    # Соседние чанки пересекаются на OVERLAP_TOKENS: ищем начало правого в хвосте левого
+    probe = right[:OVERLAP_PROBE_CHARS]
+    position = left.rfind(probe) if probe else -1
+    if position != -1:
+        return left[:position] + right
+    return left.rstrip() + " " + right.lstrip()
+
+
+def _span(doc: Document):
+    start = doc.metadata.get("start_token") or 0
+    end = doc.metadata.get("end_token") or 0
+    return start, end
+
+
+def _merge_group(docs: List[Document]) -> List[Document]:
+    """Склеивает перекрывающиеся и соседние чанки одной статьи в непрерывные фрагменты."""
+    spans = []
+    for doc in sorted(docs, key=lambda d: _span(d)[0]):
+        start, end = _span(doc)
+        last = spans[-1] if spans else None
+        if last is not None and end > start and last["end"] > last["start"] and start <= last["end"]:
+            if end > last["end"]:
+                last["text"] = _join_texts(last["text"], doc.page_content)
+                last["end"] = end
+            last["chunk_ids"].append(doc.metadata.get("chunk_id"))
+            last["rank"] = min(last["rank"], doc.metadata["_rank"])
+            last["scores"].append(doc.metadata.get("score"))
+            continue
+        spans.append({
+            "doc": doc,
+            "text": doc.page_content,
+            "start": start,
+            "end": end,
+            "chunk_ids": [doc.metadata.get("chunk_id")],
+            "rank": doc.metadata["_rank"],
+            "scores": [doc.metadata.get("score")],
+        })
+
+    merged = []
+    for span in spans:
+        metadata = {k: v for k, v in span["doc"].metadata.items() if k != "_rank"}
+        if len(span["chunk_ids"]) > 1:
+            metadata.update({
+                "start_token": span["start"],
+                "end_token": span["end"],
+                "chunk_tokens": span["end"] - span["start"],
+                "merged_chunk_ids": span["chunk_ids"],
+            })
+            scores = [score for score in span["scores"] if score is not None]
+            metadata["score"] = max(scores) if scores else None
+        metadata["_rank"] = span["rank"]
+        merged.append(Document(page_content=span["text"], metadata=metadata))
+    return merged
+
+
+def merge_chunks(docs: List[Document], max_per_article: int = 3, dedup_threshold: float = 0.85) -> List[Document]:
+    """Постобработка выдачи: склейка чанков одной статьи, лимит фрагментов на статью, удаление дублей.
+
+    Порядок результата — по рангу лучшего чанка в каждом фрагменте.
+    """
+    groups: Dict[str, List[Document]] = {}
+    for rank, doc in enumerate(docs):
+        source = doc.metadata.get("source") or doc.metadata.get("title") or f"_{rank}"
+        groups.setdefault(source, []).append(
+            Document(page_content=doc.page_content, metadata={**doc.metadata, "_rank": rank})
+        )
+
+    spans = []
+    for group in groups.values():
+        merged = sorted(_merge_group(group), key=lambda d: d.metadata["_rank"])
+        spans.extend(merged[:max_per_article])
+    spans.sort(key=lambda d: d.metadata["_rank"])
+
+    result, seen = [], []
+    for doc in spans:
+        shingles = _shingles(doc.page_content)
+        if any(_jaccard(shingles, other) >= dedup_threshold for other in seen):
+            continue
+        seen.append(shingles)
+        doc.metadata.pop("_rank", None)
+        result.append(doc)
+    return result
+
+
+@dataclass
+class PackedContext:
+    text: str
+    docs: List[Document]
+    tokens: int
+    budget: int
+    candidates: int
+    cut_by_relevance: int = 0
+    cut_by_budget: int = 0
+    truncated: int = 0
+    scores: List[Optional[float]] = field(default_factory=list)
+
+    def stats(self) -> Dict:
+        return {
+            "tokens": self.tokens,
+            "budget": self.budget,
+            "candidates": self.candidates,
+            "used": len(self.docs),
+            "cut_by_relevance": self.cut_by_relevance,
+            "cut_by_budget": self.cut_by_budget,
+            "truncated": self.truncated,
+        }
+
+
+def estimate_tokens(doc: Document, text: str = None) -> int:
+    text = doc.page_content if text is None else text
+    stored = doc.metadata.get("chunk_tokens") or 0
+    if stored and doc.page_content:
+        return max(1, round(stored * len(text) / len(doc.page_content)))
+    return max(1, round(len(text) / CHARS_PER_TOKEN))
+
+
+def relevance_cutoff(scores: List[Optional[float]], min_docs: int, cliff_gap: float, max_drop: float) -> int:
+    """Сколько документов оставить: обрываем на первом резком падении релевантности.
+
+    Документы без dense-оценки (найденные только BM25) обрыв не вызывают.
+    """
+    top, previous = None, None
+    for n, score in enumerate(scores):
+        if score is None:
+            continue
+        if top is None:
+            top, previous = score, score
+            continue
+        if n >= min_docs and (previous - score > cliff_gap or top - score > max_drop):
+            return n
+        previous = score
+    return len(scores)
+
+
+def truncate_to_sentences(doc: Document, max_tokens: int) -> Optional[str]:
+    sentences = re.split(r"(?<=[.!?])\s+", doc.page_content)
+    kept = []
+    for sentence in sentences:
+        candidate = " ".join(kept + [sentence])
+        if estimate_tokens(doc, candidate) > max_tokens:
+            break
+        kept.append(sentence)
+    return " ".join(kept) if kept else None
+
+
+def pack_context(docs: List[Document], budget: int, formatter: Callable[[int, Document, str], str],
+                 min_docs: int = 2, cliff_gap: float = 0.03, max_drop: float = 0.08) -> PackedContext:
+    """Собирает контекст промпта в пределах бюджета токенов.
+
+    Глубина выдачи определяется по распределению оценок (metadata["score"]), затем фрагменты
+    добавляются по рангу, а последний не влезающий обрезается по границе предложения.
+    """
+    scores = [doc.metadata.get("score") for doc in docs]
+    keep = relevance_cutoff(scores, min_docs, cliff_gap, max_drop)
+    packed = PackedContext(text="", docs=[], tokens=0, budget=budget, candidates=len(docs),
+                           cut_by_relevance=len(docs) - keep)
+
+    parts = []
+    for n, doc in enumerate(docs[:keep]):
+        header_tokens = estimate_tokens(doc, formatter(len(parts) + 1, doc, ""))
+        remaining = budget - packed.tokens - header_tokens
+        text = doc.page_content
+        tokens = estimate_tokens(doc)
+        if tokens > remaining:
+            text = truncate_to_sentences(doc, remaining) if remaining >= MIN_TAIL_TOKENS else None
+            if text is None:
+                packed.cut_by_budget = keep - n
+                break
+            tokens = estimate_tokens(doc, text)
+            packed.truncated += 1
+        parts.append(formatter(len(parts) + 1, doc, text))
+        packed.tokens += tokens + header_tokens
+        packed.docs.append(doc)
+        packed.scores.append(scores[n])
+
+    packed.text = "\n\n".join(parts)
+    return packed
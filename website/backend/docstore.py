@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+DOCSTORE_FILE = "docstore.sqlite3"
+
+
+def unique_chunk_rows(documents: List[Document]) -> List[int]:
+    """Позиции первых вхождений каждого chunk_id. chunk_id в docstore уникален, повторы отбрасываются."""
+    seen, rows = set(), []
+    for i, doc in enumerate(documents):
+        chunk_id = doc.metadata.get("chunk_id", str(i))
+        if chunk_id not in seen:
+            seen.add(chunk_id)
+            rows.append(i)
+    if len(rows) < len(documents):
+        logger.warning(f"Повторяющихся chunk_id: {len(documents) - len(rows)}, оставлены первые вхождения")
+    return rows
+
+
+def dedup_chunks(documents: List[Document]) -> List[Document]:
+    return [documents[i] for i in unique_chunk_rows(documents)]
+
+
+def write_docstore(path: Path, documents: Iterable[Document], row_ids: Optional[Iterable[int]] = None):
+    """Сохраняет тексты и метаданные чанков; row_id совпадает с номером вектора в FAISS.
+
+    Без row_ids строки идут подряд с 0; с row_ids пропущенные номера становятся надгробиями.
+    """
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    conn = sqlite3.connect(str(path))
+    try:
+        with conn:
+            conn.execute("""
+                CREATE TABLE chunks (
+                    row_id INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )
+            """)
+            _insert(conn, zip(row_ids, documents) if row_ids is not None else enumerate(documents))
+            conn.execute("CREATE UNIQUE INDEX chunks_chunk_id ON chunks (chunk_id)")
+    finally:
+        conn.close()
+
+
+def _insert(conn: sqlite3.Connection, rows: Iterable[Tuple[int, Document]]):
+    conn.executemany(
+        "INSERT INTO chunks (row_id, chunk_id, text, metadata) VALUES (?, ?, ?, ?)",
+        (
+            (i, doc.metadata.get("chunk_id", str(i)), doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+            for i, doc in rows
+        )
+    )
+
+
+def update_docstore(path: Path, deleted_row_ids: Iterable[int], documents: Iterable[Document], start_row: int):
+    """Инкрементальное обновление копии docstore: удаляет строки надгробий, новые чанки дописывает с row_id от start_row."""
+    conn = sqlite3.connect(str(path))
+    try:
+        with conn:
+            conn.executemany("DELETE FROM chunks WHERE row_id = ?", ((int(i),) for i in deleted_row_ids))
+            _insert(conn, enumerate(documents, start_row))
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+class SQLiteDocstore:
+    """Docstore для langchain FAISS без pickle: чанки читаются с диска только для найденных top-k.
+
+    Файл открывается только на чтение, у каждого потока своё соединение.
+    Соединения не переходят через fork: в дочернем процессе открываются заново.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(self.path)
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(f"file:{self.path.as_posix()}?mode=ro", uri=True)
+            conn.execute("PRAGMA query_only = ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _to_document(row) -> Document:
+        chunk_id, text, metadata = row
+        return Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+
+    def search(self, search: str) -> Union[Document, str]:
+        row = self._conn().execute(
+            "SELECT chunk_id, text, metadata FROM chunks WHERE row_id = ?", (int(search),)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return self._to_document(row)
+
+    def mget(self, row_ids: List[int]) -> Dict[int, Document]:
+        if not row_ids:
+            return {}
+        unique = sorted(set(int(i) for i in row_ids))
+        placeholders = ",".join("?" * len(unique))
+        rows = self._conn().execute(
+            f"SELECT row_id, chunk_id, text, metadata FROM chunks WHERE row_id IN ({placeholders})", unique
+        ).fetchall()
+        return {row[0]: self._to_document(row[1:]) for row in rows}
+
+    def iter_rows(self, batch: int = 1000) -> Iterator[Tuple[int, Document]]:
+        """Все чанки по возрастанию row_id; строк надгробий в docstore нет."""
+        cursor = self._conn().execute("SELECT row_id, chunk_id, text, metadata FROM chunks ORDER BY row_id")
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], self._to_document(row[1:])
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        """Закрывает соединение текущего потока (перед перезаписью файла)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RowIdMap(Mapping):
+    """index_to_docstore_id для langchain FAISS без хранения словаря на каждый вектор."""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __getitem__(self, i):
+        if not 0 <= int(i) < self.size:
+            raise KeyError(i)
+        return str(int(i))
+
+    def __iter__(self):
+        return iter(range(self.size))
+
+    def __len__(self):
+        return self.size
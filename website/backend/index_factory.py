@@ -0,0 +1,99 @@
+import logging
+import math
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPECS = {
+    "flat": {"type": "flat"},
+    "hnsw": {"type": "hnsw", "M": 32, "efConstruction": 200, "efSearch": 64},
+    "ivf": {"type": "ivf", "nlist": None, "nprobe": 8},
+}
+
+
+def make_spec(index_type: str = "flat", **params) -> Dict:
+    if index_type not in DEFAULT_SPECS:
+        raise ValueError(f"Неизвестный тип индекса: {index_type}. Доступны: {', '.join(DEFAULT_SPECS)}")
+    spec = dict(DEFAULT_SPECS[index_type])
+    spec.update({k: v for k, v in params.items() if v is not None and k in spec})
+    return spec
+
+
+def default_nlist(n: int) -> int:
+    # ~4*sqrt(N) списков, но не больше чем N/39 — иначе k-means обучается на слишком малой выборке
+    return max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+
+
+def build_index(spec: Dict, vectors: np.ndarray):
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    kind = spec["type"]
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, spec["M"])
+        index.hnsw.efConstruction = spec["efConstruction"]
+    elif kind == "ivf":
+        if not spec.get("nlist"):
+            spec["nlist"] = default_nlist(n)
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, spec["nlist"])
+        index.train(vectors)
+    else:
+        raise ValueError(f"Неизвестный тип индекса: {kind}")
+    index.add(vectors)
+    apply_search_params(index, spec)
+    return index
+
+
+def apply_search_params(index, spec: Optional[Dict], ef_search: int = None, nprobe: int = None):
+    """Выставляет параметры поиска (efSearch / nprobe) из спецификации индекса или явных значений."""
+    import faiss
+
+    spec = spec or {"type": "flat"}
+    if spec["type"] == "hnsw":
+        hnsw_index = faiss.downcast_index(index)
+        value = ef_search or spec.get("efSearch")
+        if value and hasattr(hnsw_index, "hnsw"):
+            hnsw_index.hnsw.efSearch = int(value)
+            logger.info(f"HNSW efSearch = {value}")
+    elif spec["type"] == "ivf":
+        value = nprobe or spec.get("nprobe")
+        if value:
+            faiss.extract_index_ivf(index).nprobe = int(value)
+            logger.info(f"IVF nprobe = {value}")
+
+
+def read_index_mmap(path: Path):
+    """Открывает индекс через mmap, чтобы векторы лежали в page cache и делились между процессами."""
+    import faiss
+
+    flags = []
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        flags.append(faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    flags.append(faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    for flag in flags:
+        try:
+            return faiss.read_index(str(path), flag)
+        except RuntimeError as e:
+            logger.debug(f"mmap с флагом {flag} не поддерживается: {e}")
+    logger.warning(f"Индекс {path} не поддерживает mmap, читаю целиком в память")
+    return faiss.read_index(str(path))
+
+
+def search_parameters(index, selector):
+    """SearchParameters с ID-селектором, сохраняющие текущие efSearch / nprobe индекса."""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    downcast = faiss.downcast_index(index)
+    if hasattr(downcast, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=downcast.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
@@ -0,0 +1,118 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "index_info.json"
+INDEX_FILE = "index.faiss"
+
+# Префиксы, с которыми модели семейства e5 обучались на запросах и пассажах
+E5_INSTRUCT_TASK = "Given a question about metallurgy, retrieve relevant passages from scientific articles"
+MODEL_PREFIXES = {
+    "intfloat/multilingual-e5-large-instruct": (f"Instruct: {E5_INSTRUCT_TASK}\nQuery: ", ""),
+    "intfloat/multilingual-e5-large": ("query: ", "passage: "),
+    "intfloat/multilingual-e5-base": ("query: ", "passage: "),
+    "intfloat/multilingual-e5-small": ("query: ", "passage: "),
+}
+
+
+class IndexManifestError(RuntimeError):
+    pass
+
+
+def prefixes_for(model_name: str):
+    return MODEL_PREFIXES.get(model_name, ("", ""))
+
+
+def load_manifest(index_dir: Path) -> Dict:
+    path = Path(index_dir) / MANIFEST_FILE
+    if not path.exists():
+        raise IndexManifestError(f"Не найден манифест индекса: {path}. Пересоберите индекс скриптом build_faiss.py")
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if "model_name" not in manifest:
+        raise IndexManifestError(f"В манифесте {path} не указана модель эмбеддингов")
+
+    # Индексы, собранные до появления этих полей, строились с нормализацией и без префиксов:
+    # запросы к ним кодируются тоже без префикса, инструкция e5 появляется только с пересборкой
+    if "normalize_embeddings" not in manifest:
+        logger.warning("В манифесте нет normalize_embeddings, считаю что векторы нормализованы")
+        manifest["normalize_embeddings"] = True
+    if "query_prefix" not in manifest:
+        logger.warning("В манифесте нет query_prefix, кодирую запросы без префикса")
+        manifest["query_prefix"] = ""
+    manifest.setdefault("passage_prefix", "")
+    return manifest
+
+
+def manifest_version(manifest: Dict) -> str:
+    return f"{manifest.get('model_name', '?')}@{manifest.get('created_at', '?')}"
+
+
+class ManifestEmbeddings(Embeddings):
+    """Эмбеддинги запросов, согласованные с манифестом индекса (модель, префиксы)."""
+
+    def __init__(self, base: Embeddings, query_prefix: str = "", passage_prefix: str = ""):
+        self.base = base
+        self.query_prefix = query_prefix
+        self.passage_prefix = passage_prefix
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents([self.passage_prefix + t for t in texts])
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents([self.query_prefix + t for t in texts])
+
+
+def load_embeddings(manifest: Dict, requested_model: str = None, strict: bool = True,
+                    backend: str = "torch", onnx_dir: Path = None, onnx_quantize: bool = True,
+                    num_threads: int = None, device: str = None, batch_size: int = None) -> ManifestEmbeddings:
+    model_name = manifest["model_name"]
+    if requested_model and requested_model != model_name:
+        message = f"Запрошена модель {requested_model}, но индекс построен на {model_name}"
+        if strict:
+            raise IndexManifestError(message)
+        logger.warning(message + " — использую модель из манифеста")
+
+    if backend == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+        base = OnnxEmbeddings.from_manifest(manifest, onnx_dir, quantize=onnx_quantize, num_threads=num_threads)
+    elif backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        encode_kwargs = {"normalize_embeddings": manifest["normalize_embeddings"]}
+        if batch_size:
+            encode_kwargs["batch_size"] = batch_size
+        base = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": device} if device else {},
+            encode_kwargs=encode_kwargs
+        )
+    else:
+        raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
+    return ManifestEmbeddings(base, manifest["query_prefix"], manifest["passage_prefix"])
+
+
+def validate_index(manifest: Dict, index, embeddings: Embeddings, strict: bool = True):
+    problems = []
+    expected_dim = manifest.get("embedding_dimension")
+    if expected_dim and index.d != expected_dim:
+        problems.append(f"размерность индекса {index.d} не совпадает с манифестом ({expected_dim})")
+    query_dim = len(embeddings.embed_query("test"))
+    if query_dim != index.d:
+        problems.append(f"модель выдаёт векторы размерности {query_dim}, а индекс — {index.d}")
+    expected_count = manifest.get("num_documents")
+    if expected_count is not None and index.ntotal != expected_count:
+        problems.append(f"в индексе {index.ntotal} векторов, а в манифесте {expected_count}")
+
+    if problems:
+        message = "Индекс не соответствует манифесту: " + "; ".join(problems)
+        if strict:
+            raise IndexManifestError(message)
+        logger.warning(message)
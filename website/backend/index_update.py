@@ -0,0 +1,220 @@
+"""Инкрементальное обновление FAISS-индекса по clean.jsonl без перекодирования всего корпуса.
+
+Чанки сравниваются с текущей версией индекса по chunk_id и хешу содержимого (текст + метаданные):
+кодируются и дописываются в конец индекса только новые и изменённые. Карта chunk_id -> row_id —
+это docstore: строки удалённых чанков и старые строки изменённых из него удаляются, а их векторы
+остаются в FAISS надгробиями (tombstones.npy) и исключаются из поиска ID-селектором.
+Когда доля надгробий превышает порог, индекс уплотняется: живые векторы восстанавливаются
+из самого индекса и собираются заново, тоже без повторного кодирования.
+
+Каждое обновление пишется в новый каталог версии (index_versions.py), текущая версия не меняется.
+"""
+import hashlib
+import json
+import logging
+import shutil
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from bm25 import BM25Index
+from docstore import DOCSTORE_FILE, SQLiteDocstore, dedup_chunks, update_docstore, write_docstore
+from index_factory import build_index
+from index_manifest import INDEX_FILE, MANIFEST_FILE, IndexManifestError, load_embeddings, load_manifest
+from metadata_filter import MetadataColumns
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(doc: Document) -> str:
+    metadata = json.dumps(doc.metadata, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(f"{doc.page_content}\0{metadata}".encode("utf-8")).hexdigest()
+
+
+@dataclass
+class IndexDiff:
+    added: List[Document]
+    changed: List[Tuple[int, Document]]  # (row_id старой версии чанка, новая версия)
+    removed: List[int]  # row_id чанков, которых больше нет в clean.jsonl
+    unchanged: int
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    @property
+    def stale_rows(self) -> List[int]:
+        return self.removed + [row for row, _ in self.changed]
+
+    @property
+    def new_documents(self) -> List[Document]:
+        return self.added + [doc for _, doc in self.changed]
+
+    def summary(self) -> Dict:
+        return {
+            "added": len(self.added),
+            "changed": len(self.changed),
+            "removed": len(self.removed),
+            "unchanged": self.unchanged,
+        }
+
+
+def diff_index(docstore: SQLiteDocstore, documents: List[Document]) -> IndexDiff:
+    """Сравнивает чанки с docstore по chunk_id и хешу. Чанки без chunk_id получают id по номеру
+    строки в load_chunks, поэтому при сдвиге строк они считаются изменёнными.
+    Повторы chunk_id отбрасываются так же, как при полной сборке (первое вхождение остаётся)."""
+    existing = {doc.metadata.get("chunk_id"): (row_id, content_hash(doc)) for row_id, doc in docstore.iter_rows()}
+    added, changed, seen = [], [], set()
+    for doc in dedup_chunks(documents):
+        chunk_id = doc.metadata.get("chunk_id")
+        seen.add(chunk_id)
+        if chunk_id not in existing:
+            added.append(doc)
+        elif existing[chunk_id][1] != content_hash(doc):
+            changed.append((existing[chunk_id][0], doc))
+    removed = sorted(row_id for chunk_id, (row_id, _) in existing.items() if chunk_id not in seen)
+    return IndexDiff(added, changed, removed, unchanged=len(seen) - len(added) - len(changed))
+
+
+def _read_index(index_dir: Path, manifest: Dict):
+    import faiss
+
+    return faiss.read_index(str(index_dir / manifest.get("index_file", INDEX_FILE)))
+
+
+def build_side_tables(docstore: SQLiteDocstore, ntotal: int):
+    """Колонки метаданных и BM25 по строкам FAISS; строки без чанка в docstore — надгробия.
+
+    BM25 строится только по живым строкам, надгробия остаются в маске deleted.
+    """
+    deleted = np.ones(ntotal, dtype=bool)
+    metadatas = [{}] * ntotal
+    row_ids, texts = [], []
+    for row_id, doc in docstore.iter_rows():
+        deleted[row_id] = False
+        metadatas[row_id] = doc.metadata
+        row_ids.append(row_id)
+        texts.append(doc.page_content)
+    columns = MetadataColumns.from_metadata(metadatas)
+    columns.deleted = deleted if deleted.any() else None
+    return columns, BM25Index.build(texts, row_ids=row_ids, n_rows=ntotal)
+
+
+def _write_manifest(index_dir: Path, manifest: Dict, ntotal: int, tombstones: int, **fields):
+    manifest = dict(manifest, **fields)
+    manifest.update({
+        "num_documents": ntotal,
+        "num_tombstones": tombstones,
+        "created_at": datetime.now().isoformat(),
+    })
+    with open(index_dir / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def apply_diff(base_dir: Path, out_dir: Path, diff: IndexDiff, vectors: Optional[np.ndarray], **manifest_fields) -> Dict:
+    """Пишет в out_dir версию base_dir с дописанными векторами и надгробиями вместо устаревших строк."""
+    import faiss
+
+    manifest = load_manifest(base_dir)
+    new_documents = diff.new_documents
+    n_vectors = 0 if vectors is None else len(vectors)
+    if n_vectors != len(new_documents):
+        raise ValueError(f"Векторов {n_vectors}, а новых чанков {len(new_documents)}")
+
+    index = _read_index(base_dir, manifest)
+    start_row = index.ntotal
+    if n_vectors:
+        index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    faiss.write_index(index, str(out_dir / INDEX_FILE))
+
+    shutil.copy2(base_dir / manifest["docstore"], out_dir / DOCSTORE_FILE)
+    update_docstore(out_dir / DOCSTORE_FILE, diff.stale_rows, new_documents, start_row)
+
+    docstore = SQLiteDocstore(out_dir / DOCSTORE_FILE)
+    columns, bm25 = build_side_tables(docstore, index.ntotal)
+    docstore.close()
+    columns.save(out_dir)
+    bm25.save(out_dir)
+    tombstones = int(columns.deleted.sum()) if columns.deleted is not None else 0
+    return _write_manifest(out_dir, manifest, index.ntotal, tombstones, index_file=INDEX_FILE,
+                           docstore=DOCSTORE_FILE, **manifest_fields)
+
+
+def _reconstruct(index, row_ids: np.ndarray) -> np.ndarray:
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(np.asarray(row_ids, dtype=np.int64))
+
+
+def compact(index_dir: Path) -> Dict:
+    """Пересобирает индекс в index_dir только из живых строк: векторы берутся из индекса, row_id идут подряд."""
+    import faiss
+
+    manifest = load_manifest(index_dir)
+    index = _read_index(index_dir, manifest)
+    docstore = SQLiteDocstore(index_dir / manifest["docstore"])
+    rows = list(docstore.iter_rows())
+    docstore.close()
+    documents = [doc for _, doc in rows]
+    vectors = _reconstruct(index, [row_id for row_id, _ in rows]) if rows else np.empty((0, index.d), np.float32)
+
+    compacted = build_index(dict(manifest.get("index_spec") or {"type": "flat"}), vectors)
+    faiss.write_index(compacted, str(index_dir / INDEX_FILE))
+    write_docstore(index_dir / DOCSTORE_FILE, documents)
+    MetadataColumns.from_metadata(d.metadata for d in documents).save(index_dir)
+    BM25Index.build(d.page_content for d in documents).save(index_dir)
+    logger.info(f"Индекс уплотнён: {index.ntotal} -> {compacted.ntotal} векторов")
+    return _write_manifest(index_dir, manifest, compacted.ntotal, 0, compacted_at=datetime.now().isoformat())
+
+
+def update_index(base_dir: Path, out_dir: Path, documents: List[Document], compact_threshold: float,
+                 embeddings: Optional[Embeddings] = None, force_compact: bool = False,
+                 device: str = None, batch_size: int = None) -> Optional[Dict]:
+    """Обновляет индекс base_dir до корпуса documents, результат — в out_dir.
+
+    Возвращает статистику или None, если корпус не изменился и уплотнять нечего.
+    Модель эмбеддингов (по манифесту base_dir, на device с batch_size) загружается,
+    только если есть что кодировать.
+    """
+    started = time.perf_counter()
+    manifest = load_manifest(base_dir)
+    if not manifest.get("docstore") or not (base_dir / manifest["docstore"]).exists():
+        raise IndexManifestError(f"Индекс {base_dir} в старом формате, сначала: python -m scripts.convert_index")
+
+    docstore = SQLiteDocstore(base_dir / manifest["docstore"])
+    diff = diff_index(docstore, documents)
+    docstore.close()
+    logger.info(f"Изменения корпуса: {diff.summary()}")
+    if diff.empty and not force_compact:
+        return None
+
+    vectors, embed_seconds = None, 0.0
+    if diff.new_documents:
+        embeddings = embeddings or load_embeddings(manifest, device=device, batch_size=batch_size)
+        t0 = time.perf_counter()
+        vectors = np.asarray(embeddings.embed_documents([d.page_content for d in diff.new_documents]), dtype=np.float32)
+        embed_seconds = time.perf_counter() - t0
+        logger.info(f"Закодировано {len(vectors)} чанков за {embed_seconds:.1f} с")
+
+    stats = dict(diff.summary(), base_version=base_dir.name, embed_seconds=round(embed_seconds, 2))
+    manifest = apply_diff(base_dir, out_dir, diff, vectors, incremental=stats)
+    ratio = manifest["num_tombstones"] / max(1, manifest["num_documents"])
+    stats["tombstone_ratio"] = round(ratio, 4)
+    stats["compacted"] = force_compact or ratio > compact_threshold
+    if stats["compacted"]:
+        manifest = compact(out_dir)
+    stats.update(num_vectors=manifest["num_documents"], num_tombstones=manifest["num_tombstones"],
+                 build_seconds=round(time.perf_counter() - started, 2))
+    _write_manifest(out_dir, manifest, manifest["num_documents"], manifest["num_tombstones"],
+                    incremental=stats, build_seconds=stats["build_seconds"])
+    return stats
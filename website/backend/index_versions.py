@@ -0,0 +1,75 @@
+"""Версии индекса: faiss_index/versions/<версия>/ и файл faiss_index/CURRENT с именем активной версии.
+
+Сборка пишет новую версию в отдельный каталог и только потом атомарно переписывает CURRENT,
+поэтому бэкенд никогда не видит недописанный индекс. Индекс старой раскладки (файлы прямо
+в faiss_index/, без CURRENT) читается как раньше.
+"""
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from index_manifest import MANIFEST_FILE, IndexManifestError
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+
+def current_version(root: Path) -> Optional[str]:
+    path = Path(root) / CURRENT_FILE
+    if not path.exists():
+        return None
+    return path.read_text(encoding="utf-8").strip() or None
+
+
+def resolve_index_dir(root: Path, version: str = None) -> Path:
+    """Каталог версии (указанной или активной по CURRENT); для старой раскладки — сам root."""
+    root = Path(root)
+    version = version or current_version(root)
+    if version:
+        path = root / VERSIONS_DIR / version
+        if not (path / MANIFEST_FILE).exists():
+            raise IndexManifestError(f"Версия индекса {version} не найдена или недописана: {path}")
+        return path
+    return root
+
+
+def list_versions(root: Path) -> List[str]:
+    versions_dir = Path(root) / VERSIONS_DIR
+    if not versions_dir.exists():
+        return []
+    return sorted(p.name for p in versions_dir.iterdir() if (p / MANIFEST_FILE).exists())
+
+
+def new_version_dir(root: Path) -> Path:
+    name = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = Path(root) / VERSIONS_DIR / name
+    n = 1
+    while path.exists():
+        n += 1
+        path = Path(root) / VERSIONS_DIR / f"{name}-{n}"
+    path.mkdir(parents=True)
+    return path
+
+
+def publish(root: Path, version: str):
+    """Делает версию активной: CURRENT переписывается через os.replace, читатели видят старое или новое имя целиком."""
+    resolve_index_dir(root, version)
+    tmp = Path(root) / f"{CURRENT_FILE}.tmp"
+    tmp.write_text(version + "\n", encoding="utf-8")
+    os.replace(tmp, Path(root) / CURRENT_FILE)
+
+
+def prune(root: Path, keep: int) -> List[str]:
+    """Удаляет старые версии, кроме последних keep и активной. Воркеры, ещё читающие старую
+    версию, не пострадают только если она среди оставленных — keep меньше 2 не рекомендуется."""
+    active = current_version(root)
+    versions = list_versions(root)
+    removed = []
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version == active:
+            continue
+        shutil.rmtree(Path(root) / VERSIONS_DIR / version)
+        removed.append(version)
+    return removed
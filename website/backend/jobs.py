@@ -0,0 +1,187 @@
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    """Фоновая задача: статус, текущая стадия и журнал событий для подписчиков."""
+
+    def __init__(self, kind: str, owner: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.status = "queued"
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.last_seen = self.created_at
+        self.subscribers = 0
+        self._events: List[Dict] = []
+        self._cond = threading.Condition()
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def publish(self, event: Dict):
+        with self._cond:
+            if event.get("event") == "stage":
+                self.stage = event.get("stage")
+            self._events.append(event)
+            self._cond.notify_all()
+
+    def touch(self):
+        self.last_seen = time.time()
+
+    def cancel(self):
+        self._cancel.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def checkpoint(self, abandon_after: float = None):
+        """Вызывается воркером между шагами: прерывает работу, если задачу отменили или бросили."""
+        if abandon_after and not self.subscribers and time.time() - self.last_seen > abandon_after:
+            logger.info(f"Задача {self.id} брошена клиентом, отменяю")
+            self._cancel.set()
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def finish(self, status: str, result=None, error: str = None):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self._events.append({"event": status, "result": result, "error": error})
+            self._cond.notify_all()
+
+    def events_since(self, cursor: int, timeout: float) -> Tuple[List[Dict], int]:
+        """Новые события начиная с cursor; ждёт до timeout секунд, если их пока нет."""
+        with self._cond:
+            if cursor >= len(self._events) and not self.finished and not self.cancelled:
+                self._cond.wait(timeout)
+            events = self._events[cursor:]
+            return events, cursor + len(events)
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Очередь задач в процессе с пулом воркеров.
+
+    Задачи не переживают перезапуск процесса: клиент получает job_id и опрашивает
+    статус или подписывается на события, пока процесс жив.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32, ttl: float = 3600, abandon_after: float = 60):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.abandon_after = abandon_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable, *args, owner: str = None, on_abort: Callable = None, **kwargs) -> Job:
+        """Ставит fn(job, *args, **kwargs) в очередь; результат fn становится job.result.
+
+        on_abort() вызывается, если задача отменена (в том числе до старта) или завершилась ошибкой.
+        """
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self.max_pending:
+                raise QueueFull(f"В очереди уже {pending} задач")
+            job = Job(kind, owner)
+            self._jobs[job.id] = job
+        # Воркер продолжает контекст запроса, поставившего задачу (спаны трассировки, метки метрик)
+        self._executor.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs, on_abort)
+        logger.info(f"Задача {job.id} ({kind}) поставлена в очередь")
+        return job
+
+    def _run(self, job: Job, fn: Callable, args, kwargs, on_abort: Callable = None):
+        if job.cancelled:
+            self._abort(job, on_abort)
+            job.finish("cancelled")
+            return
+        job.status = "running"
+        started = time.time()
+        try:
+            result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            self._abort(job, on_abort)
+            job.finish("cancelled")
+            logger.info(f"Задача {job.id} отменена")
+        except Exception as e:
+            logger.exception(f"Задача {job.id} завершилась с ошибкой")
+            self._abort(job, on_abort)
+            job.finish("failed", error=str(e))
+        else:
+            job.finish("done", result=result)
+            logger.info(f"Задача {job.id} выполнена за {time.time() - started:.1f} с")
+
+    @staticmethod
+    def _abort(job: Job, on_abort: Optional[Callable]):
+        if on_abort is None:
+            return
+        try:
+            on_abort()
+        except Exception:
+            logger.exception(f"Ошибка отката задачи {job.id}")
+
+    def get(self, job_id: str, owner: str = None) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return None
+        return job
+
+    def cancel(self, job_id: str, owner: str = None) -> Optional[Job]:
+        job = self.get(job_id, owner)
+        if job is not None and not job.finished:
+            job.cancel()
+        return job
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [j.id for j in self._jobs.values() if j.finished and now - j.finished_at > self.ttl]:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {"workers": self.workers, "max_pending": self.max_pending, "jobs": statuses}
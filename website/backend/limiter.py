@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LLMOverloaded(Exception):
+    """Вызов модели не может начаться вовремя: очередь полна или истёк срок ожидания."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelLimiter:
+    """Семафор на модель с ограниченной очередью ожидания (FIFO) и сроком ожидания слота."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+        self._waits = deque(maxlen=1000)
+        self._waiters = ThreadPoolExecutor(max_workers=max_queue + 1, thread_name_prefix=f"limiter-{name}")
+
+    def acquire(self, timeout: float = None):
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.perf_counter()
+        with self._cond:
+            if self._active >= self.max_concurrent or self._waiting:
+                if timeout == 0:
+                    # Только попытка (хеджи): отказ не считается отклонением запроса
+                    raise LLMOverloaded(f"{self.name}: нет свободного слота", retry_after=0)
+                if self._waiting >= self.max_queue:
+                    self._rejected_queue_full += 1
+                    logger.warning(f"{self.name}: очередь переполнена ({self._waiting}), запрос отклонён")
+                    raise LLMOverloaded(f"{self.name} перегружена, попробуйте позже", retry_after=timeout)
+                self._waiting += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self._active < self.max_concurrent, timeout)
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self._rejected_timeout += 1
+                    logger.warning(f"{self.name}: слот не освободился за {timeout} с, запрос отклонён")
+                    raise LLMOverloaded(f"{self.name} не ответила вовремя, попробуйте позже", retry_after=timeout)
+            self._active += 1
+            self._admitted += 1
+            self._waits.append(time.perf_counter() - started)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, timeout: float = None):
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def aacquire(self, timeout: float = None):
+        # Ожидание слота в отдельном пуле (ожидающих не больше max_queue), чтобы не блокировать
+        # event loop и не занимать потоки по умолчанию; лимит общий с синхронными вызовами
+        future = self._waiters.submit(self.acquire, timeout)
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Запрос отменили, пока он ждал: слот, полученный позже, сразу возвращаем
+            future.add_done_callback(lambda f: not f.cancelled() and f.exception() is None and self.release())
+            raise
+
+    @asynccontextmanager
+    async def aslot(self, timeout: float = None):
+        await self.aacquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            waits = np.asarray(self._waits) * 1000
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected_queue_full": self._rejected_queue_full,
+                "rejected_timeout": self._rejected_timeout,
+                "wait_ms_p50": round(float(np.percentile(waits, 50)), 2) if len(waits) else None,
+                "wait_ms_p95": round(float(np.percentile(waits, 95)), 2) if len(waits) else None,
+            }
@@ -0,0 +1,363 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import gigachat
+from gigachat.models import AccessToken
+from langchain_community.chat_models import GigaChat
+from pydantic import PrivateAttr
+
+import metrics
+from limiter import ModelLimiter
+from resilience import CallPolicy, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+TOKEN_REFRESH_MARGIN = 60  # секунды: токен, истекающий раньше, считаем просроченным
+LOCK_STALE_AFTER = 30  # секунды: лок-файл старше этого остался от упавшего процесса
+LOCK_POLL_INTERVAL = 0.05
+
+
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, int] = {}
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+
+class TokenCache:
+    """OAuth-токен GigaChat в файле, общий для всех процессов и воркеров.
+
+    Запись атомарная (os.replace), обмен токена защищён лок-файлом, чтобы при
+    истечении токена его обновлял один процесс, а остальные подхватывали результат.
+    """
+
+    def __init__(self, path: Path, credentials: str, scope: str = None, auth_url: str = None):
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix(self.path.suffix + ".lock")
+        # Токены разных OAuth-серверов (например, локальной заглушки) не должны подменять друг друга
+        raw = f"{credentials}|{scope}" + (f"|{auth_url}" if auth_url else "")
+        self.key = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def load(self) -> Optional[AccessToken]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        entry = data.get(self.key)
+        if not entry:
+            return None
+        return AccessToken(access_token=entry["access_token"], expires_at=entry["expires_at"])
+
+    def save(self, token: AccessToken):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data[self.key] = {"access_token": token.access_token, "expires_at": token.expires_at}
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.path)
+
+    def discard(self, access_token: str):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get(self.key, {}).get("access_token") == access_token:
+            del data[self.key]
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+
+    def _try_lock(self, deadline: float) -> Tuple[bool, Optional[int]]:
+        """Одна попытка создать лок-файл: (взят или ждать больше нельзя, fd или None)."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            return True, os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - self.lock_path.stat().st_mtime > LOCK_STALE_AFTER:
+                self.lock_path.unlink()
+                return self._try_lock(deadline)
+        except OSError:
+            return False, None
+        if time.time() > deadline:
+            logger.warning(f"Не дождался блокировки {self.lock_path}, обновляю токен без неё")
+            return True, None
+        return False, None
+
+    def _unlock(self, fd: Optional[int]):
+        if fd is None:
+            return
+        os.close(fd)
+        try:
+            self.lock_path.unlink()
+        except OSError:
+            pass
+
+    @contextmanager
+    def lock(self, timeout: float = 10.0):
+        deadline = time.time() + timeout
+        done, fd = self._try_lock(deadline)
+        while not done:
+            time.sleep(LOCK_POLL_INTERVAL)
+            done, fd = self._try_lock(deadline)
+        try:
+            yield
+        finally:
+            self._unlock(fd)
+
+    @asynccontextmanager
+    async def alock(self, timeout: float = 10.0):
+        """lock() для корутин: ожидание не блокирует цикл событий, работа с файлом — в пуле потоков."""
+        deadline = time.time() + timeout
+        done, fd = await asyncio.to_thread(self._try_lock, deadline)
+        while not done:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            done, fd = await asyncio.to_thread(self._try_lock, deadline)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self._unlock, fd)
+
+
+def token_is_fresh(token: Optional[AccessToken]) -> bool:
+    if token is None:
+        return False
+    if not token.expires_at:
+        return True  # статический access_token из настроек, срок неизвестен
+    return token.expires_at / 1000 - time.time() > TOKEN_REFRESH_MARGIN
+
+
+class SharedTokenClient(gigachat.GigaChat):
+    """Клиент GigaChat, который берёт OAuth-токен из общего кэша и считает переиспользование соединений."""
+
+    def __init__(self, token_cache: TokenCache, counters: Counters, **kwargs):
+        super().__init__(**kwargs)
+        self._token_cache = token_cache
+        self._counters = counters
+        self._client.event_hooks["request"].append(self._on_request)
+        self._aclient.event_hooks["request"].append(self._on_arequest)
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self._counters.incr("connections_opened")
+
+    async def _atrace(self, event_name, info):
+        self._trace(event_name, info)
+
+    def _on_request(self, request):
+        self._counters.incr("requests")
+        request.extensions["trace"] = self._trace
+
+    async def _on_arequest(self, request):
+        self._counters.incr("requests")
+        request.extensions["trace"] = self._atrace
+
+    def _check_validity_token(self) -> bool:
+        return token_is_fresh(self._access_token)
+
+    def _adopt_shared_token(self) -> bool:
+        token = self._token_cache.load()
+        if token_is_fresh(token):
+            self._access_token = token
+            self._counters.incr("token_shared_hits")
+            return True
+        return False
+
+    def _reset_token(self):
+        # Токен отвергнут сервером — убираем его и из общего кэша, иначе его подхватят снова
+        if self._access_token is not None:
+            self._token_cache.discard(self._access_token.access_token)
+        super()._reset_token()
+
+    def _update_token(self):
+        if self._check_validity_token() or self._adopt_shared_token():
+            return
+        with self._token_cache.lock():
+            if self._adopt_shared_token():
+                return
+            super()._update_token()
+            self._store_token()
+
+    async def _aupdate_token(self):
+        # Чтение и запись файла токена и ожидание лок-файла — вне цикла событий: пока одна корутина
+        # получает токен, остальные запросы и стримы продолжают работать
+        if self._check_validity_token() or await asyncio.to_thread(self._adopt_shared_token):
+            return
+        async with self._token_cache.alock():
+            if await asyncio.to_thread(self._adopt_shared_token):
+                return
+            await super()._aupdate_token()
+            await asyncio.to_thread(self._store_token)
+
+    def _store_token(self):
+        if self._access_token is not None:
+            self._counters.incr("token_fetches")
+            self._token_cache.save(self._access_token)
+            logger.info("Получен новый access token GigaChat")
+
+
+class PooledGigaChat(GigaChat):
+    """GigaChat из langchain поверх долгоживущего клиента пула.
+
+    Каждый вызов занимает слот лимитера модели и идёт через CallPolicy (повторы, хеджи;
+    слоты для invoke занимает сама политика, до отправки запроса);
+    каждая попытка записывается в metrics (длительность, токены, ошибки).
+    """
+
+    _pool_client: Any = PrivateAttr(default=None)
+    _limiter: Any = PrivateAttr(default=None)
+    _policy: Any = PrivateAttr(default=None)
+
+    @property
+    def _client(self):
+        return self._pool_client
+
+    @property
+    def _profile(self) -> str:
+        return f"{self.model}@{self.temperature}"
+
+    def _generate_once(self, hedge: bool, *args, **kwargs):
+        with metrics.llm_call(self.model, "hedge" if hedge else "invoke") as call:
+            result = super()._generate(*args, **kwargs)
+            call.usage((result.llm_output or {}).get("token_usage"))
+            return result
+
+    def _generate(self, *args, **kwargs):
+        return self._policy.run(self._profile, lambda hedge: self._generate_once(hedge, *args, **kwargs), self._limiter)
+
+    def _stream_once(self, *args, **kwargs):
+        with self._limiter.slot(), metrics.llm_call(self.model, "stream") as call:
+            for chunk in super()._stream(*args, **kwargs):
+                call.chunk(chunk)
+                yield chunk
+
+    def _stream(self, *args, **kwargs):
+        yield from self._policy.retry_stream(self._profile, lambda: self._stream_once(*args, **kwargs))
+
+    async def _agenerate_once(self, hedge: bool, *args, **kwargs):
+        with metrics.llm_call(self.model, "hedge" if hedge else "invoke") as call:
+            result = await super()._agenerate(*args, **kwargs)
+            call.usage((result.llm_output or {}).get("token_usage"))
+            return result
+
+    async def _agenerate(self, *args, **kwargs):
+        return await self._policy.arun(
+            self._profile, lambda hedge: self._agenerate_once(hedge, *args, **kwargs), self._limiter
+        )
+
+    async def _astream_once(self, *args, **kwargs):
+        async with self._limiter.aslot():
+            with metrics.llm_call(self.model, "stream") as call:
+                async for chunk in super()._astream(*args, **kwargs):
+                    call.chunk(chunk)
+                    yield chunk
+
+    async def _astream(self, *args, **kwargs):
+        async for chunk in self._policy.aretry_stream(self._profile, lambda: self._astream_once(*args, **kwargs)):
+            yield chunk
+
+
+class GigaChatPool:
+    """По одному клиенту (и пулу keep-alive соединений httpx) на модель GigaChat."""
+
+    def __init__(self, credentials: str, token_file: Path, scope: str = None, timeout: float = 120,
+                 max_connections: int = 10, verify_ssl_certs: bool = False,
+                 limits: Dict[str, Dict] = None, default_limit: Dict = None, policy: CallPolicy = None,
+                 base_url: str = None, auth_url: str = None):
+        self.credentials = credentials
+        self.scope = scope
+        self.base_url = base_url
+        self.auth_url = auth_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.verify_ssl_certs = verify_ssl_certs
+        self.token_cache = TokenCache(token_file, credentials, scope, auth_url)
+        self.counters = Counters()
+        self._clients: Dict[str, SharedTokenClient] = {}
+        self._models: Dict[tuple, PooledGigaChat] = {}
+        self._lock = threading.Lock()
+        self.limits = limits or {}
+        self.default_limit = default_limit or {"max_concurrent": 4, "max_queue": 8, "queue_timeout": 10}
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self.policy = policy or CallPolicy(RetryPolicy())
+
+    def limiter(self, model: str) -> ModelLimiter:
+        with self._lock:
+            if model not in self._limiters:
+                self._limiters[model] = ModelLimiter(model, **self.limits.get(model, self.default_limit))
+            return self._limiters[model]
+
+    def client(self, model: str) -> SharedTokenClient:
+        with self._lock:
+            if model not in self._clients:
+                kwargs = {key: value for key, value in (
+                    ("scope", self.scope), ("base_url", self.base_url), ("auth_url", self.auth_url)
+                ) if value}
+                self._clients[model] = SharedTokenClient(
+                    self.token_cache, self.counters,
+                    credentials=self.credentials,
+                    model=model,
+                    timeout=self.timeout,
+                    max_connections=self.max_connections,
+                    verify_ssl_certs=self.verify_ssl_certs,
+                    **kwargs
+                )
+                logger.info(f"Создан клиент GigaChat для {model} (до {self.max_connections} соединений)")
+            return self._clients[model]
+
+    def chat_model(self, model: str, temperature: float) -> PooledGigaChat:
+        key = (model, temperature)
+        if key not in self._models:
+            llm = PooledGigaChat(model=model, temperature=temperature, timeout=self.timeout,
+                                 verify_ssl_certs=self.verify_ssl_certs)
+            llm._pool_client = self.client(model)
+            llm._limiter = self.limiter(model)
+            llm._policy = self.policy
+            self._models[key] = llm
+        return self._models[key]
+
+    def stats(self) -> Dict:
+        counters = self.counters.snapshot()
+        requests = counters.get("requests", 0)
+        opened = counters.get("connections_opened", 0)
+        fetches = counters.get("token_fetches", 0)
+        return {
+            "models": sorted(self._clients),
+            **counters,
+            "connection_reuse_rate": round(1 - opened / requests, 4) if requests else None,
+            "token_hit_rate": round(1 - fetches / requests, 4) if requests else None,
+            "limits": {model: limiter.stats() for model, limiter in self._limiters.items()},
+            "resilience": self.policy.stats(),
+        }
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._models.clear()
@@ -0,0 +1,80 @@
+"""Память процессов сервера по /proc (Linux): сколько страниц воркеры делят с master после fork.
+
+RSS считает общие страницы в каждом процессе, PSS делит их между процессами поровну.
+Сумма RSS минус сумма PSS — сколько памяти сэкономлено по сравнению с отдельной копией на процесс.
+"""
+from pathlib import Path
+from typing import Dict, List
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def smaps(pid: int) -> Dict[str, int]:
+    """Поля smaps_rollup в кБ; на старых ядрах без smaps_rollup — сумма по smaps."""
+    proc = Path("/proc") / str(pid)
+    path = proc / "smaps_rollup"
+    if not path.exists():
+        path = proc / "smaps"
+    totals = dict.fromkeys(FIELDS, 0)
+    with open(path, "r") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in totals:
+                totals[key] += int(rest.split()[0])
+    return totals
+
+
+def children(pid: int) -> List[int]:
+    result = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # pid (comm) state ppid ...; comm может содержать пробелы и скобки
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            result.append(int(stat.parent.name))
+    return sorted(result)
+
+
+def _row(pid: int, role: str) -> Dict:
+    m = smaps(pid)
+    return {
+        "pid": pid,
+        "role": role,
+        "rss_mb": round(m["Rss"] / 1024, 1),
+        "pss_mb": round(m["Pss"] / 1024, 1),
+        "shared_mb": round((m["Shared_Clean"] + m["Shared_Dirty"]) / 1024, 1),
+        "private_mb": round((m["Private_Clean"] + m["Private_Dirty"]) / 1024, 1),
+    }
+
+
+def report(master_pid: int, worker_pids: List[int] = None) -> Dict:
+    rows = [_row(master_pid, "master")]
+    for pid in worker_pids if worker_pids is not None else children(master_pid):
+        try:
+            rows.append(_row(pid, "worker"))
+        except FileNotFoundError:
+            continue  # воркер завершился, пока собирали отчёт
+    workers = [row for row in rows if row["role"] == "worker"]
+    rss_sum = sum(row["rss_mb"] for row in rows)
+    pss_sum = sum(row["pss_mb"] for row in rows)
+    return {
+        "processes": rows,
+        "workers": len(workers),
+        "rss_sum_mb": round(rss_sum, 1),
+        "pss_sum_mb": round(pss_sum, 1),
+        "saved_mb": round(rss_sum - pss_sum, 1),
+        "saved_per_worker_mb": round(sum(row["rss_mb"] - row["pss_mb"] for row in workers) / len(workers), 1)
+        if workers else None,
+    }
+
+
+def format_report(data: Dict) -> str:
+    lines = [f"{'pid':>8} {'role':<7}{'rss':>10}{'pss':>10}{'shared':>10}{'private':>10}  (МБ)"]
+    for row in data["processes"]:
+        lines.append(f"{row['pid']:>8} {row['role']:<7}{row['rss_mb']:>10}{row['pss_mb']:>10}"
+                     f"{row['shared_mb']:>10}{row['private_mb']:>10}")
+    lines.append(f"Сумма RSS {data['rss_sum_mb']} МБ, фактически (PSS) {data['pss_sum_mb']} МБ, "
+                 f"сэкономлено {data['saved_mb']} МБ, на воркер {data['saved_per_worker_mb']} МБ")
+    return "\n".join(lines)
@@ -0,0 +1,157 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+COLUMNS_FILE = "metadata_columns.json"
+TOMBSTONES_FILE = "tombstones.npy"
+CATEGORICAL = ("country", "source", "type")
+UNKNOWN_YEAR = 0
+
+
+def _year(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return UNKNOWN_YEAR
+
+
+def parse_filters(raw: Optional[Dict]) -> Optional[Dict]:
+    """Проверяет и нормализует фильтры из запроса: year_from/year_to и списки country/source/type."""
+    if not raw:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("filters должен быть объектом")
+    filters = {}
+    for key in ("year_from", "year_to"):
+        if raw.get(key) not in (None, ""):
+            try:
+                filters[key] = int(raw[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} должен быть целым числом")
+    for key in CATEGORICAL:
+        value = raw.get(key)
+        if value in (None, "", []):
+            continue
+        values = [value] if isinstance(value, str) else value
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError(f"{key} должен быть строкой или списком строк")
+        filters[key] = sorted(set(values))
+    unknown = set(raw) - {"year_from", "year_to", *CATEGORICAL}
+    if unknown:
+        raise ValueError(f"Неизвестные фильтры: {', '.join(sorted(unknown))}")
+    return filters or None
+
+
+def filters_key(filters: Optional[Dict]) -> str:
+    return json.dumps(filters, sort_keys=True, ensure_ascii=False) if filters else ""
+
+
+class MetadataColumns:
+    """Типизированные колонки метаданных чанков, закодированные целыми числами.
+
+    Номер строки совпадает с номером вектора в FAISS, поэтому маска по колонкам
+    напрямую превращается в IDSelectorBitmap для предфильтрации поиска.
+    deleted — надгробия строк, удалённых инкрементальным обновлением (index_update.py):
+    их векторы остаются в FAISS до уплотнения, но в маску не попадают никогда.
+    """
+
+    def __init__(self, year: np.ndarray, codes: Dict[str, np.ndarray], vocab: Dict[str, List[str]],
+                 deleted: Optional[np.ndarray] = None):
+        self.year = year
+        self.codes = codes
+        self.vocab = vocab
+        self.deleted = deleted if deleted is not None and deleted.any() else None
+        self._lookup = {column: {value: i for i, value in enumerate(values)} for column, values in vocab.items()}
+        self._masks = {}
+
+    def __len__(self):
+        return len(self.year)
+
+    @classmethod
+    def from_metadata(cls, metadatas: Iterable[Dict]) -> "MetadataColumns":
+        vocab = {column: [] for column in CATEGORICAL}
+        lookup = {column: {} for column in CATEGORICAL}
+        years, codes = [], {column: [] for column in CATEGORICAL}
+        for metadata in metadatas:
+            years.append(_year(metadata.get("year")))
+            for column in CATEGORICAL:
+                value = str(metadata.get(column) or "")
+                if value not in lookup[column]:
+                    lookup[column][value] = len(vocab[column])
+                    vocab[column].append(value)
+                codes[column].append(lookup[column][value])
+        return cls(
+            np.asarray(years, dtype=np.int16),
+            {column: np.asarray(values, dtype=np.int32) for column, values in codes.items()},
+            vocab,
+        )
+
+    def save(self, index_dir: Path):
+        index_dir = Path(index_dir)
+        np.save(index_dir / "meta_year.npy", self.year)
+        for column, values in self.codes.items():
+            np.save(index_dir / f"meta_{column}.npy", values)
+        if self.deleted is not None:
+            np.save(index_dir / TOMBSTONES_FILE, self.deleted)
+        elif (index_dir / TOMBSTONES_FILE).exists():
+            (index_dir / TOMBSTONES_FILE).unlink()
+        with open(index_dir / COLUMNS_FILE, "w", encoding="utf-8") as f:
+            json.dump({"rows": len(self), "vocab": self.vocab}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir: Path) -> "MetadataColumns":
+        index_dir = Path(index_dir)
+        with open(index_dir / COLUMNS_FILE, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        year = np.load(index_dir / "meta_year.npy", mmap_mode="r")
+        codes = {column: np.load(index_dir / f"meta_{column}.npy", mmap_mode="r") for column in CATEGORICAL}
+        deleted = np.load(index_dir / TOMBSTONES_FILE) if (index_dir / TOMBSTONES_FILE).exists() else None
+        return cls(year, codes, info["vocab"], deleted)
+
+    def mask(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """Маска строк под фильтры без надгробий; None — подходят все строки."""
+        if not filters and self.deleted is None:
+            return None
+        key = filters_key(filters)
+        if key in self._masks:
+            return self._masks[key]
+        mask = np.ones(len(self), dtype=bool) if self.deleted is None else ~self.deleted
+        filters = filters or {}
+        if "year_from" in filters:
+            mask &= self.year >= filters["year_from"]
+        if "year_to" in filters:
+            mask &= (self.year <= filters["year_to"]) & (self.year != UNKNOWN_YEAR)
+        for column in CATEGORICAL:
+            if column in filters:
+                wanted = [self._lookup[column][v] for v in filters[column] if v in self._lookup[column]]
+                mask &= np.isin(self.codes[column], wanted)
+        if len(self._masks) > 256:
+            self._masks.clear()
+        self._masks[key] = mask
+        return mask
+
+    def facets(self, filters: Optional[Dict] = None, limit: int = 50) -> Dict:
+        mask = self.mask(filters)
+        rows = np.flatnonzero(mask) if mask is not None else slice(None)
+        result = {"total": int(mask.sum()) if mask is not None else len(self)}
+
+        years, counts = np.unique(np.asarray(self.year[rows]), return_counts=True)
+        result["year"] = {
+            (str(int(y)) if y != UNKNOWN_YEAR else "unknown"): int(c) for y, c in zip(years, counts)
+        }
+        for column in CATEGORICAL:
+            counts = np.bincount(np.asarray(self.codes[column][rows]), minlength=len(self.vocab[column]))
+            top = np.argsort(-counts, kind="stable")[:limit]
+            result[column] = {self.vocab[column][i]: int(counts[i]) for i in top if counts[i] > 0}
+        return result
+
+
+def make_selector(mask: np.ndarray):
+    import faiss
+
+    bitmap = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+    selector.referenced_objects = [bitmap]  # буфер должен жить, пока жив селектор
+    return selector
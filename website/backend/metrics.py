@@ -0,0 +1,198 @@
+"""Метрики Prometheus по стадиям конвейера RAG и вызовам GigaChat, спаны OpenTelemetry.
+
+prometheus_client и opentelemetry-api необязательны: без них функции модуля ничего не записывают.
+Режим запроса (qa / hypothesis / search) хранится в contextvar и попадает в метки всего,
+что записано в этом контексте, в том числе внутри вызовов LLM.
+"""
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from settings.config import METRICS_ENABLED, TRACING_ENABLED
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+PROMETHEUS_AVAILABLE = METRICS_ENABLED and prometheus_client is not None
+TRACING_AVAILABLE = TRACING_ENABLED and trace is not None
+
+# Секунды: от поиска по индексу за миллисекунды до минутных ответов GigaChat-Max
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 90, 120, 180)
+
+MODE_LABELS = {"question": "qa"}
+
+_mode = contextvars.ContextVar("rag_mode", default="none")
+
+if PROMETHEUS_AVAILABLE:
+    STAGE_SECONDS = Histogram("rag_stage_seconds", "Длительность стадии конвейера RAG", ["mode", "stage"], buckets=BUCKETS)
+    STAGE_ERRORS = Counter("rag_stage_errors", "Исключения по стадиям конвейера RAG", ["mode", "stage", "error"])
+    CACHE_LOOKUPS = Counter("rag_cache_lookups", "Результаты поиска в кэше ответов", ["mode", "result"])
+    LLM_SECONDS = Histogram("llm_request_seconds", "Длительность одного запроса к GigaChat",
+                            ["model", "mode", "kind"], buckets=BUCKETS)
+    LLM_FIRST_TOKEN = Histogram("llm_first_token_seconds", "Время до первого фрагмента стрима GigaChat",
+                                ["model", "mode"], buckets=BUCKETS)
+    LLM_TOKENS = Counter("llm_tokens", "Токены запросов к GigaChat", ["model", "mode", "type"])
+    LLM_ERRORS = Counter("llm_errors", "Ошибки запросов к GigaChat", ["model", "mode", "error"])
+    HTTP_SECONDS = Histogram("http_request_seconds", "Время до ответа Flask (для SSE — до заголовков)",
+                             ["method", "endpoint", "status"], buckets=BUCKETS)
+
+tracer = trace.get_tracer("rag") if TRACING_AVAILABLE else None
+
+
+def mode_label(mode: Optional[str]) -> str:
+    return MODE_LABELS.get(mode, mode) or "none"
+
+
+def set_mode(mode: str):
+    """Режим текущего запроса для меток; задаётся в начале ask / generate_hypotheses / search."""
+    _mode.set(mode_label(mode))
+
+
+def current_mode() -> str:
+    return _mode.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None}) as s:
+        yield s
+
+
+@contextmanager
+def stage(name: str, mode: str = None):
+    mode = mode_label(mode) if mode else _mode.get()
+    started = time.perf_counter()
+    with span(f"rag.{name}", mode=mode):
+        try:
+            yield
+        except Exception as e:
+            if PROMETHEUS_AVAILABLE:
+                STAGE_ERRORS.labels(mode, name, type(e).__name__).inc()
+            raise
+        finally:
+            if PROMETHEUS_AVAILABLE:
+                STAGE_SECONDS.labels(mode, name).observe(time.perf_counter() - started)
+
+
+def cache_lookup(result: str):
+    """result: exact, semantic или miss."""
+    if PROMETHEUS_AVAILABLE:
+        CACHE_LOOKUPS.labels(_mode.get(), result).inc()
+
+
+def _token_counts(usage) -> Tuple[Optional[int], Optional[int]]:
+    # Usage из gigachat (prompt_tokens / completion_tokens) или usage_metadata langchain (input / output)
+    if usage is None:
+        return None, None
+    get = usage.get if isinstance(usage, dict) else (lambda key: getattr(usage, key, None))
+    prompt = get("prompt_tokens")
+    completion = get("completion_tokens")
+    return (
+        prompt if prompt is not None else get("input_tokens"),
+        completion if completion is not None else get("output_tokens"),
+    )
+
+
+class LLMCall:
+    def __init__(self, model: str, mode: str, started: float, span_=None):
+        self.model = model
+        self.mode = mode
+        self.started = started
+        self.span = span_
+        self._first_token = False
+
+    def usage(self, usage):
+        prompt, completion = _token_counts(usage)
+        for kind, value in (("prompt", prompt), ("completion", completion)):
+            if value is None:
+                continue
+            if PROMETHEUS_AVAILABLE:
+                LLM_TOKENS.labels(self.model, self.mode, kind).inc(value)
+            if self.span is not None:
+                self.span.set_attribute(f"llm.tokens.{kind}", value)
+
+    def chunk(self, chunk):
+        if not self._first_token:
+            self._first_token = True
+            if PROMETHEUS_AVAILABLE:
+                LLM_FIRST_TOKEN.labels(self.model, self.mode).observe(time.perf_counter() - self.started)
+        usage = getattr(getattr(chunk, "message", None), "usage_metadata", None)
+        if usage:
+            self.usage(usage)
+
+
+@contextmanager
+def llm_call(model: str, kind: str = "invoke"):
+    """Один HTTP-запрос к модели (попытка или хедж): длительность, токены, ошибки и спан."""
+    mode = _mode.get()
+    started = time.perf_counter()
+    with span("gigachat.chat", model=model, mode=mode, kind=kind) as s:
+        try:
+            yield LLMCall(model, mode, started, s)
+        except Exception as e:
+            if PROMETHEUS_AVAILABLE:
+                LLM_ERRORS.labels(model, mode, type(e).__name__).inc()
+            raise
+        finally:
+            if PROMETHEUS_AVAILABLE:
+                LLM_SECONDS.labels(model, mode, kind).observe(time.perf_counter() - started)
+
+
+def export() -> Tuple[bytes, str]:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Несколько воркеров serve.py: собираем значения всех процессов из файлов в общем каталоге
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Вызывается master-процессом serve.py при завершении воркера."""
+    if PROMETHEUS_AVAILABLE and os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+
+def init_app(app):
+    """Время ответа по маршрутам Flask и, если установлен инструментатор, спаны запросов."""
+    from flask import g, request
+
+    if PROMETHEUS_AVAILABLE:
+        @app.before_request
+        def _start_timer():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def _observe_request(response):
+            started = g.pop("metrics_started", None)
+            if started is not None:
+                endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+                HTTP_SECONDS.labels(request.method, endpoint, str(response.status_code)).observe(
+                    time.perf_counter() - started
+                )
+            return response
+
+    if TRACING_AVAILABLE:
+        try:
+            from opentelemetry.instrumentation.flask import FlaskInstrumentor
+            FlaskInstrumentor().instrument_app(app)
+        except ImportError:
+            logger.info("opentelemetry-instrumentation-flask не установлен: спаны LLM не будут связаны с запросом Flask")
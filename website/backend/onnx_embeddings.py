@@ -0,0 +1,125 @@
+import json
+import logging
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EXPORT_INFO_FILE = "export_info.json"
+FP32_MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model.int8.onnx"
+
+
+def export_onnx(model_name: str, out_dir: Path, quantize: bool = True, opset: int = 17) -> Path:
+    """Экспортирует трансформер в ONNX и (опционально) квантует веса в int8."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Экспорт {model_name} в ONNX: {out_dir}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    tokenizer.save_pretrained(str(out_dir))
+
+    sample = tokenizer(["query: пример запроса"], return_tensors="pt")
+    fp32_path = out_dir / FP32_MODEL_FILE
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+
+    model_path = fp32_path
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        model_path = out_dir / INT8_MODEL_FILE
+        quantize_dynamic(str(fp32_path), str(model_path), weight_type=QuantType.QInt8)
+        logger.info(f"Квантованная модель: {model_path}")
+
+    with open(out_dir / EXPORT_INFO_FILE, "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "model_file": model_path.name, "quantized": quantize, "opset": opset}, f, indent=2)
+    return model_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """Эмбеддинги через onnxruntime на CPU (mean pooling, как в sentence-transformers для e5)."""
+
+    def __init__(self, model_dir: Path, normalize: bool = True, batch_size: int = 32,
+                 max_length: int = 512, num_threads: Optional[int] = None):
+        from transformers import AutoTokenizer
+
+        self.model_dir = Path(model_dir)
+        with open(self.model_dir / EXPORT_INFO_FILE, "r", encoding="utf-8") as f:
+            self.export_info = json.load(f)
+
+        self.session = self._make_session(num_threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_dir))
+        self.normalize = normalize
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _make_session(self, num_threads: Optional[int]):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        return ort.InferenceSession(
+            str(self.model_dir / self.export_info["model_file"]), options, providers=["CPUExecutionProvider"]
+        )
+
+    def reload(self, num_threads: Optional[int] = None):
+        """Новая сессия с другим числом потоков: пул потоков onnxruntime не переживает fork."""
+        self.session = self._make_session(num_threads)
+
+    @classmethod
+    def from_manifest(cls, manifest: dict, model_dir: Path, quantize: bool = True, **kwargs) -> "OnnxEmbeddings":
+        model_dir = Path(model_dir)
+        info_path = model_dir / EXPORT_INFO_FILE
+        exported = None
+        if info_path.exists():
+            with open(info_path, "r", encoding="utf-8") as f:
+                exported = json.load(f)
+        if not exported or exported.get("model_name") != manifest["model_name"] or exported.get("quantized") != quantize:
+            export_onnx(manifest["model_name"], model_dir, quantize=quantize)
+        return cls(model_dir, normalize=manifest["normalize_embeddings"], **kwargs)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        batch = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        mask = batch["attention_mask"].astype(np.int64)
+        hidden = self.session.run(None, {
+            "input_ids": batch["input_ids"].astype(np.int64),
+            "attention_mask": mask,
+        })[0]
+        weights = mask[:, :, None].astype(np.float32)
+        vectors = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        result = []
+        for i in range(0, len(texts), self.batch_size):
+            result.extend(self._encode(texts[i:i + self.batch_size]).tolist())
+        return result
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
@@ -1,12 +1,210 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
-from langchain_community.chat_models import GigaChat
-from settings.config import GIGACHAT_TOKEN
+from settings.config import (
+    GIGACHAT_TOKEN, EMBEDDING_MODEL, INDEX_MANIFEST_STRICT,
+    EMBEDDING_BACKEND, ONNX_MODEL_DIR, ONNX_QUANTIZE, ONNX_THREADS,
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, TORCH_THREADS, FAISS_EF_SEARCH, FAISS_NPROBE,
+    HYBRID_SEARCH, HYBRID_RRF_K, HYBRID_FETCH_FACTOR, HYBRID_BUDGET_MS,
+    CONTEXT_MAX_CHUNKS_PER_ARTICLE, CONTEXT_DEDUP_THRESHOLD,
+    QA_MAX_K, QA_CONTEXT_TOKENS, HYPOTHESIS_MAX_K, HYPOTHESIS_CONTEXT_TOKENS,
+    RELEVANCE_MIN_DOCS, RELEVANCE_CLIFF_GAP, RELEVANCE_MAX_DROP,
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_FILE, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_SIMILARITY,
+    SEARCH_K, SEARCH_MAX_K, SEARCH_BUDGET_MS, SEARCH_SNIPPET_CHARS,
+    GIGACHAT_TIMEOUT, GIGACHAT_MAX_CONNECTIONS, GIGACHAT_TOKEN_CACHE_FILE, LLM_LIMITS, LLM_DEFAULT_LIMIT,
+    GIGACHAT_BASE_URL, GIGACHAT_AUTH_URL,
+    LLM_RETRY_ATTEMPTS, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_RETRY_BUDGET,
+    LLM_HEDGE_ENABLED, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_MAX_INFLIGHT, LLM_HEDGE_MAX_RATIO,
+    WARMUP_QUERY, WARMUP_RETRY_AFTER,
+    INDEX_WATCH_INTERVAL, INDEX_SMOKE_QUERIES, INDEX_SMOKE_K, INDEX_SMOKE_MIN_OVERLAP,
+)
 from settings.prompts import generator_prompt, critic_prompt, qa_prompt
+from cache import AnswerCache
+from index_manifest import INDEX_FILE, IndexManifestError, load_manifest, load_embeddings, validate_index, manifest_version
+from index_versions import current_version, list_versions, resolve_index_dir
+from batcher import MicroBatcher
+from index_factory import apply_search_params, read_index_mmap, search_parameters
+from metadata_filter import COLUMNS_FILE, MetadataColumns, make_selector, parse_filters, filters_key
+from docstore import SQLiteDocstore, RowIdMap
+from bm25 import VOCAB_FILE, BM25Index, reciprocal_rank_fusion, highlight
+from context import merge_chunks, pack_context
+from llm import GigaChatPool
+from resilience import CallPolicy, RetryPolicy, HedgeBudget
+from warmup import WarmUp
+import metrics
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = Path("faiss_index")
+
+# Модель и индекс загружает _warm_up в фоне (rag_warmup.start()); до окончания прогрева
+# публичные функции бросают NotReady.
+# Всё, что зависит от версии индекса, собрано в IndexSnapshot. Горячая замена (reload_index)
+# подменяет одну ссылку current_index; публичные функции закрепляют текущий снимок на время
+# вызова (@_pin) и дорабатывают на нём, даже если индекс за это время переключился.
+manifest = None  # манифест версии, с которой загружена модель эмбеддингов
+embeddings = None
+current_index = None
+vectorstore = None  # current_index.vectorstore
+INDEX_VERSION = None  # current_index.version
+_pinned = contextvars.ContextVar("rag_index", default=None)
+# serve.py: прогрев в master-процессе перед fork (см. preload) и число потоков на воркер (см. after_fork)
+_preloading = False
+_worker_threads = None
+
+
+def _load_vectorstore(index_dir: Path, manifest: dict, embeddings):
+    docstore_file = manifest.get("docstore")
+    if docstore_file and (index_dir / docstore_file).exists():
+        index = read_index_mmap(index_dir / manifest.get("index_file", INDEX_FILE))
+        return FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=SQLiteDocstore(index_dir / docstore_file),
+            index_to_docstore_id=RowIdMap(index.ntotal),
+        )
+    logger.warning("Индекс в старом формате (index.pkl), конвертируйте его: python -m scripts.convert_index")
+    return FAISS.load_local(str(index_dir), embeddings, allow_dangerous_deserialization=True)
+
+
+def _load_metadata_columns(index_dir: Path, vectorstore):
+    if (index_dir / COLUMNS_FILE).exists():
+        return MetadataColumns.load(index_dir)
+    # Старые индексы: колонки собираются в памяти из docstore при старте
+    docs = _fetch_documents(vectorstore, list(range(vectorstore.index.ntotal)))
+    return MetadataColumns.from_metadata(docs[i].metadata for i in range(vectorstore.index.ntotal))
+
+
+def _load_bm25(index_dir: Path, vectorstore):
+    if (index_dir / VOCAB_FILE).exists():
+        if BM25Index.is_current(index_dir):
+            return BM25Index.load(index_dir)
+        logger.warning(f"BM25 в {index_dir} собран старой версией токенизатора, пересобираю в памяти")
+    if hasattr(vectorstore.docstore, "iter_rows"):
+        rows = list(vectorstore.docstore.iter_rows())
+        return BM25Index.build((doc.page_content for _, doc in rows), row_ids=[row_id for row_id, _ in rows],
+                               n_rows=vectorstore.index.ntotal)
+    docs = _fetch_documents(vectorstore, list(range(vectorstore.index.ntotal)))
+    return BM25Index.build(docs[i].page_content for i in range(vectorstore.index.ntotal))
+
+
+class IndexSnapshot:
+    """Одна версия индекса: FAISS с docstore, колонки метаданных, BM25 и кэш ответов со своей областью."""
+
+    def __init__(self, index_dir: Path, manifest: dict, vectorstore, metadata_columns, bm25_index, answer_cache):
+        self.index_dir = index_dir
+        self.manifest = manifest
+        self.vectorstore = vectorstore
+        self.metadata_columns = metadata_columns
+        self.bm25_index = bm25_index
+        self.answer_cache = answer_cache
+        self.version = manifest_version(manifest)
+        self.loaded_at = time.time()
+
+    def info(self):
+        return {
+            "dir": str(self.index_dir),
+            "version": self.version,
+            "num_vectors": self.vectorstore.index.ntotal,
+            "index_spec": self.manifest.get("index_spec", {"type": "flat"}),
+            "created_at": self.manifest.get("created_at"),
+            "loaded_at": self.loaded_at,
+        }
+
+
+def _open_index(index_dir: Path, manifest: dict, step) -> IndexSnapshot:
+    with step("index"):
+        vectorstore = _load_vectorstore(index_dir, manifest, embeddings)
+        validate_index(manifest, vectorstore.index, embeddings, strict=INDEX_MANIFEST_STRICT)
+        apply_search_params(vectorstore.index, manifest.get("index_spec"), ef_search=FAISS_EF_SEARCH, nprobe=FAISS_NPROBE)
+    with step("metadata"):
+        metadata_columns = _load_metadata_columns(index_dir, vectorstore)
+    bm25_index = None
+    if HYBRID_SEARCH:
+        with step("bm25"):
+            bm25_index = _load_bm25(index_dir, vectorstore)
+    answer_cache = AnswerCache(
+        ANSWER_CACHE_FILE,
+        scope=f"{manifest_version(manifest)}|{PROMPT_VERSION}",
+        ttl=ANSWER_CACHE_TTL,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        similarity=ANSWER_CACHE_SIMILARITY,
+    ) if ANSWER_CACHE_ENABLED else None
+    return IndexSnapshot(index_dir, manifest, vectorstore, metadata_columns, bm25_index, answer_cache)
+
+
+def _index() -> IndexSnapshot:
+    return _pinned.get() or current_index
+
+
+def _unpin(token):
+    try:
+        _pinned.reset(token)
+    except ValueError:
+        # генератор закрыт из другого контекста (например, сборщиком мусора)
+        _pinned.set(None)
+
+
+def _pin(func):
+    """Закрепляет текущую версию индекса на время вызова func (контекст копируется в to_thread
+    и очередь задач) и снимает закрепление по выходу, чтобы поток пула не держал старый снимок.
+    Генераторы держат снимок до исчерпания или закрытия."""
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _pinned.set(current_index)
+            try:
+                async for item in func(*args, **kwargs):
+                    yield item
+            finally:
+                _unpin(token)
+    elif inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _pinned.set(current_index)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _unpin(token)
+    elif inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _pinned.set(current_index)
+            try:
+                yield from func(*args, **kwargs)
+            finally:
+                _unpin(token)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _pinned.set(current_index)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _unpin(token)
+    return wrapper
+
+
+def _activate(snapshot: IndexSnapshot):
+    global current_index, vectorstore, INDEX_VERSION
+    current_index = snapshot
+    vectorstore, INDEX_VERSION = snapshot.vectorstore, snapshot.version
+
 
-embeddings = HuggingFaceEmbeddings(model_name="intfloat/multilingual-e5-large")
-vectorstore = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
 CREDENTIALS = GIGACHAT_TOKEN
 
 QA_PROMPT = PromptTemplate.from_template(qa_prompt)
@@ -14,36 +212,771 @@ GENERATOR_PROMPT = PromptTemplate.from_template(generator_prompt)
 CRITIC_PROMPT = PromptTemplate.from_template(critic_prompt)
 
 
+def _search_batch(items):
+    # Запросы к одной версии индекса с одинаковыми фильтрами ищутся одним батчем; если есть фильтры
+    # или надгробия удалённых чанков — с общим ID-селектором. Во время горячей замены в одном батче
+    # могут оказаться запросы к старой и новой версии
+    k_max = max(k for _, _, k, _ in items)
+    distances = np.empty((len(items), k_max), dtype=np.float32)
+    ids = np.full((len(items), k_max), -1, dtype=np.int64)
+    groups = {}
+    for n, (snapshot, _, _, filters) in enumerate(items):
+        groups.setdefault((id(snapshot), filters_key(filters)), []).append(n)
+    for rows in groups.values():
+        snapshot, _, _, filters = items[rows[0]]
+        index = snapshot.vectorstore.index
+        mask = snapshot.metadata_columns.mask(filters)
+        if mask is not None and not mask.any():
+            continue
+        k = max(items[n][2] for n in rows)
+        vectors = np.asarray([items[n][1] for n in rows], dtype=np.float32)
+        params = search_parameters(index, make_selector(mask)) if mask is not None else None
+        distances[rows, :k], ids[rows, :k] = index.search(vectors, k, params=params)
+
+    results = []
+    for (_, _, k, _), row_scores, row_ids in zip(items, distances, ids):
+        results.append([(int(i), float(score)) for score, i in zip(row_scores[:k], row_ids[:k]) if i != -1])
+    return results
+
+
+def _fetch_documents(vectorstore, row_ids):
+    if hasattr(vectorstore.docstore, "mget"):
+        return vectorstore.docstore.mget(row_ids)
+    return {i: vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in set(row_ids)}
+
+
+def _encode_batch(texts):
+    return embeddings.embed_queries(texts)
+
+
+def _start_workers():
+    # Все запросы к модели и индексу идут через два батчера: один поток кодирует, один ищет
+    global query_encoder, index_searcher, lexical_pool
+    query_encoder = MicroBatcher(_encode_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, name="query-encoder")
+    index_searcher = MicroBatcher(_search_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, name="index-searcher")
+    lexical_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25") if HYBRID_SEARCH else None
+
+
+_start_workers()
+
+
+def embed_query(text: str):
+    return query_encoder(text)
+
+
+def _similarity(distance: float) -> float:
+    # FAISS возвращает квадрат L2; для нормализованных векторов это 2 - 2·cos
+    return 1 - distance / 2 if manifest["normalize_embeddings"] else -distance
+
+
+def _with_scores(snapshot: IndexSnapshot, ranked, dense_scores):
+    docs = _fetch_documents(snapshot.vectorstore, [i for i in ranked])
+    result = []
+    for i in ranked:
+        if i not in docs:
+            continue
+        score = dense_scores.get(i)
+        metadata = {**docs[i].metadata, "score": _similarity(score) if score is not None else None}
+        result.append(Document(page_content=docs[i].page_content, metadata=metadata))
+    return result
+
+
+def search_by_vector(vector, k: int, filters=None):
+    snapshot = _index()
+    hits = index_searcher((snapshot, vector, k, filters))
+    return _with_scores(snapshot, [i for i, _ in hits], dict(hits))
+
+
+def retrieve(text: str, vector, k: int, filters=None, lexical_budget_ms: float = HYBRID_BUDGET_MS):
+    """Гибридный поиск: dense (FAISS) + BM25 со слиянием reciprocal rank fusion.
+
+    В metadata["score"] каждого документа — косинусная близость dense-поиска (None для найденных только BM25).
+
+    BM25 идёт параллельно с dense-поиском; если он не уложился в lexical_budget_ms
+    после завершения dense-поиска, возвращается чистый dense-результат.
+    """
+    snapshot = _index()
+    if not snapshot.bm25_index:
+        return search_by_vector(vector, k, filters)
+
+    fetch_k = k * HYBRID_FETCH_FACTOR
+    mask = snapshot.metadata_columns.mask(filters)
+    lexical = lexical_pool.submit(snapshot.bm25_index.search, text, fetch_k, mask)
+    dense = index_searcher((snapshot, vector, fetch_k, filters))
+    try:
+        lexical_hits = lexical.result(timeout=lexical_budget_ms / 1000)
+    except FutureTimeout:
+        lexical.cancel()
+        logger.warning(f"BM25 не уложился в {lexical_budget_ms:.0f} мс, использую только dense-поиск")
+        lexical_hits = []
+
+    fused = reciprocal_rank_fusion([[i for i, _ in dense], [i for i, _ in lexical_hits]], k=HYBRID_RRF_K)[:k]
+    return _with_scores(snapshot, [i for i, _ in fused], dict(dense))
+
+
+@_pin
+def search(query: str, k: int = SEARCH_K, filters=None):
+    """Поиск источников без LLM: ранжированные фрагменты с оценками, метаданными и подсветкой.
+
+    Кэш ответов не используется; задержка сравнивается с SEARCH_BUDGET_MS.
+    """
+    rag_warmup.require()
+    metrics.set_mode("search")
+    started = time.perf_counter()
+    filters = parse_filters(filters)
+    k = max(1, min(int(k), SEARCH_MAX_K))
+
+    with _timed(None, "embed_ms"):
+        vector = embed_query(query)
+    embedded = time.perf_counter()
+    remaining_ms = SEARCH_BUDGET_MS - (embedded - started) * 1000
+    with _timed(None, "search_ms"):
+        hits = retrieve(query, vector, k=k, filters=filters, lexical_budget_ms=max(1.0, min(HYBRID_BUDGET_MS, remaining_ms)))
+    docs = _merge(hits)
+    retrieved = time.perf_counter()
+
+    results = []
+    for rank, doc in enumerate(docs, 1):
+        metadata = doc.metadata
+        results.append({
+            "rank": rank,
+            "score": metadata.get("score"),
+            "chunk_id": metadata.get("chunk_id"),
+            "merged_chunk_ids": metadata.get("merged_chunk_ids"),
+            "title": metadata.get("title"),
+            "doi": metadata.get("doi"),
+            "year": metadata.get("year"),
+            "country": metadata.get("country"),
+            "source": metadata.get("source"),
+            "authors": metadata.get("authors"),
+            "pdf_url": metadata.get("pdf_url"),
+            "snippet": highlight(doc.page_content, query, width=SEARCH_SNIPPET_CHARS),
+        })
+
+    took_ms = (time.perf_counter() - started) * 1000
+    if took_ms > SEARCH_BUDGET_MS:
+        logger.warning(f"Поиск занял {took_ms:.1f} мс при бюджете {SEARCH_BUDGET_MS} мс")
+    return {
+        "query": query,
+        "filters": filters,
+        "results": results,
+        "took_ms": round(took_ms, 2),
+        "timings_ms": {
+            "embed": round((embedded - started) * 1000, 2),
+            "retrieve": round((retrieved - embedded) * 1000, 2),
+            "snippets": round((time.perf_counter() - retrieved) * 1000, 2),
+        },
+        "budget_ms": SEARCH_BUDGET_MS,
+        "within_budget": took_ms <= SEARCH_BUDGET_MS,
+    }
+
+
+@_pin
+def facets(filters=None, limit: int = 50):
+    rag_warmup.require()
+    return _index().metadata_columns.facets(parse_filters(filters), limit=limit)
+
+
+def _merge(docs):
+    return merge_chunks(docs, max_per_article=CONTEXT_MAX_CHUNKS_PER_ARTICLE, dedup_threshold=CONTEXT_DEDUP_THRESHOLD)
+
+
+def _qa_source(n, doc, text):
+    return f"Источник: {doc.metadata.get('title','?')}\n{text}"
+
+
+def _hypothesis_source(n, doc, text):
+    return f"[{n}] {doc.metadata.get('title','?')}\n{text}"
+
+
+def build_context(text: str, vector, max_k: int, budget: int, formatter, filters=None):
+    with _timed(None, "search_ms"):
+        hits = retrieve(text, vector, k=max_k, filters=filters)
+    with _timed(None, "context_ms"):
+        packed = pack_context(
+            _merge(hits), budget, formatter,
+            min_docs=RELEVANCE_MIN_DOCS, cliff_gap=RELEVANCE_CLIFF_GAP, max_drop=RELEVANCE_MAX_DROP,
+        )
+    logger.info(f"Контекст: {packed.tokens}/{budget} токенов, фрагментов {len(packed.docs)} из {packed.candidates} "
+                f"(отсечено по релевантности {packed.cut_by_relevance}, по бюджету {packed.cut_by_budget})")
+    return packed
+
+
+def _cache_mode(mode: str, filters) -> str:
+    return f"{mode}|{filters_key(filters)}" if filters else mode
+
+
+def _prompt_version() -> str:
+    raw = "\x00".join([qa_prompt, generator_prompt, critic_prompt])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+PROMPT_VERSION = _prompt_version()
+
+
+def _warm_up(step):
+    """Загрузка модели, индекса, колонок метаданных, BM25 и кэша ответов, затем пробный запрос."""
+    global manifest, embeddings
+
+    set_compute_threads(1 if _preloading else _worker_threads or TORCH_THREADS or os.cpu_count() or 1)
+
+    index_dir = resolve_index_dir(INDEX_DIR)
+    with step("embeddings"):
+        manifest = load_manifest(index_dir)
+        embeddings = load_embeddings(
+            manifest, requested_model=EMBEDDING_MODEL, strict=INDEX_MANIFEST_STRICT,
+            backend=EMBEDDING_BACKEND, onnx_dir=ONNX_MODEL_DIR, onnx_quantize=ONNX_QUANTIZE,
+            num_threads=1 if _preloading else _worker_threads or ONNX_THREADS,
+        )
+    _activate(_open_index(index_dir, manifest, step))
+
+    # Первый вызов модели и поиска заметно медленнее (ленивая инициализация torch/ONNX, чтение mmap-страниц)
+    with step("dummy_query"):
+        vector = embed_query(WARMUP_QUERY)
+        retrieve(WARMUP_QUERY, vector, k=QA_MAX_K)
+
+
+rag_warmup = WarmUp(_warm_up, retry_after=WARMUP_RETRY_AFTER)
+
+
+def set_compute_threads(n: int):
+    """Потоки torch и FAISS (OpenMP) на кодирование и поиск в этом процессе."""
+    if EMBEDDING_BACKEND == "torch":
+        import torch
+        torch.set_num_threads(n)
+    import faiss
+    faiss.omp_set_num_threads(n)
+
+
+def preload():
+    """Прогрев в master-процессе перед fork, чтобы воркеры делили страницы модели и индекса (copy-on-write).
+
+    Всё в один поток: libgomp (torch, FAISS) и пул потоков onnxruntime, запущенные в родителе,
+    не переживают fork — воркер зависнет на первом же запросе.
+    """
+    global _preloading
+    _preloading = True
+    rag_warmup.run()
+
+
+def after_fork(threads: int):
+    """Вызывается в воркере сразу после fork: свои потоки вычислений, батчеры и пулы заново."""
+    global _worker_threads, _preloading
+    _worker_threads = threads
+    if not _preloading:
+        return  # модуль импортирован уже в воркере, прогрев сам возьмёт _worker_threads
+    _preloading = False
+    set_compute_threads(threads)
+    if EMBEDDING_BACKEND == "onnx" and threads > 1:
+        # Сессия onnxruntime пересоздаётся с нужным числом потоков — веса ONNX у воркера свои
+        embeddings.base.reload(num_threads=threads)
+    _start_workers()
+    start_index_watcher()
+
+
+# Горячая замена индекса: новая версия грузится в фоне, проверяется пробными запросами
+# и подменяет current_index одним присваиванием. Запросы, закрепившие старый снимок,
+# дорабатывают на нём; память старой версии освобождается, когда их не останется.
+index_reload = None
+_reload_lock = threading.Lock()
+_watcher = None
+
+
+def _retrieve_on(snapshot: IndexSnapshot, text: str, vector, k: int):
+    token = _pinned.set(snapshot)
+    try:
+        return retrieve(text, vector, k=k)
+    finally:
+        _pinned.reset(token)
+
+
+def _smoke_test(snapshot: IndexSnapshot):
+    """Каждый пробный запрос должен что-то находить, а выдача не должна совсем разойтись с текущей версией."""
+    overlaps = []
+    for query in INDEX_SMOKE_QUERIES:
+        vector = embed_query(query)
+        new_ids = {doc.metadata.get("chunk_id") for doc in _retrieve_on(snapshot, query, vector, INDEX_SMOKE_K)}
+        if not new_ids:
+            raise IndexManifestError(f"Версия {snapshot.index_dir.name}: пустая выдача на пробный запрос «{query}»")
+        old_ids = {doc.metadata.get("chunk_id") for doc in _retrieve_on(current_index, query, vector, INDEX_SMOKE_K)}
+        overlaps.append(len(new_ids & old_ids) / max(1, len(old_ids)))
+    overlap = sum(overlaps) / len(overlaps) if overlaps else 1.0
+    if overlap < INDEX_SMOKE_MIN_OVERLAP:
+        raise IndexManifestError(
+            f"Версия {snapshot.index_dir.name}: пересечение выдачи с текущим индексом {overlap:.2f} "
+            f"ниже порога {INDEX_SMOKE_MIN_OVERLAP}"
+        )
+    return overlap
+
+
+def _swap_index(step, version: str = None):
+    index_dir = resolve_index_dir(INDEX_DIR, version)
+    if index_dir.resolve() == current_index.index_dir.resolve():
+        logger.info(f"Индекс {index_dir.name} уже загружен")
+        return
+    new_manifest = load_manifest(index_dir)
+    for key in ("model_name", "query_prefix", "normalize_embeddings"):
+        if new_manifest.get(key) != manifest.get(key):
+            raise IndexManifestError(
+                f"Версия {index_dir.name} собрана с другим {key} ({new_manifest.get(key)!r} вместо "
+                f"{manifest.get(key)!r}): горячая замена невозможна, нужен перезапуск"
+            )
+    snapshot = _open_index(index_dir, new_manifest, step)
+    with step("smoke"):
+        overlap = _smoke_test(snapshot)
+    previous = current_index
+    _activate(snapshot)
+    logger.info(f"Индекс переключён: {previous.index_dir.name} ({previous.version}) -> "
+                f"{index_dir.name} ({snapshot.version}), векторов {snapshot.vectorstore.index.ntotal}, "
+                f"пересечение пробной выдачи {overlap:.2f}")
+
+
+def reload_index(version: str = None) -> WarmUp:
+    """Фоновая загрузка версии индекса (по умолчанию — из CURRENT); пока идёт одна, вторая не запускается."""
+    global index_reload
+    rag_warmup.require()
+    with _reload_lock:
+        if index_reload is None or index_reload.status not in ("pending", "warming"):
+            index_reload = WarmUp(lambda step: _swap_index(step, version), retry_after=WARMUP_RETRY_AFTER)
+            index_reload.start()
+        return index_reload
+
+
+def _watch_index():
+    failed = None
+    while True:
+        time.sleep(INDEX_WATCH_INTERVAL)
+        if not rag_warmup.ready:
+            continue
+        try:
+            version = current_version(INDEX_DIR)
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать версию индекса: {e}")
+            continue
+        if not version or version == current_index.index_dir.name or version == failed:
+            continue
+        logger.info(f"Опубликована версия индекса {version}, загрузка в фоне")
+        job = reload_index(version)
+        job.wait()
+        if job.status == "failed":
+            failed = version  # повторять до публикации следующей версии нет смысла
+
+
+def start_index_watcher():
+    """Опрос faiss_index/CURRENT раз в INDEX_WATCH_INTERVAL секунд; в master перед fork не запускается."""
+    global _watcher
+    if not INDEX_WATCH_INTERVAL or _preloading or _watcher is not None:
+        return
+    _watcher = threading.Thread(target=_watch_index, name="index-watcher", daemon=True)
+    _watcher.start()
+
+
+def index_status():
+    return {
+        "current": current_index.info() if current_index else None,
+        "published": current_version(INDEX_DIR),
+        "versions": list_versions(INDEX_DIR),
+        "reload": index_reload.stats() if index_reload else None,
+        "watch_interval": INDEX_WATCH_INTERVAL,
+    }
+
+
+llm_pool = GigaChatPool(
+    CREDENTIALS,
+    token_file=GIGACHAT_TOKEN_CACHE_FILE,
+    timeout=GIGACHAT_TIMEOUT,
+    max_connections=GIGACHAT_MAX_CONNECTIONS,
+    verify_ssl_certs=False,
+    base_url=GIGACHAT_BASE_URL,
+    auth_url=GIGACHAT_AUTH_URL,
+    limits=LLM_LIMITS,
+    default_limit=LLM_DEFAULT_LIMIT,
+    policy=CallPolicy(
+        RetryPolicy(LLM_RETRY_ATTEMPTS, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_RETRY_BUDGET),
+        hedge_enabled=LLM_HEDGE_ENABLED,
+        hedge_quantile=LLM_HEDGE_QUANTILE,
+        hedge_min_delay=LLM_HEDGE_MIN_DELAY,
+        hedge_min_samples=LLM_HEDGE_MIN_SAMPLES,
+        budget=HedgeBudget(LLM_HEDGE_MAX_INFLIGHT, LLM_HEDGE_MAX_RATIO),
+    ),
+)
+
+
 def get_generator_llm():
-    return GigaChat(credentials=CREDENTIALS, model="GigaChat-Pro", temperature=0.7, verify_ssl_certs=False, timeout=120)
+    return llm_pool.chat_model("GigaChat-Pro", temperature=0.7)
 
 def get_critic_llm():
-    return GigaChat(credentials=CREDENTIALS, model="GigaChat-Max", temperature=0.2, verify_ssl_certs=False, timeout=120)
+    return llm_pool.chat_model("GigaChat-Max", temperature=0.2)
 
 def get_qa_llm():
-    return GigaChat(credentials=CREDENTIALS, model="GigaChat-Pro", temperature=0.4, verify_ssl_certs=False, timeout=120)
+    return llm_pool.chat_model("GigaChat-Pro", temperature=0.4)
+
+
+def cache_stats():
+    if not rag_warmup.ready:
+        return {"enabled": ANSWER_CACHE_ENABLED, "warmup": rag_warmup.status}
+    return current_index.answer_cache.stats() if current_index.answer_cache else {"enabled": False}
+
+
+def llm_stats():
+    return llm_pool.stats()
+
+
+def batch_stats():
+    return {"encoder": query_encoder.stats(), "searcher": index_searcher.stats()}
 
 
-def ask(question: str):
-    docs = vectorstore.similarity_search(question, k=5)
-    context = "\n\n".join([f"Источник: {d.metadata.get('title','?')}\n{d.page_content}" for d in docs])
-    llm = get_qa_llm()
-    response = (QA_PROMPT | llm).invoke({"context": context, "question": question})
+def embed_queries(texts):
+    """Эмбеддинги пачки запросов одним вызовом модели (для пакетной обработки)."""
+    rag_warmup.require()
+    return embeddings.embed_queries(list(texts))
+
+
+@contextmanager
+def _timed(timings, stage: str):
+    """Длительность стадии: в словарь timings (мс) и в гистограмму metrics с именем без суффикса _ms."""
+    started = time.perf_counter()
+    try:
+        with metrics.stage(stage[:-3] if stage.endswith("_ms") else stage):
+            yield
+    finally:
+        if timings is not None:
+            timings[stage] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def _lookup(cache_mode: str, text: str, query_vector=None):
+    """Точное и семантическое попадание в кэш ответов; возвращает (payload или None, вектор запроса)."""
+    answer_cache = _index().answer_cache
+    if answer_cache:
+        cached = answer_cache.get(cache_mode, text)
+        if cached:
+            metrics.cache_lookup("exact")
+            return cached, None
+    if query_vector is None:
+        with _timed(None, "embed_ms"):
+            query_vector = embed_query(text)
+    if answer_cache:
+        cached = answer_cache.get_similar(cache_mode, query_vector)
+        if cached:
+            metrics.cache_lookup("semantic")
+            return cached, query_vector
+        metrics.cache_lookup("miss")
+    return None, query_vector
+
+
+def _render(prompt, inputs: dict):
+    with _timed(None, "prompt_ms"):
+        return prompt.invoke(inputs)
+
+
+def _stream_text(llm, prompt_value, stage: str = None):
+    """Стримит ответ модели: события token, затем полный текст в событии text."""
+    parts = []
+    for chunk in llm.stream(prompt_value):
+        if chunk.content:
+            parts.append(chunk.content)
+            event = {"event": "token", "text": chunk.content}
+            if stage:
+                event["stage"] = stage
+            yield event
+    yield {"event": "text", "text": "".join(parts)}
+
+
+@_pin
+def ask(question: str, filters=None, query_vector=None, timings=None):
+    """Ответ на вопрос по базе статей.
+
+    query_vector — готовый эмбеддинг вопроса (пакетный режим), timings — словарь,
+    в который записываются длительности стадий в мс.
+    """
+    rag_warmup.require()
+    metrics.set_mode("qa")
+    filters = parse_filters(filters)
+    cache_mode = _cache_mode("qa", filters)
+    with _timed(timings, "cache_ms"):
+        cached, query_vector = _lookup(cache_mode, question, query_vector)
+    if cached:
+        return cached["answer"]
+
+    with _timed(timings, "retrieve_ms"):
+        packed = build_context(question, query_vector, QA_MAX_K, QA_CONTEXT_TOKENS, _qa_source, filters)
+    prompt_value = _render(QA_PROMPT, {"context": packed.text, "question": question})
+    with _timed(timings, "llm_ms"):
+        response = get_qa_llm().invoke(prompt_value)
+
+    _cache_put(cache_mode, question, query_vector, {"answer": response.content})
     return response.content
 
 
-def generate_hypotheses(problem: str):
-    docs = vectorstore.similarity_search(problem, k=10)
-    context = "\n\n".join([f"[{i+1}] {d.metadata.get('title','?')}\n{d.page_content}" for i, d in enumerate(docs)])
-    
-    raw_hypotheses = (GENERATOR_PROMPT | get_generator_llm()).invoke({
-        "problem": problem,
-        "context": context
-    }).content
-    
-    final_hypotheses = (CRITIC_PROMPT | get_critic_llm()).invoke({
-        "raw_hypotheses": raw_hypotheses,
-        "context": context
-    }).content
-    
-    return final_hypotheses, raw_hypotheses, docs
\ No newline at end of file
+@_pin
+def ask_stream(question: str, filters=None):
+    """Потоковый вариант ask: события {"event": "token", "text": ...}, в конце {"event": "done", "answer": ...}."""
+    rag_warmup.require()
+    metrics.set_mode("qa")
+    filters = parse_filters(filters)
+    cache_mode = _cache_mode("qa", filters)
+    cached, query_vector = _lookup(cache_mode, question)
+    if cached:
+        yield {"event": "token", "text": cached["answer"]}
+        yield {"event": "done", "answer": cached["answer"], "cached": True}
+        return
+
+    with _timed(None, "retrieve_ms"):
+        packed = build_context(question, query_vector, QA_MAX_K, QA_CONTEXT_TOKENS, _qa_source, filters)
+    prompt_value = _render(QA_PROMPT, {"context": packed.text, "question": question})
+    answer = ""
+    with _timed(None, "llm_ms"):
+        for event in _stream_text(get_qa_llm(), prompt_value):
+            if event["event"] == "text":
+                answer = event["text"]
+            else:
+                yield event
+
+    if answer:
+        _cache_put(cache_mode, question, query_vector, {"answer": answer})
+    yield {"event": "done", "answer": answer, "cached": False}
+
+
+@_pin
+def generate_hypotheses(problem: str, filters=None, query_vector=None, timings=None):
+    """Гипотезы по описанию проблемы: генератор, затем критик. Параметры query_vector и timings — как у ask."""
+    rag_warmup.require()
+    metrics.set_mode("hypothesis")
+    filters = parse_filters(filters)
+    cache_mode = _cache_mode("hypothesis", filters)
+    with _timed(timings, "cache_ms"):
+        cached, query_vector = _lookup(cache_mode, problem, query_vector)
+    if cached:
+        return _from_cached_hypotheses(cached)
+
+    with _timed(timings, "retrieve_ms"):
+        packed = build_context(problem, query_vector, HYPOTHESIS_MAX_K, HYPOTHESIS_CONTEXT_TOKENS, _hypothesis_source, filters)
+    context, docs = packed.text, packed.docs
+
+    prompt_value = _render(GENERATOR_PROMPT, {"problem": problem, "context": context})
+    with _timed(timings, "generator_ms"):
+        raw_hypotheses = get_generator_llm().invoke(prompt_value).content
+
+    prompt_value = _render(CRITIC_PROMPT, {"raw_hypotheses": raw_hypotheses, "context": context})
+    with _timed(timings, "critic_ms"):
+        final_hypotheses = get_critic_llm().invoke(prompt_value).content
+
+    _cache_put(cache_mode, problem, query_vector, _hypotheses_payload(final_hypotheses, raw_hypotheses, docs))
+    return final_hypotheses, raw_hypotheses, docs
+
+
+@_pin
+def generate_hypotheses_stream(problem: str, filters=None):
+    """Потоковый вариант generate_hypotheses.
+
+    События: stage (retrieving / generating / critiquing), sources, token (с полем stage),
+    в конце done с final, raw и docs.
+    """
+    rag_warmup.require()
+    metrics.set_mode("hypothesis")
+    filters = parse_filters(filters)
+    cache_mode = _cache_mode("hypothesis", filters)
+    yield {"event": "stage", "stage": "retrieving"}
+    cached, query_vector = _lookup(cache_mode, problem)
+    if cached:
+        final_hypotheses, raw_hypotheses, docs = _from_cached_hypotheses(cached)
+        yield {"event": "sources", "titles": _titles(docs)}
+        yield {"event": "token", "stage": "critiquing", "text": final_hypotheses}
+        yield {"event": "done", "final": final_hypotheses, "raw": raw_hypotheses, "docs": docs, "cached": True}
+        return
+
+    with _timed(None, "retrieve_ms"):
+        packed = build_context(problem, query_vector, HYPOTHESIS_MAX_K, HYPOTHESIS_CONTEXT_TOKENS, _hypothesis_source, filters)
+    context, docs = packed.text, packed.docs
+    yield {"event": "sources", "titles": _titles(docs)}
+
+    texts = {}
+    for stage, timing, prompt, llm, inputs in _hypothesis_stages(problem, context, texts):
+        yield {"event": "stage", "stage": stage}
+        prompt_value = _render(prompt, inputs())
+        with _timed(None, timing):
+            for event in _stream_text(llm, prompt_value, stage):
+                if event["event"] == "text":
+                    texts[stage] = event["text"]
+                else:
+                    yield event
+
+    raw_hypotheses, final_hypotheses = texts["generating"], texts["critiquing"]
+    if final_hypotheses:
+        _cache_put(cache_mode, problem, query_vector, _hypotheses_payload(final_hypotheses, raw_hypotheses, docs))
+    yield {"event": "done", "final": final_hypotheses, "raw": raw_hypotheses, "docs": docs, "cached": False}
+
+
+# Асинхронные варианты: LLM через ainvoke/astream, эмбеддинг, поиск и кэш — в пуле потоков
+
+
+async def _alookup(cache_mode: str, text: str):
+    return await asyncio.to_thread(_lookup, cache_mode, text)
+
+
+def _cache_put(cache_mode: str, text: str, query_vector, payload: dict):
+    # Ответ кладётся в кэш той версии индекса, по которой он построен
+    answer_cache = _index().answer_cache
+    if answer_cache:
+        answer_cache.put(cache_mode, text, query_vector, payload)
+
+
+async def _acache_put(cache_mode: str, text: str, query_vector, payload: dict):
+    if _index().answer_cache:
+        await asyncio.to_thread(_cache_put, cache_mode, text, query_vector, payload)
+
+
+async def _astream_text(llm, prompt_value, stage: str = None):
+    parts = []
+    async for chunk in llm.astream(prompt_value):
+        if chunk.content:
+            parts.append(chunk.content)
+            event = {"event": "token", "text": chunk.content}
+            if stage:
+                event["stage"] = stage
+            yield event
+    yield {"event": "text", "text": "".join(parts)}
+
+
+@_pin
+async def aask(question: str, filters=None):
+    rag_warmup.require()
+    metrics.set_mode("qa")
+    filters = parse_filters(filters)
+    cache_mode = _cache_mode("qa", filters)
+    cached, query_vector = await _alookup(cache_mode, question)
+    if cached:
+        return cached["answer"]
+
+    with _timed(None, "retrieve_ms"):
+        packed = await asyncio.to_thread(build_context, question, query_vector, QA_MAX_K, QA_CONTEXT_TOKENS, _qa_source, filters)
+    prompt_value = _render(QA_PROMPT, {"context": packed.text, "question": question})
+    with _timed(None, "llm_ms"):
+        response = await get_qa_llm().ainvoke(prompt_value)
+
+    await _acache_put(cache_mode, question, query_vector, {"answer": response.content})
+    return response.content
+
+
+@_pin
+async def aask_stream(question: str, filters=None):
+    """Асинхронный вариант ask_stream, события те же."""
+    rag_warmup.require()
+    metrics.set_mode("qa")
+    filters = parse_filters(filters)
+    cache_mode = _cache_mode("qa", filters)
+    cached, query_vector = await _alookup(cache_mode, question)
+    if cached:
+        yield {"event": "token", "text": cached["answer"]}
+        yield {"event": "done", "answer": cached["answer"], "cached": True}
+        return
+
+    with _timed(None, "retrieve_ms"):
+        packed = await asyncio.to_thread(build_context, question, query_vector, QA_MAX_K, QA_CONTEXT_TOKENS, _qa_source, filters)
+    prompt_value = _render(QA_PROMPT, {"context": packed.text, "question": question})
+    answer = ""
+    with _timed(None, "llm_ms"):
+        async for event in _astream_text(get_qa_llm(), prompt_value):
+            if event["event"] == "text":
+                answer = event["text"]
+            else:
+                yield event
+
+    if answer:
+        await _acache_put(cache_mode, question, query_vector, {"answer": answer})
+    yield {"event": "done", "answer": answer, "cached": False}
+
+
+@_pin
+async def agenerate_hypotheses(problem: str, filters=None):
+    rag_warmup.require()
+    metrics.set_mode("hypothesis")
+    filters = parse_filters(filters)
+    cache_mode = _cache_mode("hypothesis", filters)
+    cached, query_vector = await _alookup(cache_mode, problem)
+    if cached:
+        return _from_cached_hypotheses(cached)
+
+    with _timed(None, "retrieve_ms"):
+        packed = await asyncio.to_thread(
+            build_context, problem, query_vector, HYPOTHESIS_MAX_K, HYPOTHESIS_CONTEXT_TOKENS, _hypothesis_source, filters
+        )
+    context, docs = packed.text, packed.docs
+
+    prompt_value = _render(GENERATOR_PROMPT, {"problem": problem, "context": context})
+    with _timed(None, "generator_ms"):
+        raw_hypotheses = (await get_generator_llm().ainvoke(prompt_value)).content
+
+    prompt_value = _render(CRITIC_PROMPT, {"raw_hypotheses": raw_hypotheses, "context": context})
+    with _timed(None, "critic_ms"):
+        final_hypotheses = (await get_critic_llm().ainvoke(prompt_value)).content
+
+    await _acache_put(cache_mode, problem, query_vector, _hypotheses_payload(final_hypotheses, raw_hypotheses, docs))
+    return final_hypotheses, raw_hypotheses, docs
+
+
+@_pin
+async def agenerate_hypotheses_stream(problem: str, filters=None):
+    """Асинхронный вариант generate_hypotheses_stream, события те же."""
+    rag_warmup.require()
+    metrics.set_mode("hypothesis")
+    filters = parse_filters(filters)
+    cache_mode = _cache_mode("hypothesis", filters)
+    yield {"event": "stage", "stage": "retrieving"}
+    cached, query_vector = await _alookup(cache_mode, problem)
+    if cached:
+        final_hypotheses, raw_hypotheses, docs = _from_cached_hypotheses(cached)
+        yield {"event": "sources", "titles": _titles(docs)}
+        yield {"event": "token", "stage": "critiquing", "text": final_hypotheses}
+        yield {"event": "done", "final": final_hypotheses, "raw": raw_hypotheses, "docs": docs, "cached": True}
+        return
+
+    with _timed(None, "retrieve_ms"):
+        packed = await asyncio.to_thread(
+            build_context, problem, query_vector, HYPOTHESIS_MAX_K, HYPOTHESIS_CONTEXT_TOKENS, _hypothesis_source, filters
+        )
+    context, docs = packed.text, packed.docs
+    yield {"event": "sources", "titles": _titles(docs)}
+
+    texts = {}
+    for stage, timing, prompt, llm, inputs in _hypothesis_stages(problem, context, texts):
+        yield {"event": "stage", "stage": stage}
+        prompt_value = _render(prompt, inputs())
+        with _timed(None, timing):
+            async for event in _astream_text(llm, prompt_value, stage):
+                if event["event"] == "text":
+                    texts[stage] = event["text"]
+                else:
+                    yield event
+
+    raw_hypotheses, final_hypotheses = texts["generating"], texts["critiquing"]
+    if final_hypotheses:
+        await _acache_put(cache_mode, problem, query_vector, _hypotheses_payload(final_hypotheses, raw_hypotheses, docs))
+    yield {"event": "done", "final": final_hypotheses, "raw": raw_hypotheses, "docs": docs, "cached": False}
+
+
+def _hypothesis_stages(problem: str, context: str, texts: dict):
+    """Стадии потоковой генерации гипотез: (событие stage, метрика, промпт, модель, входы промпта)."""
+    return [
+        ("generating", "generator_ms", GENERATOR_PROMPT, get_generator_llm(),
+         lambda: {"problem": problem, "context": context}),
+        ("critiquing", "critic_ms", CRITIC_PROMPT, get_critic_llm(),
+         lambda: {"raw_hypotheses": texts["generating"], "context": context}),
+    ]
+
+
+def _titles(docs):
+    return [d.metadata.get("title", "Без названия") for d in docs]
+
+
+def _hypotheses_payload(final_hypotheses: str, raw_hypotheses: str, docs):
+    return {
+        "final": final_hypotheses,
+        "raw": raw_hypotheses,
+        "docs": [{"page_content": d.page_content, "metadata": d.metadata} for d in docs],
+    }
+
+
+def _from_cached_hypotheses(cached: dict):
+    docs = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in cached["docs"]]
+    return cached["final"], cached["raw"], docs
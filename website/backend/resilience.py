@@ -0,0 +1,340 @@
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Callable, Dict, Optional
+
+import httpx
+import numpy as np
+from gigachat.exceptions import AuthenticationError, ResponseError
+
+from limiter import LLMOverloaded, ModelLimiter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, AuthenticationError):
+        return False  # токен обновляет сам клиент
+    if isinstance(exc, ResponseError):
+        return len(exc.args) > 1 and exc.args[1] in RETRYABLE_STATUSES
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError))
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    headers = exc.args[3] if isinstance(exc, ResponseError) and len(exc.args) > 3 else None
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Экспоненциальная задержка с полным джиттером; Retry-After от сервера имеет приоритет."""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0, budget: float = 180.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def delay(self, attempt: int, exc: Exception) -> float:
+        server = _retry_after(exc)
+        if server is not None:
+            return min(server, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, attempt: int, exc: Exception, started: float) -> Optional[float]:
+        """Задержка перед следующей попыткой или None, если повторять не нужно."""
+        if attempt + 1 >= self.attempts or not is_retryable(exc):
+            return None
+        delay = self.delay(attempt, exc)
+        if time.perf_counter() - started + delay > self.budget:
+            return None
+        return delay
+
+
+class LatencyTracker:
+    def __init__(self, quantile: float = 0.95, min_samples: int = 20, window: int = 500):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def threshold(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            return float(np.quantile(np.asarray(self._samples), self.quantile))
+
+
+class HedgeBudget:
+    """Глобальный лимит хеджей: не больше max_inflight одновременно и не больше max_ratio от всех вызовов."""
+
+    def __init__(self, max_inflight: int = 2, max_ratio: float = 0.1):
+        self.max_inflight = max_inflight
+        self.max_ratio = max_ratio
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._requests = 0
+        self._hedges = 0
+
+    def record_request(self):
+        with self._lock:
+            self._requests += 1
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._inflight >= self.max_inflight or self._hedges + 1 > self.max_ratio * self._requests:
+                return False
+            self._inflight += 1
+            self._hedges += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+
+
+class CallPolicy:
+    """Повторы с джиттером и хеджирование вызовов LLM.
+
+    Хедж — дубль запроса, отправленный, если основной не ответил за p95 задержки
+    этого профиля; побеждает первый успешный ответ. Слот лимитера модели занимается
+    до отправки основного запроса (в потоке вызывающего), поэтому ни ожидание слота,
+    ни очередь пула хеджей не входят ни в задержку хеджа, ни в p95. Хеджи слота
+    не ждут: нет свободного — хеджа не будет; ещё они ограничены HedgeBudget.
+    """
+
+    def __init__(self, retry: RetryPolicy, hedge_enabled: bool = False, hedge_quantile: float = 0.95,
+                 hedge_min_delay: float = 2.0, hedge_min_samples: int = 20, budget: HedgeBudget = None):
+        self.retry = retry
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.budget = budget or HedgeBudget()
+        self._trackers: Dict[str, LatencyTracker] = {}
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge") if hedge_enabled else None
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+
+    def _incr(self, name: str):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+    def tracker(self, key: str) -> LatencyTracker:
+        with self._lock:
+            if key not in self._trackers:
+                self._trackers[key] = LatencyTracker(self.hedge_quantile, self.hedge_min_samples)
+            return self._trackers[key]
+
+    def _hedge_delay(self, key: str) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        threshold = self.tracker(key).threshold()
+        return max(threshold, self.hedge_min_delay) if threshold is not None else None
+
+    def run(self, key: str, call: Callable[[bool], object], limiter: ModelLimiter = None):
+        """Синхронный вызов call(hedge) с повторами и хеджированием; каждая попытка — в слоте limiter."""
+        started = time.perf_counter()
+        for attempt in range(self.retry.attempts):
+            try:
+                self.budget.record_request()
+                return self._hedged(key, call, limiter)
+            except Exception as e:
+                delay = self.retry.next_delay(attempt, e, started)
+                if delay is None:
+                    raise
+                self._incr("retries")
+                logger.warning(f"{key}: попытка {attempt + 1} не удалась ({e!r}), повтор через {delay:.2f} с")
+                time.sleep(delay)
+
+    @staticmethod
+    def _call_in_slot(limiter: Optional[ModelLimiter], call, hedge: bool):
+        # Слот уже занят вызывающим; освобождается, когда завершится сам вызов
+        try:
+            return call(hedge)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    def _try_hedge_slot(self, limiter: Optional[ModelLimiter]) -> bool:
+        if not self.budget.try_acquire():
+            return False
+        try:
+            if limiter is not None:
+                limiter.acquire(0)
+        except LLMOverloaded:
+            self.budget.release()
+            return False
+        return True
+
+    def _hedged(self, key: str, call, limiter: ModelLimiter = None):
+        delay = self._hedge_delay(key)
+        if limiter is not None:
+            limiter.acquire()
+        started = time.perf_counter()
+        if delay is None:
+            result = self._call_in_slot(limiter, call, False)
+        else:
+            result = self._race(key, call, limiter, delay)
+        self.tracker(key).record(time.perf_counter() - started)
+        return result
+
+    def _race(self, key: str, call, limiter: Optional[ModelLimiter], delay: float):
+        # Контекст копируется, чтобы метки и спаны вызова в пуле относились к исходному запросу
+        primary = self._executor.submit(contextvars.copy_context().run, self._call_in_slot, limiter, call, False)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        if not self._try_hedge_slot(limiter):
+            self._incr("hedges_skipped")
+            return primary.result()
+
+        self._incr("hedges")
+        logger.info(f"{key}: нет ответа за {delay:.1f} с, отправляю хедж")
+        hedge = self._executor.submit(contextvars.copy_context().run, self._run_hedge, limiter, call)
+        pending = {primary, hedge}
+        errors = {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._incr("hedge_wins")
+                    return future.result()
+                errors[future] = future.exception()
+        raise errors.get(primary) or errors[hedge]
+
+    def _run_hedge(self, limiter: Optional[ModelLimiter], call):
+        try:
+            return self._call_in_slot(limiter, call, True)
+        finally:
+            self.budget.release()
+
+    async def arun(self, key: str, acall: Callable[[bool], object], limiter: ModelLimiter = None):
+        """Асинхронный вариант run: acall(hedge) возвращает корутину."""
+        started = time.perf_counter()
+        for attempt in range(self.retry.attempts):
+            try:
+                self.budget.record_request()
+                return await self._ahedged(key, acall, limiter)
+            except Exception as e:
+                delay = self.retry.next_delay(attempt, e, started)
+                if delay is None:
+                    raise
+                self._incr("retries")
+                logger.warning(f"{key}: попытка {attempt + 1} не удалась ({e!r}), повтор через {delay:.2f} с")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _acall_in_slot(limiter: Optional[ModelLimiter], acall, hedge: bool):
+        try:
+            return await acall(hedge)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    async def _ahedged(self, key: str, acall, limiter: ModelLimiter = None):
+        delay = self._hedge_delay(key)
+        if limiter is not None:
+            await limiter.aacquire()
+        started = time.perf_counter()
+        if delay is None:
+            result = await self._acall_in_slot(limiter, acall, False)
+        else:
+            result = await self._arace(key, acall, limiter, delay)
+        self.tracker(key).record(time.perf_counter() - started)
+        return result
+
+    async def _arace(self, key: str, acall, limiter: Optional[ModelLimiter], delay: float):
+        primary = asyncio.ensure_future(self._acall_in_slot(limiter, acall, False))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        if not self._try_hedge_slot(limiter):
+            self._incr("hedges_skipped")
+            return await primary
+
+        self._incr("hedges")
+        logger.info(f"{key}: нет ответа за {delay:.1f} с, отправляю хедж")
+        hedge = asyncio.ensure_future(self._arun_hedge(limiter, acall))
+        pending = {primary, hedge}
+        errors = {}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._incr("hedge_wins")
+                        return task.result()
+                    errors[task] = task.exception()
+            raise errors.get(primary) or errors[hedge]
+        finally:
+            for task in pending:
+                task.cancel()  # в отличие от синхронного варианта проигравший запрос можно оборвать
+
+    async def _arun_hedge(self, limiter: Optional[ModelLimiter], acall):
+        try:
+            return await self._acall_in_slot(limiter, acall, True)
+        finally:
+            self.budget.release()
+
+    def retry_stream(self, key: str, stream_fn: Callable[[], object]):
+        """Повторяет стрим, только пока не отдан ни один фрагмент; хеджирование к стримам не применяется."""
+        started = time.perf_counter()
+        for attempt in range(self.retry.attempts):
+            yielded = False
+            try:
+                for chunk in stream_fn():
+                    yielded = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if yielded else self.retry.next_delay(attempt, e, started)
+                if delay is None:
+                    raise
+                self._incr("retries")
+                logger.warning(f"{key}: стрим не начался ({e!r}), повтор через {delay:.2f} с")
+                time.sleep(delay)
+
+    async def aretry_stream(self, key: str, stream_fn: Callable[[], object]):
+        started = time.perf_counter()
+        for attempt in range(self.retry.attempts):
+            yielded = False
+            try:
+                async for chunk in stream_fn():
+                    yielded = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if yielded else self.retry.next_delay(attempt, e, started)
+                if delay is None:
+                    raise
+                self._incr("retries")
+                logger.warning(f"{key}: стрим не начался ({e!r}), повтор через {delay:.2f} с")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+            keys = list(self._trackers)
+        return {
+            **counters,
+            "hedge_enabled": self.hedge_enabled,
+            "hedge_inflight": self.budget._inflight,
+            "hedge_delay_s": {key: self._hedge_delay(key) for key in keys},
+        }
@@ -0,0 +1,184 @@
+"""Пакетный прогон вопросов или проблем через ask() / generate_hypotheses().
+
+Вход — JSONL, по объекту на строку: {"id": ..., "text": ..., "filters": {...}}
+(вместо text можно question или problem). Результаты дописываются в выходной JSONL
+по мере готовности, поэтому прерванный прогон продолжается с места остановки.
+
+    python -m scripts.batch_run --input questions.jsonl --output answers.jsonl --mode qa --concurrency 4
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+TEXT_KEYS = ("text", "question", "problem")
+
+
+def read_items(path: Path) -> List[Dict]:
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            raw = json.loads(line)
+            text = next((raw[key] for key in TEXT_KEYS if raw.get(key)), None)
+            if not text:
+                logger.warning(f"Строка {line_no}: нет поля text/question/problem, пропускаю")
+                continue
+            items.append({"id": str(raw.get("id", line_no)), "text": text, "filters": raw.get("filters")})
+    return items
+
+
+def read_done(path: Path, retry_failed: bool) -> set:
+    """id уже обработанных записей из выходного файла (контрольная точка)."""
+    done = set()
+    if not path.exists():
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # недописанная строка после аварийной остановки
+            if retry_failed and record.get("error"):
+                continue
+            done.add(record["id"])
+    return done
+
+
+def process(rag, mode: str, item: Dict, vector, embed_ms: float) -> Dict:
+    timings = {"embed_ms": embed_ms}
+    record = {"id": item["id"], "mode": mode, "text": item["text"], "filters": item["filters"]}
+    started = time.perf_counter()
+    try:
+        if mode == "qa":
+            record["answer"] = rag.ask(item["text"], filters=item["filters"], query_vector=vector, timings=timings)
+        else:
+            final, raw, docs = rag.generate_hypotheses(
+                item["text"], filters=item["filters"], query_vector=vector, timings=timings
+            )
+            record["final"] = final
+            record["raw"] = raw
+            record["sources"] = [
+                {"title": d.metadata.get("title"), "doi": d.metadata.get("doi"), "score": d.metadata.get("score")}
+                for d in docs
+            ]
+        record["error"] = None
+    except Exception as e:
+        logger.error(f"{item['id']}: {e!r}")
+        record["error"] = repr(e)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000 + embed_ms, 2)
+    record["timings"] = timings
+    return record
+
+
+def summarize(records: List[Dict], wall_seconds: float) -> Dict:
+    ok = [r for r in records if not r["error"]]
+    stages = sorted({stage for r in ok for stage in r["timings"]})
+    summary = {
+        "processed": len(records),
+        "ok": len(ok),
+        "failed": len(records) - len(ok),
+        "wall_seconds": round(wall_seconds, 2),
+        "throughput_per_min": round(len(records) / wall_seconds * 60, 2) if wall_seconds else None,
+        "stages_ms": {},
+    }
+    for stage in stages:
+        values = np.asarray([r["timings"][stage] for r in ok if stage in r["timings"]])
+        summary["stages_ms"][stage] = {
+            "n": len(values),
+            "mean": round(float(values.mean()), 2),
+            "p50": round(float(np.percentile(values, 50)), 2),
+            "p95": round(float(np.percentile(values, 95)), 2),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный прогон ask / generate_hypotheses с контрольными точками")
+    parser.add_argument("--input", type=Path, required=True)
+    parser.add_argument("--output", type=Path, required=True, help="JSONL с результатами, он же контрольная точка")
+    parser.add_argument("--mode", choices=["qa", "hypothesis"], default="qa")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных запросов к LLM")
+    parser.add_argument("--batch-size", type=int, default=32, help="запросов в одном вызове модели эмбеддингов")
+    parser.add_argument("--no-cache", action="store_true", help="не читать и не пополнять кэш ответов")
+    parser.add_argument("--retry-failed", action="store_true", help="повторить записи, завершившиеся ошибкой")
+    parser.add_argument("--summary", type=Path, help="куда сохранить итоговую статистику (JSON)")
+    args = parser.parse_args()
+
+    items = read_items(args.input)
+    done = read_done(args.output, args.retry_failed)
+    pending = [item for item in items if item["id"] not in done]
+    logger.info(f"Всего {len(items)}, уже готово {len(items) - len(pending)}, к обработке {len(pending)}")
+    if not pending:
+        return
+
+    import rag
+    rag.rag_warmup.run()
+    if args.no_cache:
+        rag.current_index.answer_cache = None
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    write_lock = threading.Lock()
+    records = []
+    started = time.perf_counter()
+
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        def write(record):
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                records.append(record)
+                if len(records) % 10 == 0 or len(records) == len(pending):
+                    elapsed = time.perf_counter() - started
+                    logger.info(f"Готово {len(records)}/{len(pending)} ({len(records) / elapsed * 60:.1f} в мин)")
+
+        in_flight = set()
+        try:
+            for offset in range(0, len(pending), args.batch_size):
+                # Следующую пачку кодируем, пока LLM занята предыдущей, но не убегаем далеко вперёд
+                while len(in_flight) > args.concurrency * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        write(future.result())
+
+                batch = pending[offset:offset + args.batch_size]
+                t0 = time.perf_counter()
+                vectors = rag.embed_queries([item["text"] for item in batch])
+                embed_ms = round((time.perf_counter() - t0) * 1000 / len(batch), 2)
+                for item, vector in zip(batch, vectors):
+                    in_flight.add(pool.submit(process, rag, args.mode, item, np.asarray(vector, dtype=np.float32), embed_ms))
+
+            for future in as_completed(in_flight):
+                write(future.result())
+        except KeyboardInterrupt:
+            logger.warning("Прервано: готовые результаты сохранены, повторный запуск продолжит с этого места")
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    summary = summarize(records, time.perf_counter() - started)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Бенчмарк ANN-индексов FAISS: recall@k относительно точного Flat и задержки p50/p99.
+
+Корпуса синтетические (смесь гауссиан на единичной сфере, как у нормализованных e5-векторов),
+поэтому бенчмарк не требует модели эмбеддингов.
+
+    python -m scripts.bench_ann --sizes 10000 100000 1000000 --dim 256
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from index_factory import build_index, default_nlist  # noqa: E402
+
+
+def synthetic_corpus(n: int, dim: int, n_queries: int, seed: int):
+    rng = np.random.default_rng(seed)
+    n_clusters = max(16, int(np.sqrt(n)))
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, n_clusters, n)
+    vectors = centers[assignment] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picked = rng.choice(n, n_queries, replace=False)
+    queries = vectors[picked] + 0.1 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+
+def specs_for(n: int) -> List[Dict]:
+    nlist = default_nlist(n)
+    specs = [{"type": "flat"}]
+    for m in (16, 32):
+        for ef in (32, 64, 128):
+            specs.append({"type": "hnsw", "M": m, "efConstruction": 200, "efSearch": ef})
+    for nprobe in (1, 8, 32):
+        specs.append({"type": "ivf", "nlist": nlist, "nprobe": min(nprobe, nlist)})
+    return specs
+
+
+def measure(index, queries: np.ndarray, k: int):
+    latencies = []
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        t0 = time.perf_counter()
+        _, found = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        ids[i] = found[0]
+    return ids, latencies
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall и задержки Flat / HNSW / IVF на синтетических корпусах")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=256, help="1024 для e5-large (1M векторов ~ 4 ГБ)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=1, help="потоки FAISS (1 — как на один запрос)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    import faiss
+    faiss.omp_set_num_threads(args.threads)
+
+    report = []
+    for n in args.sizes:
+        print(f"\nКорпус: {n} векторов, размерность {args.dim}")
+        vectors, queries = synthetic_corpus(n, args.dim, args.queries, args.seed)
+        truth = None
+        for spec in specs_for(n):
+            t0 = time.perf_counter()
+            index = build_index(dict(spec), vectors)
+            build_seconds = time.perf_counter() - t0
+            ids, latencies = measure(index, queries, args.k)
+            if spec["type"] == "flat":
+                truth = ids
+            row = {
+                "n": n,
+                "dim": args.dim,
+                "spec": spec,
+                "build_seconds": round(build_seconds, 2),
+                f"recall@{args.k}": round(recall_at_k(ids, truth), 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            }
+            report.append(row)
+            params = ", ".join(f"{key}={value}" for key, value in spec.items() if key != "type")
+            print(f"  {spec['type']:<5} {params:<40} recall={row[f'recall@{args.k}']:<7} "
+                  f"p50={row['p50_ms']:<8} p99={row['p99_ms']:<8} build={row['build_seconds']}s")
+            del index
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nОтчёт сохранён: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
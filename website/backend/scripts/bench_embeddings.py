@@ -0,0 +1,159 @@
+"""Сравнение бэкендов эмбеддингов запросов: PyTorch (sentence-transformers) против ONNX Runtime int8.
+
+Каждый бэкенд запускается в отдельном процессе, чтобы честно измерить RSS.
+Запросы берутся из data/clean.jsonl (заголовки и первые предложения чанков).
+
+    python -m scripts.bench_embeddings --queries 200 --k 10
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from settings.config import CHUNKS_FILE, ONNX_MODEL_DIR, ONNX_THREADS  # noqa: E402
+
+
+def rss_mb() -> float:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def load_queries(path: Path, n: int, seed: int) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        chunks = [json.loads(line) for line in f if line.strip()]
+    random.Random(seed).shuffle(chunks)
+    queries = []
+    for chunk in chunks[:n]:
+        text = chunk["chunk_text"]
+        abstract = text.split("Abstract:", 1)[-1].strip()
+        queries.append(abstract.split(". ")[0][:300] or chunk.get("title", ""))
+    return queries
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_worker(backend: str, index_dir: Path, chunks_file: Path, n: int, k: int, seed: int) -> Dict:
+    from index_factory import apply_search_params, read_index_mmap, search_parameters
+    from metadata_filter import COLUMNS_FILE, MetadataColumns, make_selector
+    from index_manifest import INDEX_FILE, load_manifest, load_embeddings
+    from index_versions import resolve_index_dir
+
+    rss_start = rss_mb()
+    started = time.perf_counter()
+    index_dir = resolve_index_dir(index_dir)
+    manifest = load_manifest(index_dir)
+    if not manifest.get("docstore"):
+        raise SystemExit(f"Индекс {index_dir} в старом формате, сначала: python -m scripts.convert_index")
+    embeddings = load_embeddings(manifest, backend=backend, onnx_dir=BACKEND_DIR / ONNX_MODEL_DIR, num_threads=ONNX_THREADS)
+    load_seconds = time.perf_counter() - started
+    index = read_index_mmap(index_dir / manifest.get("index_file", INDEX_FILE))
+    apply_search_params(index, manifest.get("index_spec"))
+    # Надгробия (удалённые и повторные чанки) в выдачу не попадают, как в rag.py
+    live = MetadataColumns.load(index_dir).mask(None) if (index_dir / COLUMNS_FILE).exists() else None
+    params = search_parameters(index, make_selector(live)) if live is not None else None
+
+    queries = load_queries(chunks_file, n, seed)
+    embeddings.embed_query(queries[0])  # прогрев
+
+    latencies, hits = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        vector = embeddings.embed_query(query)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        _, ids = index.search(np.asarray([vector], dtype=np.float32), k, params=params)
+        hits.append(ids[0].tolist())
+
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "rss_mb": round(rss_mb(), 1),
+        "rss_model_mb": round(rss_mb() - rss_start, 1),
+        "latency_ms": {
+            "mean": round(float(np.mean(latencies)), 2),
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+        },
+        "hits": hits,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк эмбеддингов запросов: torch vs onnx")
+    parser.add_argument("--index-dir", type=Path, default=BACKEND_DIR / "faiss_index")
+    parser.add_argument("--chunks", type=Path, default=CHUNKS_FILE)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"])
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", type=Path, help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_worker(args.worker, args.index_dir, args.chunks, args.queries, args.k, args.seed)
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for backend in args.backends:
+        print(f"Запуск бэкенда {backend}...")
+        proc = subprocess.run(
+            [sys.executable, "-m", "scripts.bench_embeddings", "--worker", backend,
+             "--index-dir", str(args.index_dir), "--chunks", str(args.chunks), "--queries", str(args.queries),
+             "--k", str(args.k), "--seed", str(args.seed)],
+            cwd=str(BACKEND_DIR), capture_output=True, text=True, env=os.environ.copy()
+        )
+        if proc.returncode != 0:
+            print(proc.stderr)
+            sys.exit(f"Бэкенд {backend} завершился с ошибкой")
+        results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    report = {"queries": args.queries, "k": args.k, "backends": {}}
+    for backend, result in results.items():
+        report["backends"][backend] = {key: value for key, value in result.items() if key != "hits"}
+
+    if "torch" in results:
+        reference = results["torch"]["hits"]
+        for backend, result in results.items():
+            if backend == "torch":
+                continue
+            overlaps = [len(set(a) & set(b)) / args.k for a, b in zip(reference, result["hits"])]
+            top1 = [a[0] == b[0] for a, b in zip(reference, result["hits"])]
+            report["backends"][backend]["topk_overlap"] = round(float(np.mean(overlaps)), 4)
+            report["backends"][backend]["top1_agreement"] = round(float(np.mean(top1)), 4)
+
+    print("\n" + "=" * 60)
+    print(f"{'бэкенд':<8} {'загрузка, с':>12} {'RSS, МБ':>9} {'p50, мс':>9} {'p95, мс':>9} {'overlap@k':>10}")
+    for backend, row in report["backends"].items():
+        print(f"{backend:<8} {row['load_seconds']:>12} {row['rss_mb']:>9} {row['latency_ms']['p50']:>9} "
+              f"{row['latency_ms']['p95']:>9} {row.get('topk_overlap', 1.0):>10}")
+    print("=" * 60)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Отчёт сохранён: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
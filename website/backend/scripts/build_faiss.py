@@ -1,14 +1,25 @@
+import argparse
 import json
 from pathlib import Path
 from typing import List, Dict, Optional
-from langchain_community.vectorstores import FAISS
+import faiss
+import numpy as np
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
 import logging
 import sys
+import time
+import shutil
 import torch
 from datetime import datetime
-from settings.config import FAISS_DIR, CHUNKS_FILE
+from settings.config import FAISS_DIR, CHUNKS_FILE, INDEX_KEEP_VERSIONS, INDEX_COMPACT_THRESHOLD
+from index_manifest import MANIFEST_FILE, INDEX_FILE, ManifestEmbeddings, prefixes_for
+from index_factory import DEFAULT_SPECS, make_spec, build_index
+from docstore import DOCSTORE_FILE, dedup_chunks, write_docstore
+from metadata_filter import COLUMNS_FILE, MetadataColumns
+from bm25 import VOCAB_FILE, BM25Index
+from index_versions import new_version_dir, publish, prune, resolve_index_dir
+from index_update import update_index
 
 
 logging.basicConfig(
@@ -21,12 +32,6 @@ logger = logging.getLogger(__name__)
 
 FAISS_DIR.mkdir(exist_ok=True, parents=True)
 
-
-if not CHUNKS_FILE.exists():
-    logger.error(f"Файл не найден: {CHUNKS_FILE}")
-    logger.info("Сначала запустите clean_and_split.py")
-    sys.exit(1)
-
 def load_chunks(file_path: Path, min_length: int = 100) -> List[Document]:
     documents = []
     stats = {
@@ -86,63 +91,175 @@ def load_chunks(file_path: Path, min_length: int = 100) -> List[Document]:
                 if stats["errors"] <= 5:
                     logger.warning(f"Ошибка в строке {line_num}: {e}")
     
+    # В корпусе встречаются повторы chunk_id с тем же текстом; docstore хранит chunk_id уникальным
+    unique = dedup_chunks(documents)
+    stats["skipped_duplicate"] = len(documents) - len(unique)
+    stats["loaded"] -= stats["skipped_duplicate"]
+    documents = unique
+    
     logger.info(f"Загрузка завершена:")
     logger.info(f" Всего строк: {stats['total']}")
     logger.info(f" Успешно загружено: {stats['loaded']}")
     logger.info(f" Пропущено (короткие): {stats['skipped_short']}")
     logger.info(f" Пропущено (невалидные): {stats['skipped_invalid']}")
+    logger.info(f" Пропущено (повторы chunk_id): {stats['skipped_duplicate']}")
     logger.info(f" Ошибок: {stats['errors']}")
     
     return documents
 
-def create_faiss_index(documents: List[Document], faiss_dir: Path):
+# Размер батча кодирования чанков: полная сборка и --incremental кодируют одинаково
+ENCODE_BATCH_SIZE = 64
+
+def encode_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def create_faiss_index(documents: List[Document], faiss_dir: Path, index_spec: Optional[Dict] = None):
+    index_spec = index_spec or make_spec("flat")
     logger.info("Загрузка модели эмбеддингов...")
     
     model_name = "intfloat/multilingual-e5-large-instruct"
+    normalize = True
     
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = encode_device()
     logger.info(f"Используется устройство: {device}")
     
     try:
-        embeddings = HuggingFaceEmbeddings(
+        base_embeddings = HuggingFaceEmbeddings(
             model_name=model_name,
             model_kwargs={'device': device},
-            encode_kwargs={'normalize_embeddings': True, 'batch_size': 64}
+            encode_kwargs={'normalize_embeddings': normalize, 'batch_size': ENCODE_BATCH_SIZE}
         )
         logger.info(f"Модель '{model_name}' загружена")
     except Exception as e:
         logger.error(f"Ошибка загрузки модели: {e}")
         logger.info("Переключаюсь на альтернативную модель...")
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        normalize = False
+        base_embeddings = HuggingFaceEmbeddings(
+            model_name=model_name,
             model_kwargs={'device': device}
         )
     
-    logger.info("Создание FAISS индекса...")
+    query_prefix, passage_prefix = prefixes_for(model_name)
+    embeddings = ManifestEmbeddings(base_embeddings, query_prefix, passage_prefix)
+    
+    logger.info(f"Создание FAISS индекса: {index_spec}")
     
-    vectorstore = FAISS.from_documents(documents, embeddings)
-    vectorstore.save_local(str(faiss_dir))
+    build_started = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents([d.page_content for d in documents]), dtype=np.float32)
+    index = build_index(index_spec, vectors)
+    build_seconds = time.perf_counter() - build_started
+    # Вместо index.pkl: индекс читается через mmap, чанки лежат в SQLite и достаются только для top-k
+    faiss.write_index(index, str(faiss_dir / INDEX_FILE))
+    write_docstore(faiss_dir / DOCSTORE_FILE, documents)
+    MetadataColumns.from_metadata(d.metadata for d in documents).save(faiss_dir)
+    BM25Index.build(d.page_content for d in documents).save(faiss_dir)
+    legacy_pickle = faiss_dir / "index.pkl"
+    if legacy_pickle.exists():
+        legacy_pickle.unlink()
+    # rag.py загружает модель, нормализацию и префиксы строго по этому манифесту
     index_info = {
         "model_name": model_name,
+        "normalize_embeddings": normalize,
+        "query_prefix": query_prefix,
+        "passage_prefix": passage_prefix,
         "num_documents": len(documents),
-        "embedding_dimension": len(embeddings.embed_query("test")),
+        "embedding_dimension": index.d,
+        "index_spec": index_spec,
+        "index_file": INDEX_FILE,
+        "docstore": DOCSTORE_FILE,
+        "metadata_columns": COLUMNS_FILE,
+        "bm25": VOCAB_FILE,
         "created_at": datetime.now().isoformat(),
+        "build_seconds": round(build_seconds, 2),
         "device": device
     }
     
-    with open(faiss_dir / "index_info.json", "w", encoding="utf-8") as f:
+    with open(faiss_dir / MANIFEST_FILE, "w", encoding="utf-8") as f:
         json.dump(index_info, f, indent=2, ensure_ascii=False)
     
     logger.info(f"FAISS индекс создан: {len(documents)} документов")
-    return vectorstore
+    return index
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Построение FAISS индекса по clean.jsonl")
+    parser.add_argument("--index-type", choices=list(DEFAULT_SPECS), default="flat",
+                        help="flat — точный поиск, hnsw — граф, ivf — инвертированные списки")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW: число связей на узел (M)")
+    parser.add_argument("--ef-construction", type=int, help="HNSW: efConstruction при построении")
+    parser.add_argument("--ef-search", type=int, help="HNSW: efSearch при поиске")
+    parser.add_argument("--nlist", type=int, help="IVF: число списков (по умолчанию ~4*sqrt(N))")
+    parser.add_argument("--nprobe", type=int, help="IVF: число просматриваемых списков при поиске")
+    parser.add_argument("--keep", type=int, default=INDEX_KEEP_VERSIONS,
+                        help="сколько последних версий индекса оставить в faiss_index/versions")
+    parser.add_argument("--no-publish", action="store_true",
+                        help="собрать версию, но не делать её активной (CURRENT не меняется)")
+    parser.add_argument("--publish", metavar="VERSION",
+                        help="не собирать, а сделать активной уже собранную версию (например, после --no-publish)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="кодировать только новые и изменённые чанки относительно текущей версии")
+    parser.add_argument("--compact", action="store_true",
+                        help="с --incremental: уплотнить индекс (убрать надгробия) независимо от порога")
+    parser.add_argument("--compact-threshold", type=float, default=INDEX_COMPACT_THRESHOLD,
+                        help="с --incremental: доля надгробий, после которой индекс уплотняется")
+    return parser.parse_args()
+
+def publish_version(version: str, keep: int):
+    publish(FAISS_DIR, version)
+    logger.info(f"Активная версия: {version}")
+    removed = prune(FAISS_DIR, keep=keep)
+    if removed:
+        logger.info(f"Удалены старые версии: {', '.join(removed)}")
 
 def main():
+    args = parse_args()
+    if args.publish:
+        publish_version(args.publish, args.keep)
+        return
+    if not CHUNKS_FILE.exists():
+        logger.error(f"Файл не найден: {CHUNKS_FILE}")
+        logger.info("Сначала запустите clean_and_split.py")
+        sys.exit(1)
+    index_spec = make_spec(
+        args.index_type,
+        M=args.hnsw_m,
+        efConstruction=args.ef_construction,
+        efSearch=args.ef_search,
+        nlist=args.nlist,
+        nprobe=args.nprobe
+    )
     logger.info("СОЗДАНИЕ ВЕКТОРНОГО ИНДЕКСА ДЛЯ RAG-СИСТЕМЫ")
     documents = load_chunks(CHUNKS_FILE)
-    vectorstore = create_faiss_index(documents, FAISS_DIR)
+    # Каждая сборка — новая версия рядом с работающей; бэкенд переключится на неё после publish
+    base_dir = resolve_index_dir(FAISS_DIR)
+    if args.incremental and not (base_dir / MANIFEST_FILE).exists():
+        logger.warning(f"В {FAISS_DIR} нет индекса, инкрементальное обновление невозможно — полная сборка")
+        args.incremental = False
+    version_dir = new_version_dir(FAISS_DIR)
+    try:
+        if args.incremental:
+            # Тип индекса и модель берутся из текущей версии, --index-type и параметры игнорируются
+            stats = update_index(base_dir, version_dir, documents, args.compact_threshold, force_compact=args.compact,
+                                 device=encode_device(), batch_size=ENCODE_BATCH_SIZE)
+            if stats is None:
+                shutil.rmtree(version_dir)
+                logger.info(f"Корпус не изменился, активной остаётся {base_dir.name}")
+                return
+            logger.info(f"Инкрементальное обновление {base_dir.name} -> {version_dir.name}: {stats}")
+        else:
+            create_faiss_index(documents, version_dir, index_spec)
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
     logger.info("\nИндекс создан.")
-    logger.info(f"Папка: {FAISS_DIR}")
+    logger.info(f"Папка: {version_dir}")
     logger.info(f"Документов: {len(documents)}")
+    if args.no_publish:
+        logger.info(f"Версия {version_dir.name} не опубликована. Сделать активной: "
+                    f"python -m scripts.build_faiss --publish {version_dir.name}; "
+                    f"загрузить без публикации: POST /api/admin/reload_index с {{\"version\": \"{version_dir.name}\"}}")
+        return
+    publish_version(version_dir.name, args.keep)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""Переводит индекс старого формата (index.faiss + index.pkl) на SQLite-docstore без pickle.
+
+    python -m scripts.convert_index --index-dir faiss_index
+"""
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from langchain_community.vectorstores import FAISS  # noqa: E402
+from langchain_core.embeddings import FakeEmbeddings  # noqa: E402
+from index_manifest import MANIFEST_FILE, INDEX_FILE  # noqa: E402
+from docstore import DOCSTORE_FILE, SQLiteDocstore, unique_chunk_rows, write_docstore  # noqa: E402
+from metadata_filter import COLUMNS_FILE  # noqa: E402
+from bm25 import VOCAB_FILE  # noqa: E402
+from index_update import build_side_tables  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Конвертация index.pkl в docstore.sqlite3")
+    parser.add_argument("--index-dir", type=Path, default=BACKEND_DIR / "faiss_index")
+    parser.add_argument("--keep-pickle", action="store_true", help="не удалять index.pkl после конвертации")
+    args = parser.parse_args()
+
+    manifest_path = args.index_dir / MANIFEST_FILE
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    # Эмбеддинги для конвертации не нужны — только чтение pickle
+    store = FAISS.load_local(
+        str(args.index_dir), FakeEmbeddings(size=manifest.get("embedding_dimension", 1024)),
+        allow_dangerous_deserialization=True
+    )
+    documents = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(store.index.ntotal)]
+    # Повторы chunk_id остаются в FAISS надгробиями: векторы не удаляются, но в поиск не попадают
+    rows = unique_chunk_rows(documents)
+    write_docstore(args.index_dir / DOCSTORE_FILE, [documents[i] for i in rows], row_ids=rows)
+    docstore = SQLiteDocstore(args.index_dir / DOCSTORE_FILE)
+    columns, bm25 = build_side_tables(docstore, store.index.ntotal)
+    docstore.close()
+    columns.save(args.index_dir)
+    bm25.save(args.index_dir)
+    logger.info(f"Записано чанков: {len(rows)} из {len(documents)} -> {args.index_dir / DOCSTORE_FILE}")
+
+    manifest["index_file"] = INDEX_FILE
+    manifest["docstore"] = DOCSTORE_FILE
+    manifest["metadata_columns"] = COLUMNS_FILE
+    manifest["bm25"] = VOCAB_FILE
+    manifest["num_tombstones"] = store.index.ntotal - len(rows)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    if not args.keep_pickle:
+        (args.index_dir / "index.pkl").unlink()
+        logger.info("index.pkl удалён")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Нагрузочный тест бэкенда: виртуальные пользователи ведут сессии через /api/new_chat и /api/send_message.
+
+Сессия: новый чат → выбор режима («вопрос» или «гипотеза») → несколько сообщений с паузами
+на «чтение ответа». Тексты берутся из размеченных запросов benchmark/queries.jsonl, поэтому
+поиск по индексу выполняется по-настоящему. Чтобы не тратить квоту GigaChat, запустите
+бэкенд против заглушки (scripts/mock_gigachat.py, см. GIGACHAT_BASE_URL в settings/config.py).
+
+    python -m scripts.load_test --users 16 --duration 300 --hypothesis-share 0.2 --output load.json
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import requests
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERIES = BACKEND_DIR / "benchmark" / "queries.jsonl"
+MODE_MESSAGES = {"question": "вопрос", "hypothesis": "гипотеза"}
+
+
+def load_texts(path: Path) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["query"] for line in f if line.strip()]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records: List[Dict] = []
+        self.sessions = 0
+
+    def add(self, endpoint: str, status, latency_ms: float, error: str = None, ttfb_ms: float = None):
+        record = {"endpoint": endpoint, "status": status, "latency_ms": latency_ms, "error": error,
+                  "finished_at": time.perf_counter()}
+        if ttfb_ms is not None:
+            record["ttfb_ms"] = ttfb_ms
+        with self._lock:
+            self.records.append(record)
+
+    def session_done(self):
+        with self._lock:
+            self.sessions += 1
+
+
+class VirtualUser:
+    def __init__(self, n: int, args, texts: List[str], recorder: Recorder, deadline: float, sessions_left):
+        self.n = n
+        self.args = args
+        self.texts = texts
+        self.recorder = recorder
+        self.deadline = deadline
+        self.sessions_left = sessions_left
+        self.random = random.Random(args.seed + n)
+        self.http = requests.Session()
+        self.http.headers["X-User-ID"] = f"load-{uuid.uuid4().hex[:12]}"
+
+    def _post(self, endpoint: str, path: str, payload: Dict):
+        started = time.perf_counter()
+        try:
+            response = self.http.post(self.args.base_url + path, json=payload, timeout=self.args.timeout)
+        except requests.RequestException as e:
+            self.recorder.add(endpoint, None, (time.perf_counter() - started) * 1000, error=type(e).__name__)
+            return None
+        latency_ms = (time.perf_counter() - started) * 1000
+        error = None if response.ok else response.text[:200]
+        self.recorder.add(endpoint, response.status_code, latency_ms, error=error)
+        return response.json() if response.ok else None
+
+    def _post_stream(self, endpoint: str, payload: Dict) -> bool:
+        """SSE: latency — до события done, ttfb — до первого события token."""
+        started = time.perf_counter()
+        ttfb_ms, status, error = None, None, None
+        try:
+            with self.http.post(self.args.base_url + "/api/send_message_stream", json=payload,
+                                timeout=self.args.timeout, stream=True) as response:
+                status = response.status_code
+                if not response.ok:
+                    error = response.text[:200]
+                else:
+                    event = None
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line.startswith("event: "):
+                            event = line[len("event: "):]
+                            if event == "token" and ttfb_ms is None:
+                                ttfb_ms = (time.perf_counter() - started) * 1000
+                        elif line.startswith("data: ") and event == "error":
+                            error = line[len("data: "):][:200]
+                        if event in ("done", "error"):
+                            break
+        except requests.RequestException as e:
+            error = type(e).__name__
+        self.recorder.add(endpoint, status, (time.perf_counter() - started) * 1000, error=error, ttfb_ms=ttfb_ms)
+        return error is None
+
+    def _think(self):
+        if self.args.think_time > 0:
+            time.sleep(min(self.random.expovariate(1 / self.args.think_time), self.args.think_time * 5))
+
+    def _claim_session(self) -> bool:
+        if time.perf_counter() >= self.deadline:
+            return False
+        if self.sessions_left is None:
+            return True
+        with self.sessions_left["lock"]:
+            if self.sessions_left["n"] <= 0:
+                return False
+            self.sessions_left["n"] -= 1
+            return True
+
+    def run(self):
+        while self._claim_session():
+            mode = "hypothesis" if self.random.random() < self.args.hypothesis_share else "question"
+            chat = self._post("new_chat", "/api/new_chat", {"title": "Новый чат"})
+            if not chat:
+                self._think()
+                continue
+            chat_id = chat["chat_id"]
+            if not self._post("send_message:mode", "/api/send_message",
+                              {"chat_id": chat_id, "message": MODE_MESSAGES[mode]}):
+                continue
+            for _ in range(self.args.messages):
+                if time.perf_counter() >= self.deadline:
+                    break
+                self._think()
+                payload = {"chat_id": chat_id, "message": self.random.choice(self.texts)}
+                if self.random.random() < self.args.stream_share:
+                    ok = self._post_stream(f"send_message_stream:{mode}", payload)
+                else:
+                    ok = self._post(f"send_message:{mode}", "/api/send_message", payload) is not None
+                if not ok:
+                    break
+            self.recorder.session_done()
+
+
+def _percentiles(values) -> Dict:
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {}
+    return {
+        "mean": round(float(values.mean()), 1),
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+        "max": round(float(values.max()), 1),
+    }
+
+
+def summarize(recorder: Recorder, wall_seconds: float) -> Dict:
+    endpoints = {}
+    for endpoint in sorted({r["endpoint"] for r in recorder.records}):
+        rows = [r for r in recorder.records if r["endpoint"] == endpoint]
+        ok = [r for r in rows if r["error"] is None]
+        statuses = {}
+        for r in rows:
+            key = str(r["status"]) if r["status"] is not None else r["error"]
+            statuses[key] = statuses.get(key, 0) + 1
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "ok": len(ok),
+            "error_rate": round(1 - len(ok) / len(rows), 4),
+            "statuses": statuses,
+            "throughput_rps": round(len(ok) / wall_seconds, 3),
+            "latency_ms": _percentiles([r["latency_ms"] for r in ok]),
+        }
+        ttfb = [r["ttfb_ms"] for r in ok if r.get("ttfb_ms") is not None]
+        if ttfb:
+            endpoints[endpoint]["ttfb_ms"] = _percentiles(ttfb)
+    total_ok = sum(1 for r in recorder.records if r["error"] is None)
+    return {
+        "wall_seconds": round(wall_seconds, 1),
+        "sessions_completed": recorder.sessions,
+        "requests": len(recorder.records),
+        "throughput_rps": round(total_ok / wall_seconds, 3) if wall_seconds else None,
+        "endpoints": endpoints,
+    }
+
+
+def print_summary(summary: Dict):
+    print(f"\n{'endpoint':<32}{'n':>6}{'err%':>7}{'rps':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for endpoint, row in summary["endpoints"].items():
+        latency = row["latency_ms"]
+        print(f"{endpoint:<32}{row['requests']:>6}{row['error_rate'] * 100:>7.1f}{row['throughput_rps']:>8.2f}"
+              f"{latency.get('p50', '-'):>10}{latency.get('p95', '-'):>10}{latency.get('p99', '-'):>10}")
+    print(f"\nСессий: {summary['sessions_completed']}, запросов: {summary['requests']}, "
+          f"{summary['throughput_rps']} успешных в секунду за {summary['wall_seconds']} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /api/new_chat и /api/send_message")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--users", type=int, default=8, help="одновременных виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=120, help="длительность теста, с")
+    parser.add_argument("--sessions", type=int, help="остановиться после стольких сессий (вместе с --duration)")
+    parser.add_argument("--ramp-up", type=float, default=10, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--messages", type=int, default=3, help="сообщений в сессии после выбора режима")
+    parser.add_argument("--hypothesis-share", type=float, default=0.2, help="доля сессий в режиме гипотез")
+    parser.add_argument("--stream-share", type=float, default=0.0, help="доля сообщений через /api/send_message_stream")
+    parser.add_argument("--think-time", type=float, default=3.0, help="средняя пауза между сообщениями, с")
+    parser.add_argument("--queries", type=Path, default=DEFAULT_QUERIES)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, help="куда сохранить отчёт (JSON)")
+    args = parser.parse_args()
+
+    texts = load_texts(args.queries)
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    sessions_left = {"n": args.sessions, "lock": threading.Lock()} if args.sessions else None
+
+    threads = []
+    for n in range(args.users):
+        user = VirtualUser(n, args, texts, recorder, deadline, sessions_left)
+        thread = threading.Thread(target=user.run, name=f"user-{n}", daemon=True)
+        threads.append(thread)
+        thread.start()
+        time.sleep(args.ramp_up / args.users if args.users else 0)
+    logger.info(f"Запущено {args.users} пользователей против {args.base_url}, тест до {args.duration:.0f} с")
+
+    try:
+        for thread in threads:
+            # Запросы, начатые до дедлайна, дожидаемся (не дольше таймаута запроса)
+            thread.join(timeout=max(0.0, deadline - time.perf_counter()) + args.timeout)
+    except KeyboardInterrupt:
+        logger.warning("Прервано, считаю статистику по завершённым запросам")
+
+    summary = summarize(recorder, time.perf_counter() - started)
+    summary["config"] = {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()}
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        logger.info(f"Отчёт сохранён: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
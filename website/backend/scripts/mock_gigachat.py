@@ -0,0 +1,249 @@
+"""Локальная заглушка GigaChat для нагрузочных тестов без расхода квоты.
+
+Реализует OAuth (/api/v2/oauth), /api/v1/chat/completions (обычный ответ и SSE-стрим),
+/api/v1/models и /api/v1/tokens/count в формате, который понимает библиотека gigachat.
+Задержка до первого токена — логнормальная (медиана и sigma), скорость генерации —
+токенов в секунду; ошибки 500/503 и 429 с Retry-After выдаются с заданной вероятностью.
+
+    python -m scripts.mock_gigachat --port 8090 --ttft 1.5 --sigma 0.6 --tps 40 --error-rate 0.02
+
+В settings/config.py для бэкенда:
+    GIGACHAT_BASE_URL = "http://localhost:8090/api/v1"
+    GIGACHAT_AUTH_URL = "http://localhost:8090/api/v2/oauth"
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import JSONResponse, StreamingResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+MODELS = ["GigaChat", "GigaChat-Pro", "GigaChat-Max"]
+
+# Ответ собирается из этих слов до нужной длины; содержание для нагрузочного теста не важно
+WORDS = (
+    "раскисление стали алюминием приводит к образованию включений глинозёма которые при обработке "
+    "кальцием модифицируются в жидкие алюминаты кальция что снижает зарастание стаканов и улучшает "
+    "разливаемость гипотеза состоит в том что скорость ввода кальция определяет долю твёрдых включений"
+).split()
+
+
+def estimate_tokens(text: str) -> int:
+    # Грубо: ~4 символа на токен, как у токенизаторов GigaChat на смешанном русско-английском тексте
+    return max(1, len(text) // 4)
+
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.tokens: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def incr(self, name: str):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def issue_token(self) -> Dict:
+        token = uuid.uuid4().hex
+        expires_at = time.time() + self.args.token_ttl
+        with self._lock:
+            self.tokens[token] = expires_at
+        return {"access_token": token, "expires_at": int(expires_at * 1000)}
+
+    def token_valid(self, header: str) -> bool:
+        if not header.startswith("Bearer "):
+            return False
+        expires_at = self.tokens.get(header[len("Bearer "):])
+        return expires_at is not None and expires_at > time.time()
+
+    def ttft(self, model: str) -> float:
+        factor = self.args.model_factor.get(model, 1.0)
+        if self.args.sigma <= 0:
+            return self.args.ttft * factor
+        return random.lognormvariate(math.log(self.args.ttft), self.args.sigma) * factor
+
+    def completion_tokens(self) -> int:
+        return max(1, int(random.gauss(self.args.completion_tokens, self.args.completion_tokens * 0.2)))
+
+    def failure(self):
+        """None или (статус, заголовки) для искусственной ошибки."""
+        roll = random.random()
+        if roll < self.args.rate_limit_rate:
+            return 429, {"Retry-After": str(self.args.retry_after)}
+        if roll < self.args.rate_limit_rate + self.args.error_rate:
+            return random.choice((500, 503)), {}
+        return None
+
+
+def _error(status: int, message: str, headers: Dict = None):
+    return JSONResponse({"status": status, "message": message}, status_code=status, headers=headers)
+
+
+def _completion_text(n_tokens: int) -> str:
+    # ~1 слово на 1.5 токена
+    return " ".join(random.choice(WORDS) for _ in range(max(1, int(n_tokens / 1.5))))
+
+
+def build_app(args) -> Starlette:
+    state = MockState(args)
+
+    async def oauth(request: Request):
+        state.incr("oauth")
+        if not request.headers.get("Authorization", "").startswith("Basic "):
+            return _error(401, "Authorization header required")
+        return JSONResponse(state.issue_token())
+
+    async def models(request: Request):
+        if not state.token_valid(request.headers.get("Authorization", "")):
+            return _error(401, "Token has expired")
+        return JSONResponse({"object": "list", "data": [
+            {"id": model, "object": "model", "owned_by": "mock"} for model in MODELS
+        ]})
+
+    async def tokens_count(request: Request):
+        body = await request.json()
+        return JSONResponse([
+            {"object": "tokens", "tokens": estimate_tokens(text), "characters": len(text)}
+            for text in body.get("input", [])
+        ])
+
+    async def chat_completions(request: Request):
+        if not state.token_valid(request.headers.get("Authorization", "")):
+            state.incr("status_401")
+            return _error(401, "Token has expired")
+        body = await request.json()
+        model = body.get("model", "GigaChat")
+        prompt_tokens = estimate_tokens("".join(m.get("content", "") for m in body.get("messages", [])))
+        completion_tokens = state.completion_tokens()
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "precached_prompt_tokens": 0,
+        }
+        failure = state.failure()
+        ttft = state.ttft(model)
+        generation = completion_tokens / args.tps
+
+        with state._lock:
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        if failure:
+            status, headers = failure
+            state.incr(f"status_{status}")
+            try:
+                await asyncio.sleep(min(ttft, 0.5))
+            finally:
+                with state._lock:
+                    state.in_flight -= 1
+            return _error(status, "Mock failure", headers)
+
+        if not body.get("stream"):
+            try:
+                await asyncio.sleep(ttft + generation)
+            finally:
+                with state._lock:
+                    state.in_flight -= 1
+            state.incr("status_200")
+            return JSONResponse({
+                "choices": [{"message": {"role": "assistant", "content": _completion_text(completion_tokens)},
+                             "index": 0, "finish_reason": "stop"}],
+                "created": int(time.time()),
+                "model": model,
+                "object": "chat.completion",
+                "usage": usage,
+            })
+
+        async def stream():
+            try:
+                await asyncio.sleep(ttft)
+                words = _completion_text(completion_tokens).split()
+                step = max(1, args.chunk_words)
+                delay = generation * step / max(len(words), 1)
+                for start in range(0, len(words), step):
+                    last = start + step >= len(words)
+                    chunk = {
+                        "choices": [{"delta": {"role": "assistant", "content": " ".join(words[start:start + step]) + " "},
+                                     "index": 0, "finish_reason": "stop" if last else None}],
+                        "created": int(time.time()),
+                        "model": model,
+                        "object": "chat.completion",
+                    }
+                    if last:
+                        chunk["usage"] = usage
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(delay)
+                yield "data: [DONE]\n\n"
+                state.incr("status_200")
+            finally:
+                with state._lock:
+                    state.in_flight -= 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def stats(request: Request):
+        with state._lock:
+            return JSONResponse({
+                **state.counters,
+                "in_flight": state.in_flight,
+                "max_in_flight": state.max_in_flight,
+                "tokens_issued": len(state.tokens),
+            })
+
+    return Starlette(routes=[
+        Route("/api/v2/oauth", oauth, methods=["POST"]),
+        Route("/api/v1/models", models, methods=["GET"]),
+        Route("/api/v1/tokens/count", tokens_count, methods=["POST"]),
+        Route("/api/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/stats", stats, methods=["GET"]),
+    ])
+
+
+def parse_model_factor(values):
+    factors = {}
+    for value in values or []:
+        model, _, factor = value.partition("=")
+        factors[model] = float(factor)
+    return factors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка GigaChat API (OAuth, chat/completions, стрим)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--ttft", type=float, default=1.5, help="медиана задержки до первого токена, с")
+    parser.add_argument("--sigma", type=float, default=0.5, help="sigma логнормального распределения (0 — фиксированная)")
+    parser.add_argument("--tps", type=float, default=40, help="скорость генерации, токенов в секунду")
+    parser.add_argument("--completion-tokens", type=int, default=300, help="средняя длина ответа в токенах")
+    parser.add_argument("--chunk-words", type=int, default=3, help="слов в одном фрагменте стрима")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500/503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After для 429, с")
+    parser.add_argument("--token-ttl", type=int, default=1800, help="срок жизни access token, с")
+    parser.add_argument("--model-factor", nargs="*", metavar="MODEL=FACTOR",
+                        help="множитель задержки для модели, например GigaChat-Max=2.5")
+    args = parser.parse_args()
+    args.model_factor = parse_model_factor(args.model_factor)
+
+    import uvicorn
+    uvicorn.run(build_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
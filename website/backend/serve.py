@@ -0,0 +1,161 @@
+"""Продакшен-запуск бэкенда в несколько процессов (gunicorn).
+
+Модель эмбеддингов и индекс загружаются один раз в master-процессе, затем воркеры создаются
+через fork и делят эти страницы памяти (copy-on-write) вместо того, чтобы грузить свою копию.
+У каждого воркера свои потоки torch/FAISS, чтобы воркеры не дрались за ядра.
+
+    python serve.py --workers 4                      # Flask (app:app), воркеры gthread
+    python serve.py --workers 4 --asgi               # Starlette (asgi:app), воркеры uvicorn
+    python serve.py --workers 4 --memory-report 60   # через минуту после старта — отчёт о памяти
+
+Только Linux/macOS. Прогрев в master идёт до открытия порта; с --no-preload каждый воркер
+прогревается сам в фоне, как python app.py (память не делится).
+"""
+import argparse
+import atexit
+import gc
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from gunicorn.app.base import BaseApplication  # noqa: E402
+
+from settings.config import SERVE_WORKERS, SERVE_REQUEST_THREADS, SERVE_COMPUTE_THREADS, SERVE_TIMEOUT  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+
+def compute_threads(workers: int, requested: int = None) -> int:
+    return requested or max(1, (os.cpu_count() or 1) // workers)
+
+
+class Server(BaseApplication):
+    def __init__(self, args):
+        self.args = args
+        self.threads = compute_threads(args.workers, args.compute_threads)
+        super().__init__()
+
+    def load_config(self):
+        args = self.args
+        settings = {
+            "bind": args.bind,
+            "workers": args.workers,
+            "worker_class": "uvicorn.workers.UvicornWorker" if args.asgi else "gthread",
+            "threads": args.threads,
+            "timeout": args.timeout,
+            "graceful_timeout": args.timeout,
+            "preload_app": not args.no_preload,
+            "post_fork": self.post_fork,
+            "child_exit": self.child_exit,
+            "when_ready": self.when_ready,
+        }
+        for key, value in settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        if not self.args.no_preload:
+            self._preload()
+        if self.args.asgi:
+            from asgi import app
+        else:
+            from app import app
+        if not self.args.no_preload:
+            # Объекты, созданные до fork, сборщик мусора больше не трогает: иначе он пишет
+            # в их заголовки и страницы копируются в каждый воркер
+            gc.freeze()
+        return app
+
+    def _preload(self):
+        try:
+            import rag
+        except Exception as e:
+            logger.warning(f"RAG недоступен, предзагрузка пропущена: {e}")
+            return
+        started = time.perf_counter()
+        rag.preload()
+        logger.info(f"Модель и индекс загружены в master за {time.perf_counter() - started:.1f} с, "
+                    f"воркеров {self.args.workers}, потоков torch/FAISS на воркер {self.threads}")
+
+    def post_fork(self, server, worker):
+        if "rag" in sys.modules or self.args.no_preload:
+            try:
+                import rag
+                rag.after_fork(self.threads)
+            except Exception as e:
+                logger.warning(f"RAG недоступен в воркере {worker.pid}: {e}")
+        if "app" in sys.modules:
+            # Соединения SQLAlchemy, открытые master-процессом (db.create_all), воркеру не достаются
+            from app import app, db
+            with app.app_context():
+                db.engine.dispose()
+
+    def child_exit(self, server, worker):
+        import metrics
+        metrics.mark_process_dead(worker.pid)
+
+    def when_ready(self, server):
+        if not self.args.memory_report:
+            return
+
+        def report():
+            import memstats
+            time.sleep(self.args.memory_report)
+            try:
+                data = memstats.report(os.getpid(), sorted(server.WORKERS))
+            except OSError as e:
+                logger.warning(f"Отчёт о памяти недоступен: {e}")
+                return
+            logger.info("Память процессов:\n" + memstats.format_report(data))
+
+        threading.Thread(target=report, name="memory-report", daemon=True).start()
+
+
+def _multiproc_dir():
+    """Каталог для метрик Prometheus всех воркеров; задаётся до импорта prometheus_client."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        path = Path(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+        path.mkdir(parents=True, exist_ok=True)
+        for stale in path.glob("*.db"):
+            stale.unlink()
+        return
+    path = tempfile.mkdtemp(prefix="prometheus-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэкенд в несколько процессов с общей моделью и индексом")
+    parser.add_argument("--bind", default="0.0.0.0:5000")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVE_REQUEST_THREADS,
+                        help="потоков обработки запросов в воркере (только Flask)")
+    parser.add_argument("--compute-threads", type=int, default=SERVE_COMPUTE_THREADS,
+                        help="потоков torch/FAISS на воркер (по умолчанию ядра поровну)")
+    parser.add_argument("--asgi", action="store_true", help="asgi:app на воркерах uvicorn вместо app:app")
+    parser.add_argument("--timeout", type=int, default=SERVE_TIMEOUT)
+    parser.add_argument("--no-preload", action="store_true", help="каждый воркер грузит модель сам")
+    parser.add_argument("--memory-report", type=float, metavar="SECONDS",
+                        help="через столько секунд после старта записать в лог RSS/PSS master и воркеров")
+    args = parser.parse_args()
+
+    _multiproc_dir()
+    # Токенизатор HF иначе предупреждает о fork после использования пула потоков и отключает его сам
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    Server(args).run()
+
+
+if __name__ == "__main__":
+    main()
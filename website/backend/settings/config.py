@@ -9,7 +9,135 @@ RAW_FILE = DATA_DIR / "raw.jsonl"
 CHUNKS_FILE = DATA_DIR / "clean.jsonl"
 RAW_OUTPUT = DATA_DIR / "raw.jsonl"
 
+# Кэш ответов (точный + семантический)
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_FILE = Path("cache") / "answers.sqlite3"
+ANSWER_CACHE_TTL = 7 * 24 * 3600  # секунды
+ANSWER_CACHE_MAX_ENTRIES = 2000
+ANSWER_CACHE_SIMILARITY = 0.97  # порог косинусной близости для семантического попадания
 
+# Модель эмбеддингов берётся из faiss_index/index_info.json. Если задать явно и она не совпадёт
+# с манифестом, при INDEX_MANIFEST_STRICT = True запуск RAG прервётся, иначе будет предупреждение.
+EMBEDDING_MODEL = None
+INDEX_MANIFEST_STRICT = True
 
+# Бэкенд эмбеддингов запросов: "torch" (sentence-transformers) или "onnx" (onnxruntime, int8 на CPU).
+# ONNX-модель экспортируется из модели манифеста при первом запуске.
+EMBEDDING_BACKEND = "torch"
+ONNX_MODEL_DIR = Path("onnx_model")
+ONNX_QUANTIZE = True
+ONNX_THREADS = None
 
+# Микробатчинг эмбеддингов запросов и поиска FAISS для одновременных запросов
+BATCH_MAX_SIZE = 32
+BATCH_MAX_WAIT_MS = 5
+TORCH_THREADS = None  # None — по числу ядер
 
+# Параметры поиска ANN-индекса. None — брать из index_spec в index_info.json
+FAISS_EF_SEARCH = None  # HNSW
+FAISS_NPROBE = None  # IVF
+
+# Гибридный поиск: BM25 по chunk_text + dense, слияние reciprocal rank fusion
+HYBRID_SEARCH = True
+HYBRID_RRF_K = 60
+HYBRID_FETCH_FACTOR = 3  # каждый поиск достаёт k * factor кандидатов перед слиянием
+HYBRID_BUDGET_MS = 5  # сколько BM25 может отставать от dense-поиска
+
+# Склейка перекрывающихся чанков одной статьи перед сборкой контекста
+CONTEXT_MAX_CHUNKS_PER_ARTICLE = 3
+CONTEXT_DEDUP_THRESHOLD = 0.85  # Jaccard по 3-граммам слов, выше — дубль
+
+# Сборка контекста: до *_MAX_K кандидатов, обрыв на резком падении косинусной близости,
+# затем упаковка в бюджет токенов (оценка по chunk_tokens)
+QA_MAX_K = 8
+QA_CONTEXT_TOKENS = 3000
+HYPOTHESIS_MAX_K = 12
+HYPOTHESIS_CONTEXT_TOKENS = 6000
+RELEVANCE_MIN_DOCS = 2
+RELEVANCE_CLIFF_GAP = 0.03  # падение между соседними документами
+RELEVANCE_MAX_DROP = 0.08  # падение относительно лучшего документа
+
+# База чатов и отзывов (относительный путь sqlite — от каталога instance/)
+DATABASE_URI = 'sqlite:///chatbot.db'
+
+# Фоновая очередь задач генерации гипотез
+JOB_WORKERS = 2
+JOB_MAX_PENDING = 32  # больше незавершённых задач — 503
+JOB_TTL = 3600  # сколько хранить завершённые задачи, секунды
+JOB_ABANDON_AFTER = 60  # задача без подписчиков и опроса дольше этого отменяется
+JOB_HEARTBEAT = 15  # интервал keep-alive в SSE-подписке, секунды
+
+# Клиенты GigaChat: один долгоживущий клиент с пулом keep-alive соединений на модель,
+# OAuth-токен кэшируется в файле до истечения и общий для всех процессов
+GIGACHAT_TIMEOUT = 120
+GIGACHAT_MAX_CONNECTIONS = 10
+GIGACHAT_TOKEN_CACHE_FILE = Path("cache") / "gigachat_token.json"
+# Адреса API и OAuth; None — стандартные адреса Сбера. Для нагрузочных тестов без квоты —
+# локальная заглушка: python -m scripts.mock_gigachat (http://localhost:8090/api/v1 и /api/v2/oauth)
+GIGACHAT_BASE_URL = None
+GIGACHAT_AUTH_URL = None
+
+# Ограничение одновременных вызовов на модель: max_concurrent в работе, до max_queue ждут слот
+# не дольше queue_timeout секунд, остальные сразу получают 503 с Retry-After
+LLM_LIMITS = {
+    "GigaChat-Pro": {"max_concurrent": 8, "max_queue": 16, "queue_timeout": 10},
+    "GigaChat-Max": {"max_concurrent": 2, "max_queue": 8, "queue_timeout": 20},
+}
+LLM_DEFAULT_LIMIT = {"max_concurrent": 4, "max_queue": 8, "queue_timeout": 10}
+
+# Повторы вызовов GigaChat при 429/5xx и сетевых ошибках: экспоненциальная задержка с джиттером,
+# не больше LLM_RETRY_BUDGET секунд на все попытки
+LLM_RETRY_ATTEMPTS = 3
+LLM_RETRY_BASE_DELAY = 0.5
+LLM_RETRY_MAX_DELAY = 8.0
+LLM_RETRY_BUDGET = 180.0
+
+# Хеджирование: если ответа нет дольше p95 для этого профиля (но не меньше LLM_HEDGE_MIN_DELAY),
+# отправляется дубль запроса. Хеджей одновременно не больше LLM_HEDGE_MAX_INFLIGHT
+# и не больше LLM_HEDGE_MAX_RATIO от всех вызовов. Стримы не хеджируются.
+LLM_HEDGE_ENABLED = False
+LLM_HEDGE_QUANTILE = 0.95
+LLM_HEDGE_MIN_DELAY = 2.0
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_HEDGE_MAX_INFLIGHT = 2
+LLM_HEDGE_MAX_RATIO = 0.1
+
+# Поиск источников без LLM (/api/search)
+SEARCH_K = 10
+SEARCH_MAX_K = 50
+SEARCH_BUDGET_MS = 50  # целевая задержка; BM25 получает остаток бюджета после эмбеддинга запроса
+SEARCH_SNIPPET_CHARS = 300
+
+# Наблюдаемость: гистограммы стадий и вызовов LLM на /metrics (нужен prometheus_client)
+# и спаны OpenTelemetry (нужен opentelemetry-api; экспорт настраивается SDK / opentelemetry-instrument)
+METRICS_ENABLED = True
+TRACING_ENABLED = True
+
+# Прогрев при старте: модель и индекс грузятся в фоне, затем пробный запрос. До конца прогрева
+# маршруты RAG отвечают 503 с Retry-After, /ready — 503, /health (liveness) — 200
+WARMUP_QUERY = "влияние раскисления стали на неметаллические включения"
+WARMUP_RETRY_AFTER = 10
+
+# Продакшен-запуск serve.py: gunicorn, модель и индекс грузятся в master до fork и делятся воркерами
+SERVE_WORKERS = 2
+SERVE_REQUEST_THREADS = 8  # потоков обработки запросов в воркере Flask (gthread)
+SERVE_COMPUTE_THREADS = None  # потоков torch/FAISS на воркер; None — ядра поровну между воркерами
+SERVE_TIMEOUT = 300  # генерация гипотез GigaChat-Max длится минутами
+
+# Версии индекса (faiss_index/versions/<версия>, активная — в faiss_index/CURRENT) и горячая замена:
+# воркер раз в INDEX_WATCH_INTERVAL секунд проверяет CURRENT (0 — только через /api/admin/reload_index),
+# грузит новую версию в фоне и переключается, если пробные запросы находят документы и выдача
+# пересекается с текущей версией не меньше чем на INDEX_SMOKE_MIN_OVERLAP
+INDEX_WATCH_INTERVAL = 30
+INDEX_SMOKE_QUERIES = [
+    "влияние раскисления стали на неметаллические включения",
+    "механические свойства сварных соединений",
+    "термическая обработка жаропрочных сплавов",
+]
+INDEX_SMOKE_K = 10
+INDEX_SMOKE_MIN_OVERLAP = 0.2
+INDEX_KEEP_VERSIONS = 3  # сколько версий оставляет build_faiss.py
+# build_faiss.py --incremental: удалённые и изменённые чанки остаются в FAISS надгробиями,
+# при доле надгробий выше порога индекс уплотняется (без перекодирования)
+INDEX_COMPACT_THRESHOLD = 0.2
+ADMIN_TOKEN = None  # заголовок X-Admin-Token для /api/admin/*; None — только запросы с localhost
@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    """Flask-приложение app.py с временной базой вместо instance/chatbot.db.
+
+    База — файл, а не память: sqlite в памяти делит одно соединение между потоками,
+    а ответы задач сохраняются из воркеров очереди.
+    """
+    pytest.importorskip("flask_sqlalchemy")
+    from settings import config
+
+    config.DATABASE_URI = f"sqlite:///{tmp_path_factory.mktemp('db') / 'chatbot.db'}"
+    import app
+
+    return app
@@ -0,0 +1,43 @@
+import json
+
+from bm25 import VOCAB_FILE, BM25Index, highlight
+
+TEXTS = [
+    "сталь сварка шов",
+    "сплав титан TiN",
+    "сталь раскисление алюминий включения",
+    "шов трещина сталь",
+]
+
+
+def test_live_rows_score_like_full_rebuild(tmp_path):
+    live = [TEXTS[0], TEXTS[2], TEXTS[3]]
+    rebuilt = BM25Index.build(live)
+    # Те же чанки в строках 0, 5, 7 индекса из 9 строк, остальные — надгробия
+    incremental = BM25Index.build(live, row_ids=[0, 5, 7], n_rows=9)
+    incremental.save(tmp_path)
+    loaded = BM25Index.load(tmp_path)
+
+    to_row = {0: 0, 1: 5, 2: 7}
+    expected = [(to_row[i], score) for i, score in rebuilt.search("сталь шов", 5)]
+    assert incremental.search("сталь шов", 5) == expected
+    assert loaded.search("сталь шов", 5) == expected
+    assert (loaded.n_docs, loaded.avgdl) == (rebuilt.n_docs, rebuilt.avgdl)
+
+
+def test_lowercase_query_matches_mixed_case_formula():
+    index = BM25Index.build(["включения Al2O3 в стали", "сталь AISI 304L после отжига", "сталь без включений"])
+
+    assert [row for row, _ in index.search("al2o3", 3)] == [0]
+    assert [row for row, _ in index.search("aisi 304l", 3)] == [1]
+    assert "<mark>Al2O3</mark>" in highlight("включения Al2O3 в стали", "al2o3")
+
+
+def test_vocab_from_older_tokenizer_is_not_current(tmp_path):
+    BM25Index.build(TEXTS).save(tmp_path)
+    assert BM25Index.is_current(tmp_path)
+
+    info = json.loads((tmp_path / VOCAB_FILE).read_text(encoding="utf-8"))
+    del info["tokenizer"]
+    (tmp_path / VOCAB_FILE).write_text(json.dumps(info), encoding="utf-8")
+    assert not BM25Index.is_current(tmp_path)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import cache
+from cache import AnswerCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+def _cache(tmp_path, **kwargs):
+    params = dict(scope="v1", ttl=3600, max_entries=100, similarity=0.97)
+    params.update(kwargs)
+    return AnswerCache(tmp_path / "answers.sqlite3", **params)
+
+
+def _rotated(angle):
+    # Единичный вектор под углом angle к (1, 0, 0): косинус близости равен cos(angle)
+    return [float(np.cos(angle)), float(np.sin(angle)), 0.0]
+
+
+def test_exact_hit_ignores_case_spacing_and_trailing_punctuation(tmp_path, clock):
+    answers = _cache(tmp_path)
+    answers.put("qa", "Что такое TiN?", None, {"answer": "нитрид титана"})
+
+    assert answers.get("qa", "  что  такое tin ") == {"answer": "нитрид титана"}
+    assert answers.get("hypothesis", "Что такое TiN?") is None
+    assert _cache(tmp_path, scope="v2").get("qa", "Что такое TiN?") is None
+
+
+def test_expired_entries_are_not_returned(tmp_path, clock):
+    answers = _cache(tmp_path, ttl=60)
+    answers.put("qa", "вопрос", [1.0, 0.0, 0.0], {"answer": "ответ"})
+    clock.now += 61
+
+    assert answers.get("qa", "вопрос") is None
+    assert answers.get_similar("qa", [1.0, 0.0, 0.0]) is None
+
+
+def test_overflow_evicts_least_recently_used(tmp_path, clock):
+    answers = _cache(tmp_path, max_entries=2)
+    answers.put("qa", "первый", None, {"answer": 1})
+    answers.put("qa", "второй", None, {"answer": 2})
+    assert answers.get("qa", "первый") == {"answer": 1}
+    answers.put("qa", "третий", None, {"answer": 3})
+
+    assert answers.get("qa", "второй") is None
+    assert answers.get("qa", "первый") == {"answer": 1}
+    assert answers.get("qa", "третий") == {"answer": 3}
+    assert answers.stats()["evictions"] == 1
+
+
+def test_semantic_hit_requires_similarity_threshold(tmp_path, clock):
+    answers = _cache(tmp_path, similarity=0.97)
+    answers.put("qa", "вопрос", [2.0, 0.0, 0.0], {"answer": "ответ"})
+
+    assert answers.get_similar("qa", _rotated(0.1)) == {"answer": "ответ"}  # cos ≈ 0.995
+    assert answers.get_similar("qa", _rotated(0.5)) is None  # cos ≈ 0.878
+    assert answers.get_similar("hypothesis", _rotated(0.0)) is None
+    stats = answers.stats()
+    assert (stats["semantic_hits"], stats["misses"]) == (1, 2)
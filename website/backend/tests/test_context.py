@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document  # noqa: E402
+
+from context import pack_context, relevance_cutoff  # noqa: E402
+
+SENTENCE = "Сталь после закалки отпускали при шестистах градусах."
+
+
+def _doc(score, sentences=8):
+    return Document(page_content=" ".join([SENTENCE] * sentences), metadata={"score": score})
+
+
+def _format(n, doc, text):
+    return f"[{n}] {text}"
+
+
+def test_cutoff_on_cliff_between_neighbours():
+    assert relevance_cutoff([0.90, 0.89, 0.88, 0.80, 0.79], min_docs=2, cliff_gap=0.03, max_drop=0.2) == 3
+
+
+def test_cutoff_on_drift_from_best_but_not_before_min_docs():
+    scores = [0.90, 0.70, 0.69, 0.68]
+    assert relevance_cutoff(scores, min_docs=2, cliff_gap=0.5, max_drop=0.08) == 2
+    assert relevance_cutoff(scores, min_docs=3, cliff_gap=0.5, max_drop=0.08) == 3
+
+
+def test_lexical_only_documents_do_not_cut():
+    assert relevance_cutoff([0.90, None, None, 0.88], min_docs=2, cliff_gap=0.03, max_drop=0.08) == 4
+
+
+def test_pack_drops_irrelevant_tail_and_truncates_last_fragment():
+    docs = [_doc(0.90), _doc(0.89), _doc(0.88), _doc(0.70)]
+    # Каждый фрагмент ~108 токенов (431 символ / 4): третий влезает только частично
+    packed = pack_context(docs, budget=300, formatter=_format, min_docs=2, cliff_gap=0.03, max_drop=0.08)
+
+    assert packed.cut_by_relevance == 1
+    assert len(packed.docs) == 3
+    assert packed.truncated == 1
+    assert packed.tokens <= 300
+    last = packed.text.split("\n\n")[-1]
+    assert last.startswith("[3] ") and last.endswith(".")
+    assert len(last) < len(_format(3, docs[2], docs[2].page_content))
+
+
+def test_pack_skips_fragment_when_remaining_budget_is_too_small():
+    docs = [_doc(0.90), _doc(0.89), _doc(0.88)]
+    packed = pack_context(docs, budget=250, formatter=_format)
+
+    assert len(packed.docs) == 2
+    assert (packed.cut_by_budget, packed.truncated) == (1, 0)
@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document  # noqa: E402
+
+from docstore import SQLiteDocstore, dedup_chunks, unique_chunk_rows, write_docstore  # noqa: E402
+
+
+def _doc(chunk_id, text):
+    return Document(page_content=text, metadata={"chunk_id": chunk_id, "title": text})
+
+
+CORPUS = [_doc("a", "первый"), _doc("b", "второй"), _doc("a", "первый"), _doc("c", "третий")]
+
+
+def test_repeated_chunk_id_builds_docstore(tmp_path):
+    documents = dedup_chunks(CORPUS)
+    assert [d.metadata["chunk_id"] for d in documents] == ["a", "b", "c"]
+
+    write_docstore(tmp_path / "docstore.sqlite3", documents)
+    store = SQLiteDocstore(tmp_path / "docstore.sqlite3")
+    assert len(store) == 3
+    assert store.search("2").metadata["chunk_id"] == "c"
+
+
+def test_repeated_rows_become_gaps(tmp_path):
+    # convert_index: векторы повторов остаются в индексе, а в docstore их строк нет
+    rows = unique_chunk_rows(CORPUS)
+    assert rows == [0, 1, 3]
+
+    write_docstore(tmp_path / "docstore.sqlite3", [CORPUS[i] for i in rows], row_ids=rows)
+    store = SQLiteDocstore(tmp_path / "docstore.sqlite3")
+    assert [row_id for row_id, _ in store.iter_rows()] == [0, 1, 3]
+    assert set(store.mget([0, 1, 2, 3])) == {0, 1, 3}
@@ -0,0 +1,75 @@
+import threading
+
+from limiter import LLMOverloaded
+
+
+def _start_job(backend, monkeypatch, stream):
+    from models import ChatSession, Message, db
+
+    monkeypatch.setattr(backend, "generate_hypotheses_stream", stream, raising=False)
+    with backend.app.app_context():
+        user_id = backend.ensure_user(None)
+        chat = ChatSession(user_id=user_id, title="Новый чат")
+        db.session.add(chat)
+        db.session.commit()
+        user_message = Message(chat_id=chat.id, content="трещины в сварном шве", is_user=True)
+        db.session.add(user_message)
+        ctx = {"chat_id": chat.id, "message": user_message.content, "attachments": [], "filters": None,
+               "user_message": user_message}
+        job = backend.submit_hypothesis_job(ctx, user_id)
+        return job, chat.id
+
+
+def _wait(job):
+    cursor = 0
+    while not job.finished:
+        _, cursor = job.events_since(cursor, timeout=1)
+
+
+def _messages(backend, chat_id):
+    from models import Message
+
+    with backend.app.app_context():
+        return [m.content for m in Message.query.filter_by(chat_id=chat_id).all()]
+
+
+def test_cancelled_job_leaves_no_orphan_message(backend, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def stream(message, filters=None):
+        yield {"event": "stage", "stage": "retrieving"}
+        started.set()
+        release.wait(5)
+        yield {"event": "stage", "stage": "generating"}
+
+    job, chat_id = _start_job(backend, monkeypatch, stream)
+    assert started.wait(5)
+    job.cancel()
+    release.set()
+    _wait(job)
+
+    assert job.status == "cancelled"
+    assert _messages(backend, chat_id) == []
+
+
+def test_overloaded_job_leaves_no_orphan_message(backend, monkeypatch):
+    def stream(message, filters=None):
+        raise LLMOverloaded("GigaChat-Pro", retry_after=1)
+        yield
+
+    job, chat_id = _start_job(backend, monkeypatch, stream)
+    _wait(job)
+
+    assert job.status == "failed"
+    assert _messages(backend, chat_id) == []
+
+
+def test_finished_job_stores_reply(backend, monkeypatch):
+    def stream(message, filters=None):
+        yield {"event": "done", "final": "гипотеза", "raw": "", "docs": []}
+
+    job, chat_id = _start_job(backend, monkeypatch, stream)
+    _wait(job)
+
+    assert job.status == "done", job.error
+    assert len(_messages(backend, chat_id)) == 2
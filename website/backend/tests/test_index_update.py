@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document  # noqa: E402
+
+from docstore import SQLiteDocstore, write_docstore  # noqa: E402
+from index_update import diff_index  # noqa: E402
+
+
+def _doc(chunk_id, text):
+    return Document(page_content=text, metadata={"chunk_id": chunk_id})
+
+
+def test_diff_with_repeated_chunk_id(tmp_path):
+    write_docstore(tmp_path / "docstore.sqlite3", [_doc("a", "первый"), _doc("b", "второй"), _doc("c", "третий")])
+    corpus = [_doc("a", "первый"), _doc("b", "второй, исправленный"), _doc("a", "первый"), _doc("d", "четвёртый")]
+
+    diff = diff_index(SQLiteDocstore(tmp_path / "docstore.sqlite3"), corpus)
+
+    assert [d.metadata["chunk_id"] for d in diff.added] == ["d"]
+    assert [(row, d.metadata["chunk_id"]) for row, d in diff.changed] == [(1, "b")]
+    assert diff.removed == [2]
+    assert diff.unchanged == 1
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueue, QueueFull
+
+
+def _wait(job, timeout=5):
+    deadline = time.time() + timeout
+    cursor = 0
+    while not job.finished and time.time() < deadline:
+        _, cursor = job.events_since(cursor, timeout=0.1)
+    return job.status
+
+
+def _until_cancelled(started):
+    def work(job):
+        started.set()
+        while True:
+            job.checkpoint(abandon_after=0.2)
+            time.sleep(0.01)
+    return work
+
+
+def test_cancel_running_job():
+    queue = JobQueue(workers=1)
+    started, aborted = threading.Event(), []
+    job = queue.submit("test", _until_cancelled(started), owner="u1", on_abort=lambda: aborted.append(True))
+    assert started.wait(5)
+    job.subscribers += 1  # подписчик есть — задача не считается брошенной
+
+    assert queue.cancel(job.id, owner="u2") is None
+    assert queue.cancel(job.id, owner="u1") is job
+    assert _wait(job) == "cancelled"
+    assert aborted == [True]
+
+
+def test_queued_job_cancelled_before_start_never_runs():
+    queue = JobQueue(workers=1)
+    release, calls, aborted = threading.Event(), [], []
+    blocker = queue.submit("test", lambda job: release.wait(5))
+    queued = queue.submit("test", lambda job: calls.append(job.id), on_abort=lambda: aborted.append(True))
+    queued.cancel()
+    release.set()
+
+    assert _wait(blocker) == "done"
+    assert _wait(queued) == "cancelled"
+    assert (calls, aborted) == ([], [True])
+
+
+def test_job_without_subscribers_or_polling_is_abandoned():
+    queue = JobQueue(workers=1)
+    started = threading.Event()
+    job = queue.submit("test", _until_cancelled(started))
+    assert started.wait(5)
+
+    assert _wait(job) == "cancelled"  # никто не опрашивает дольше abandon_after
+
+
+def test_failed_job_reports_error_and_aborts():
+    queue = JobQueue(workers=1)
+    aborted = []
+
+    def fail(job):
+        raise ValueError("нет контекста")
+
+    job = queue.submit("test", fail, on_abort=lambda: aborted.append(True))
+
+    assert _wait(job) == "failed"
+    assert job.error == "нет контекста"
+    assert aborted == [True]
+
+
+def test_queue_full():
+    queue = JobQueue(workers=1, max_pending=1)
+    release = threading.Event()
+    queue.submit("test", lambda job: release.wait(5))
+    with pytest.raises(QueueFull):
+        queue.submit("test", lambda job: None)
+    release.set()
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from limiter import LLMOverloaded, ModelLimiter
+
+
+def _until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_full_queue_rejects_immediately():
+    limiter = ModelLimiter("pro", max_concurrent=1, max_queue=1, queue_timeout=5)
+    limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    assert _until(lambda: limiter.stats()["waiting"] == 1)
+
+    started = time.perf_counter()
+    with pytest.raises(LLMOverloaded) as error:
+        limiter.acquire()
+    assert time.perf_counter() - started < 1
+    assert error.value.retry_after == 5
+
+    limiter.release()
+    waiter.join(5)
+    stats = limiter.stats()
+    assert (stats["active"], stats["admitted"], stats["rejected_queue_full"]) == (1, 2, 1)
+
+
+def test_slot_wait_times_out():
+    limiter = ModelLimiter("max", max_concurrent=1, max_queue=4, queue_timeout=0.05)
+    with limiter.slot():
+        with pytest.raises(LLMOverloaded):
+            limiter.acquire()
+        with pytest.raises(LLMOverloaded) as error:
+            limiter.acquire(0)  # попытка без ожидания (хедж)
+        assert error.value.retry_after == 0
+
+    stats = limiter.stats()
+    assert (stats["active"], stats["waiting"], stats["rejected_timeout"]) == (0, 0, 1)
+
+
+def test_cancelled_async_waiter_returns_slot_it_gets_later():
+    limiter = ModelLimiter("pro", max_concurrent=1, max_queue=2, queue_timeout=5)
+    limiter.acquire()
+
+    async def cancel_while_waiting():
+        async def use_slot():
+            async with limiter.aslot():
+                pass
+
+        task = asyncio.ensure_future(use_slot())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_while_waiting())
+    limiter.release()
+
+    # Отменённый ожидающий всё же получает слот и сразу его возвращает
+    assert _until(lambda: limiter.stats()["admitted"] == 2)
+    assert _until(lambda: limiter.stats()["active"] == 0)
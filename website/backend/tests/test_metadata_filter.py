@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from metadata_filter import MetadataColumns, parse_filters
+
+METADATA = [
+    {"year": 2015, "country": "RU", "source": "journal"},
+    {"year": "2020", "country": "DE", "source": "journal"},
+    {"year": None, "country": "RU", "source": "patent"},
+    {"year": "н/д", "country": "", "source": "journal"},
+    {"year": 2023, "country": "RU", "source": "patent"},
+]
+
+
+def _rows(mask):
+    return np.flatnonzero(mask).tolist()
+
+
+def test_year_range_excludes_unknown_years():
+    columns = MetadataColumns.from_metadata(METADATA)
+
+    assert _rows(columns.mask({"year_from": 2016})) == [1, 4]
+    assert _rows(columns.mask({"year_to": 2020})) == [0, 1]
+    assert _rows(columns.mask({"year_from": 2016, "year_to": 2021})) == [1]
+
+
+def test_categorical_filters_and_unknown_values():
+    columns = MetadataColumns.from_metadata(METADATA)
+
+    assert columns.mask(None) is None
+    assert _rows(columns.mask({"country": ["RU"], "source": ["patent"]})) == [2, 4]
+    assert _rows(columns.mask({"country": ["FR"]})) == []
+
+
+def test_tombstones_never_match(tmp_path):
+    columns = MetadataColumns.from_metadata(METADATA)
+    columns.deleted = np.array([False, False, False, False, True])
+    columns.save(tmp_path)
+    loaded = MetadataColumns.load(tmp_path)
+
+    assert _rows(loaded.mask(None)) == [0, 1, 2, 3]
+    assert _rows(loaded.mask({"country": ["RU"]})) == [0, 2]
+    assert loaded.facets()["year"] == {"unknown": 2, "2015": 1, "2020": 1}
+
+
+def test_parse_filters_normalizes_and_validates():
+    assert parse_filters({"year_from": "2010", "country": "RU", "source": ["b", "a", "b"]}) == {
+        "year_from": 2010, "country": ["RU"], "source": ["a", "b"]
+    }
+    assert parse_filters({"year_to": "", "type": []}) is None
+    for raw in ({"year_from": "давно"}, {"country": [1]}, {"author": "x"}, ["RU"]):
+        with pytest.raises(ValueError):
+            parse_filters(raw)
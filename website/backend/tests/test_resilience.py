@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("gigachat")
+
+import httpx  # noqa: E402
+
+from limiter import LLMOverloaded, ModelLimiter  # noqa: E402
+from resilience import CallPolicy, HedgeBudget, RetryPolicy  # noqa: E402
+
+
+def _policy(**kwargs):
+    kwargs.setdefault("budget", HedgeBudget(max_inflight=2, max_ratio=1.0))
+    return CallPolicy(RetryPolicy(attempts=1), hedge_enabled=True, hedge_min_delay=0.05, hedge_min_samples=1, **kwargs)
+
+
+def test_waiting_for_limiter_slot_neither_hedges_nor_counts_as_latency():
+    policy = _policy()
+    policy.tracker("pro").record(0.01)
+    limiter = ModelLimiter("pro", max_concurrent=1, max_queue=4, queue_timeout=5)
+    limiter.acquire()  # слот занят другим запросом
+    threading.Timer(0.3, limiter.release).start()
+
+    def call(hedge):
+        time.sleep(0.01)
+        return "hedge" if hedge else "primary"
+
+    assert policy.run("pro", call, limiter) == "primary"
+    assert policy.stats().get("hedges", 0) == 0
+    assert policy.tracker("pro").threshold() < 0.1
+    assert limiter.stats()["active"] == 0
+
+
+def test_async_waiting_for_limiter_slot_does_not_hedge():
+    policy = _policy()
+    policy.tracker("pro").record(0.01)
+    limiter = ModelLimiter("pro", max_concurrent=1, max_queue=4, queue_timeout=5)
+    limiter.acquire()
+    threading.Timer(0.3, limiter.release).start()
+
+    async def acall(hedge):
+        await asyncio.sleep(0.01)
+        return "hedge" if hedge else "primary"
+
+    assert asyncio.run(policy.arun("pro", acall, limiter)) == "primary"
+    assert policy.stats().get("hedges", 0) == 0
+    assert policy.tracker("pro").threshold() < 0.1
+    assert limiter.stats()["active"] == 0
+
+
+def _flaky(failures, exc=None):
+    calls = []
+
+    def call(hedge):
+        calls.append(hedge)
+        if len(calls) <= failures:
+            raise exc or httpx.ConnectTimeout("timeout")
+        return "ok"
+    return call, calls
+
+
+def test_retries_transient_errors_only():
+    policy = CallPolicy(RetryPolicy(attempts=3, base_delay=0))
+    call, calls = _flaky(2)
+    assert policy.run("lite", call) == "ok"
+    assert (len(calls), policy.stats()["retries"]) == (3, 2)
+
+    for exc in (ValueError("плохой ответ"), LLMOverloaded("lite", retry_after=1)):
+        call, calls = _flaky(1, exc)
+        with pytest.raises(type(exc)):
+            policy.run("lite", call)
+        assert len(calls) == 1
+
+
+def test_retry_gives_up_when_budget_is_spent():
+    retry = RetryPolicy(attempts=5, base_delay=0, budget=1)
+    started = time.perf_counter()
+    assert retry.next_delay(0, httpx.ConnectTimeout("timeout"), started) is not None
+    assert retry.next_delay(0, httpx.ConnectTimeout("timeout"), started - 2) is None
+
+
+def test_stream_is_not_retried_after_first_chunk():
+    policy = CallPolicy(RetryPolicy(attempts=3, base_delay=0))
+    attempts = []
+
+    def stream():
+        attempts.append(1)
+        yield "первый"
+        raise httpx.ReadTimeout("timeout")
+
+    with pytest.raises(httpx.ReadTimeout):
+        list(policy.retry_stream("lite", stream))
+    assert len(attempts) == 1
+
+
+def test_slow_primary_is_hedged_and_hedge_wins():
+    policy = _policy()
+    policy.tracker("pro").record(0.01)
+
+    def call(hedge):
+        time.sleep(0.01 if hedge else 0.5)
+        return "hedge" if hedge else "primary"
+
+    assert policy.run("pro", call) == "hedge"
+    stats = policy.stats()
+    assert (stats["hedges"], stats["hedge_wins"], stats["hedge_inflight"]) == (1, 1, 0)
+
+
+def test_hedges_are_capped_by_budget_ratio():
+    policy = _policy(budget=HedgeBudget(max_inflight=2, max_ratio=0.1))
+    policy.tracker("pro").record(0.01)
+
+    def call(hedge):
+        time.sleep(0.1)
+        return "hedge" if hedge else "primary"
+
+    assert policy.run("pro", call) == "primary"
+    assert policy.stats()["hedges_skipped"] == 1
@@ -0,0 +1,36 @@
+import pytest
+
+from warmup import WarmUp
+
+
+def _failed_warmup():
+    warmup = WarmUp(lambda step: 1 / 0)
+    warmup.start()
+    warmup.wait(5)
+    return warmup
+
+
+@pytest.mark.parametrize("warmup", [WarmUp(lambda step: None), _failed_warmup()], ids=["warming", "failed"])
+def test_question_before_rag_is_ready_gets_503_and_is_not_stored(backend, monkeypatch, warmup):
+    from models import ChatSession, Message, db
+
+    monkeypatch.setattr(backend, "RAG_AVAILABLE", True)
+    monkeypatch.setattr(backend, "rag_warmup", warmup, raising=False)
+    monkeypatch.setattr(backend, "parse_filters", lambda filters: filters, raising=False)
+    with backend.app.app_context():
+        user_id = backend.ensure_user(None)
+        chat = ChatSession(user_id=user_id, title="Новый чат")
+        db.session.add(chat)
+        db.session.commit()
+        db.session.add(Message(chat_id=chat.id, content="вопрос", is_user=True))
+        db.session.commit()
+        chat_id = chat.id
+
+    response = backend.app.test_client().post(
+        "/api/send_message", json={"chat_id": chat_id, "message": "Почему трескается шов?"},
+        headers={"X-User-ID": user_id}
+    )
+
+    assert response.status_code == 503
+    with backend.app.app_context():
+        assert [m.content for m in Message.query.filter_by(chat_id=chat_id).all()] == ["вопрос"]
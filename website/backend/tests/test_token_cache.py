@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("gigachat")
+pytest.importorskip("langchain_community.chat_models")
+
+from llm import TokenCache  # noqa: E402
+
+
+def test_alock_waits_without_blocking_loop(tmp_path):
+    cache = TokenCache(tmp_path / "token.json", "credentials")
+    order = []
+
+    async def holder():
+        async with cache.alock():
+            order.append("holder")
+            await asyncio.sleep(0.3)
+
+    async def waiter():
+        await asyncio.sleep(0.05)
+        async with cache.alock():
+            order.append("waiter")
+
+    async def ticker():
+        # Если ожидание лока блокирует цикл, тики между захватами не пройдут
+        ticks = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < 0.25:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return ticks
+
+    async def main():
+        _, _, ticks = await asyncio.gather(holder(), waiter(), ticker())
+        return ticks
+
+    ticks = asyncio.run(main())
+    assert order == ["holder", "waiter"]
+    assert ticks > 10
+    assert not cache.lock_path.exists()
+
+
+def test_sync_lock_times_out_without_lock(tmp_path):
+    cache = TokenCache(tmp_path / "token.json", "credentials")
+    with cache.lock():
+        started = time.perf_counter()
+        with cache.lock(timeout=0.2):
+            assert time.perf_counter() - started >= 0.2
+    assert not cache.lock_path.exists()
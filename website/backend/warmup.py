@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from limiter import LLMOverloaded
+
+logger = logging.getLogger(__name__)
+
+
+class NotReady(LLMOverloaded):
+    """Модель или индекс ещё загружаются. Наследует LLMOverloaded, чтобы обработчики 503 с Retry-After работали без изменений."""
+
+
+class WarmUp:
+    """Загрузка модели и индекса в фоновом потоке.
+
+    fn получает функцию step(name) — контекстный менеджер, отмечающий длительность шага.
+    Статусы: pending → warming → ready или failed. Пока статус не ready, require() бросает NotReady.
+    """
+
+    def __init__(self, fn: Callable, retry_after: float = 10):
+        self.fn = fn
+        self.retry_after = retry_after
+        self.status = "pending"
+        self.steps = []
+        self.current_step: Optional[str] = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if self.status != "pending":
+                return False
+            self.status = "warming"
+            self.started_at = time.time()
+            return True
+
+    def start(self):
+        """Запускает прогрев в фоновом потоке; повторные вызовы ничего не делают."""
+        if self._claim():
+            threading.Thread(target=self._run, name="warmup", daemon=True).start()
+
+    def run(self):
+        """Прогрев в текущем потоке (скрипты, master-процесс перед fork). Ошибка загрузки пробрасывается."""
+        if self._claim():
+            self._run()
+        self._done.wait()
+        if self.status == "failed":
+            raise RuntimeError(f"Прогрев RAG не удался: {self.error}")
+
+    def wait(self, timeout: float = None) -> bool:
+        self._done.wait(timeout)
+        return self.ready
+
+    @contextmanager
+    def step(self, name: str):
+        self.current_step = name
+        started = time.perf_counter()
+        yield
+        ms = round((time.perf_counter() - started) * 1000, 1)
+        self.steps.append({"name": name, "ms": ms})
+        self.current_step = None
+        logger.info(f"Прогрев: {name} за {ms} мс")
+
+    def _run(self):
+        try:
+            self.fn(self.step)
+            self.status = "ready"
+            logger.info(f"RAG готов к работе за {time.time() - self.started_at:.1f} с")
+        except Exception as e:
+            self.status = "failed"
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception(f"Ошибка прогрева на шаге {self.current_step}")
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+
+    def require(self):
+        if self.status == "ready":
+            return
+        if self.status == "failed":
+            raise RuntimeError(f"RAG не загрузился: {self.error}")
+        raise NotReady(f"RAG загружается ({self.current_step or self.status})", self.retry_after)
+
+    def stats(self):
+        elapsed_until = self.finished_at or time.time()
+        return {
+            "status": self.status,
+            "current_step": self.current_step,
+            "steps": list(self.steps),
+            "error": self.error,
+            "seconds": round(elapsed_until - self.started_at, 1) if self.started_at else None,
+        }
@@ -164,6 +164,79 @@ const api = {
         };
     },
 
+    // Потоковый вариант sendMessage: ответ приходит по токенам через Server-Sent Events
+    async sendMessageStream({ chatId, text, files }, onEvent) {
+        getOrCreateUserId();
+        
+        const attachmentsPayload = files?.map(f => ({
+            name: f.name,
+            size: f.size,
+            type: f.type || 'unknown'
+        })) || [];
+
+        const response = await fetch(`${API_CONFIG.BASE_URL}/send_message_stream`, {
+            method: 'POST',
+            headers: API_CONFIG.HEADERS,
+            body: JSON.stringify({
+                chat_id: chatId,
+                message: text,
+                attachments: attachmentsPayload
+            })
+        });
+
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || 'Failed to send message');
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let data = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const raw = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let payload = '';
+                for (const line of raw.split('\n')) {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) payload += line.slice(5).trim();
+                }
+                const parsed = payload ? JSON.parse(payload) : {};
+
+                if (event === 'error') {
+                    throw new Error(parsed.error || 'Failed to send message');
+                }
+                if (event === 'cancelled') {
+                    throw new Error('Генерация гипотез отменена');
+                }
+                if (event === 'done') {
+                    data = parsed;
+                } else if (onEvent) {
+                    onEvent(event, parsed);
+                }
+            }
+        }
+
+        if (!data) {
+            throw new Error('Соединение прервано до завершения ответа');
+        }
+        return { 
+            text: data.bot_response.content,
+            messageId: data.bot_response.id,
+            mode: data.mode,
+            chat_title: data.chat_title
+        };
+    },
+
     async loadChatHistory() {
         getOrCreateUserId();
         
@@ -577,9 +650,32 @@ async function handleSend(e) {
     renderMessages(chatId);
 
     try {
-        const resp = await api.sendMessage({ chatId, text: savedText, files: savedFiles });
+        // Черновик ответа, который дописывается по мере прихода токенов
+        const draftId = 'temp_ai_' + Date.now();
+        let draft = null;
+        let draftStage = null;
+        const resp = await api.sendMessageStream({ chatId, text: savedText, files: savedFiles }, (event, data) => {
+            if (event !== 'token') return;
+            if (!draft) {
+                state.ui.typing = false;
+                draft = { id: draftId, sender: 'ai', text: '', ts: Date.now() };
+                pushMessage(chatId, draft);
+            }
+            // Критик переписывает черновые гипотезы — начинаем текст заново
+            if (data.stage && data.stage !== draftStage) {
+                draftStage = data.stage;
+                draft.text = '';
+            }
+            draft.text += data.text;
+            renderMessages(chatId);
+        });
         state.ui.typing = false;
         
+        if (draft) {
+            const messages = state.messages.get(chatId) || [];
+            state.messages.set(chatId, messages.filter(msg => msg.id !== draftId));
+        }
+        
         if (resp.mode) {
             state.chatMode = resp.mode;
         }